@@ -0,0 +1,41 @@
+"""Measure how batch sketching scales with the number of worker processes.
+
+Usage: python benchmarks/bench_batch.py [diagrams] [max points]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from greedy_sketch.batch import batch_greedy_sketch
+
+
+def synthetic_corpus(count, max_points, seed=0):
+    """Diagrams of uneven sizes, like one diagram per sample of a data set."""
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for size in rng.integers(max_points // 10, max_points, count):
+        births = rng.uniform(0, 100, size)
+        corpus.append(np.column_stack((births, births + rng.exponential(20, size))))
+    return corpus
+
+
+def main(count=400, max_points=2000):
+    corpus = synthetic_corpus(count, max_points)
+    cpus = os.cpu_count() or 1
+    workers = sorted({1, 2, 4, 8, 16, 32, cpus} & set(range(1, cpus + 1)))
+    print(f"{count} diagrams of up to {max_points} points, {cpus} cpus")
+    print(f"{'workers':>8} {'time':>9} {'speedup':>8}")
+    baseline = None
+    for w in workers:
+        start = time.perf_counter()
+        batch_greedy_sketch(corpus, workers=w)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{w:>8} {elapsed:>8.2f}s {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,39 @@
+"""Measure how the greedy sketch engines scale with diagram size.
+
+Usage: python benchmarks/bench_engines.py [size ...]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from greedy_sketch.sketch import naive_greedy_sketch
+
+
+def random_pd(size, seed=0):
+    rng = np.random.default_rng(seed)
+    births = rng.uniform(0, 100, size)
+    deaths = births + rng.exponential(20, size)
+    return np.column_stack((births, deaths))
+
+
+def main(sizes):
+    # The quadratic engines get too slow to be worth waiting for past these
+    limits = {"python": 10_000, "numpy": 100_000, "threaded": 100_000, "grid": 10**7}
+    print(f"{'size':>10} " + " ".join(f"{engine:>10}" for engine in limits))
+    for size in sizes:
+        pd = random_pd(size)
+        times = []
+        for engine, limit in limits.items():
+            if size > limit:
+                times.append(f"{'-':>10}")
+                continue
+            start = time.perf_counter()
+            naive_greedy_sketch(pd, engine=engine)
+            times.append(f"{time.perf_counter() - start:>9.2f}s")
+        print(f"{size:>10} " + " ".join(times))
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10**3, 10**4, 10**5])
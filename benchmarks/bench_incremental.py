@@ -0,0 +1,52 @@
+"""Compare updating an incremental greedy sketch with sketching from scratch.
+
+Usage: python benchmarks/bench_incremental.py [size] [inserted points] [persistence]
+
+Inserted points have exponentially distributed persistence with the given
+mean, 20 like the rest of the diagram by default. New features with little
+persistence only change the end of the greedy permutation.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from greedy_sketch.incremental import IncrementalGreedySketch
+from greedy_sketch.sketch import naive_greedy_sketch
+
+
+def random_pd(size, seed=0, persistence=20):
+    rng = np.random.default_rng(seed)
+    births = rng.uniform(0, 100, size)
+    deaths = births + rng.exponential(persistence, size)
+    return np.column_stack((births, deaths))
+
+
+def main(size=100_000, inserted=10, persistence=20, updates=5):
+    inc = IncrementalGreedySketch(random_pd(size))
+    print(
+        f"{size} points, inserting {inserted} points of persistence "
+        f"{persistence} {updates} times"
+    )
+    print(f"{'update':>8} {'reused':>8} {'insert':>9} {'remove':>9} {'scratch':>9}")
+    for seed in range(1, updates + 1):
+        new = random_pd(inserted, seed, persistence)
+        start = time.perf_counter()
+        inc.insert(new)
+        insert = time.perf_counter() - start
+        reused = inc.reused
+
+        start = time.perf_counter()
+        naive_greedy_sketch(inc.points, engine="grid")
+        scratch = time.perf_counter() - start
+
+        start = time.perf_counter()
+        inc.remove(new)
+        remove = time.perf_counter() - start
+        print(f"{seed:>8} {reused:>8} {insert:>8.2f}s {remove:>8.2f}s {scratch:>8.2f}s")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(*[int(arg) for arg in args[:2]], *[float(arg) for arg in args[2:3]])
@@ -0,0 +1,313 @@
+"""Benchmark every stage from sketching to serving, and check for regressions.
+
+Usage: python benchmarks/bench_suite.py [options]
+
+Times each stage on seeded synthetic persistence diagrams of every generator
+and size, then runs it again under `tracemalloc` for its peak memory, and
+writes the results as JSON. With `--baseline`, results are compared with a
+stored run, and the exit status is 1 when any stage got slower or bigger by
+more than the thresholds, which default to those stored in the baseline.
+
+    python benchmarks/bench_suite.py --max-size 1000000 --output results.json
+    python benchmarks/bench_suite.py --baseline benchmarks/baseline.json
+
+Stages only run up to the size they finish in reasonable time, see `STAGES`.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from greedy_sketch.sketch import (
+    compute_mult,
+    generate_sketches,
+    intersketch_bd,
+    naive_greedy_sketch,
+)
+
+SIZES = [10, 100, 1_000, 10_000, 100_000, 1_000_000]
+
+# Version of the JSON written, bump it when the layout changes
+FORMAT_VERSION = 1
+
+
+def uniform(size, rng):
+    """Births and persistence uniformly distributed."""
+    births = rng.uniform(0, 100, size)
+    return np.column_stack((births, births + rng.uniform(0, 50, size)))
+
+
+def clustered(size, rng):
+    """Points in a few tight clusters away from the diagonal."""
+    centers = uniform(10, rng)
+    pts = centers[rng.integers(0, len(centers), size)] + rng.normal(0, 1, (size, 2))
+    # Keep deaths after births
+    return np.column_stack((pts.min(axis=1), pts.max(axis=1)))
+
+
+def near_diagonal(size, rng):
+    """Mostly noise close to the diagonal, with a few persistent features."""
+    births = rng.uniform(0, 100, size)
+    persistence = np.where(
+        rng.random(size) < 0.05,
+        rng.exponential(20, size),
+        rng.exponential(0.5, size),
+    )
+    return np.column_stack((births, births + persistence))
+
+
+def duplicates(size, rng):
+    """Integer points from a small grid, so most points are repeated."""
+    births = rng.integers(0, 20, size)
+    return np.column_stack((births, births + rng.integers(0, 20, size))).astype(float)
+
+
+GENERATORS = {
+    "uniform": uniform,
+    "clustered": clustered,
+    "near_diagonal": near_diagonal,
+    "duplicates": duplicates,
+}
+
+
+# Each stage takes a diagram, prepares anything it needs, and returns the work
+# to measure
+
+
+def sketch_python(pd):
+    return lambda: naive_greedy_sketch(pd, dict_plans=False)
+
+
+def sketch_grid(pd):
+    return lambda: naive_greedy_sketch(pd, engine="grid", dict_plans=False)
+
+
+def sketch_full(pd):
+    return lambda: naive_greedy_sketch(
+        pd, minimal=False, engine="grid", dict_plans=False
+    )
+
+
+def generate(pd):
+    ret = naive_greedy_sketch(pd, engine="grid")
+    return lambda: generate_sketches(ret["perm"], ret["transport_plans"])
+
+
+def mult_dicts(pd):
+    plans = naive_greedy_sketch(pd, engine="grid")["transport_plans"]
+    return lambda: compute_mult(plans)
+
+
+def mult_flat(pd):
+    transport = naive_greedy_sketch(pd, engine="grid", dict_plans=False)["transport"]
+    return lambda: compute_mult(transport)
+
+
+def bottleneck(pd):
+    # Sketches of the diagram and of a shifted copy, of up to 100 points
+    n = min(100, len(pd))
+    a = naive_greedy_sketch(pd, n, engine="grid", dict_plans=False)
+    b = naive_greedy_sketch(pd + 1, n, engine="grid", dict_plans=False)
+    return lambda: intersketch_bd(a["transport"], b["transport"])
+
+
+def animation(pd, frames=10):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    from greedy_sketch import viz
+
+    result = naive_greedy_sketch(pd, minimal=False, engine="grid")
+
+    def draw():
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        anim = viz.make_greedy_sketch_animation(result, ax=fig.add_subplot())
+        anim._init_draw()
+        for frame in range(min(frames, len(result["perm"]))):
+            anim._draw_next_frame(frame, blit=False)
+
+    return draw
+
+
+def api_animate(pd):
+    # The diagram's points are used as the point cloud
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "website"))
+    import app
+    import cache
+
+    app.app.config["RENDER_WORKERS"] = 1
+    client = app.app.test_client()
+
+    def request():
+        # Nothing is cached between runs
+        app.results = cache.ResultCache(app.app.config["CACHE_MAX_BYTES"])
+        client.post("/api/animate", json=pd.tolist())
+
+    return request
+
+
+# Stage name, function and largest size it runs on
+STAGES = {
+    "sketch_python": (sketch_python, 1_000),
+    "sketch_grid": (sketch_grid, 1_000_000),
+    "sketch_full": (sketch_full, 100_000),
+    "generate_sketches": (generate, 10_000),
+    "compute_mult": (mult_dicts, 10_000),
+    "compute_mult_flat": (mult_flat, 1_000_000),
+    "intersketch_bd": (bottleneck, 100_000),
+    "animation": (animation, 10_000),
+    "api_animate": (api_animate, 100),
+}
+
+
+def measure(work, memory):
+    """Seconds taken by `work()`, and its peak traced memory when `memory`."""
+    start = time.perf_counter()
+    work()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        work()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def run(stages, generators, sizes, memory=True, seed=0):
+    """Measure every stage on every diagram, yielding a result for each."""
+    for size in sizes:
+        for generator in generators:
+            pd = GENERATORS[generator](size, np.random.default_rng(seed))
+            for stage in stages:
+                func, limit = STAGES[stage]
+                if size > limit:
+                    continue
+                seconds, peak = measure(func(pd), memory)
+                yield {
+                    "stage": stage,
+                    "generator": generator,
+                    "size": size,
+                    "seconds": seconds,
+                    "peak_bytes": peak,
+                }
+
+
+def compare(
+    results, baseline, time_threshold, memory_threshold, min_seconds, min_bytes
+):
+    """Results slower or bigger than the baseline by more than the thresholds.
+
+    Thresholds are relative, so 0.5 allows 50% more than the baseline. Times
+    under `min_seconds` and peaks under `min_bytes` in both runs are too noisy
+    to compare.
+    """
+    base = {(r["stage"], r["generator"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = base.get((result["stage"], result["generator"], result["size"]))
+        if old is None:
+            continue
+        seconds, old_seconds = result["seconds"], old["seconds"]
+        slower = seconds > old_seconds * (1 + time_threshold)
+        if slower and max(seconds, old_seconds) >= min_seconds:
+            regressions.append((result, old, "seconds"))
+        peak, old_peak = result["peak_bytes"], old["peak_bytes"]
+        if peak is None or old_peak is None:
+            continue
+        bigger = peak > old_peak * (1 + memory_threshold)
+        if bigger and max(peak, old_peak) >= min_bytes:
+            regressions.append((result, old, "peak_bytes"))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument(
+        "--generators", nargs="+", choices=GENERATORS, default=list(GENERATORS)
+    )
+    parser.add_argument("--max-size", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="skip the second run of every stage measuring peak memory",
+    )
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--baseline", help="results to compare with")
+    parser.add_argument("--time-threshold", type=float)
+    parser.add_argument("--memory-threshold", type=float)
+    parser.add_argument("--min-seconds", type=float)
+    parser.add_argument("--min-bytes", type=int)
+    args = parser.parse_args(argv)
+
+    sizes = [size for size in SIZES if size <= args.max_size]
+    results = []
+    print(f"{'stage':>18} {'generator':>14} {'size':>8} {'time':>9} {'peak':>10}")
+    for result in run(
+        args.stages, args.generators, sizes, not args.no_memory, args.seed
+    ):
+        peak = result["peak_bytes"]
+        peak = f"{peak / 2**10:>8.0f}KB" if peak is not None else f"{'-':>10}"
+        print(
+            f"{result['stage']:>18} {result['generator']:>14} {result['size']:>8} "
+            f"{result['seconds']:>8.3f}s {peak}"
+        )
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "version": FORMAT_VERSION,
+                    "seed": args.seed,
+                    "machine": {
+                        "python": platform.python_version(),
+                        "numpy": np.__version__,
+                        "platform": platform.platform(),
+                        "cpus": os.cpu_count(),
+                    },
+                    "results": results,
+                },
+                f,
+                indent=1,
+            )
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    thresholds = baseline.get("thresholds", {})
+    regressions = compare(
+        results,
+        baseline,
+        _first(args.time_threshold, thresholds.get("seconds"), 0.5),
+        _first(args.memory_threshold, thresholds.get("peak_bytes"), 0.25),
+        _first(args.min_seconds, thresholds.get("min_seconds"), 0.05),
+        _first(args.min_bytes, thresholds.get("min_bytes"), 2**18),
+    )
+    for result, old, key in regressions:
+        print(
+            f"REGRESSION {result['stage']} {result['generator']} {result['size']} "
+            f"{key}: {old[key]:.4g} -> {result[key]:.4g}"
+        )
+    return 1 if regressions else 0
+
+
+def _first(*values):
+    return next(value for value in values if value is not None)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
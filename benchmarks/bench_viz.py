@@ -0,0 +1,71 @@
+"""Frames per second of the greedy sketch animation by diagram size.
+
+Usage: python benchmarks/bench_viz.py [largest size] [frames]
+
+"update" only changes the artists for the next frame, "draw" also renders the
+frame with the Agg backend, redrawing everything or only the animated artists
+with blitting.
+"""
+
+import sys
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np  # noqa: E402
+from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: E402
+from matplotlib.figure import Figure  # noqa: E402
+
+from greedy_sketch import viz  # noqa: E402
+from greedy_sketch.sketch import naive_greedy_sketch  # noqa: E402
+
+
+def random_pd(size, seed=0):
+    rng = np.random.default_rng(seed)
+    births = rng.uniform(0, 100, size)
+    deaths = births + rng.exponential(20, size)
+    return np.column_stack((births, deaths))
+
+
+def fps(result, frames, blit, draw):
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    anim = viz.make_greedy_sketch_animation(result, ax=fig.add_subplot(), blit=blit)
+    # Draws the background and the first frame
+    fig.canvas.draw()
+    start = time.perf_counter()
+    for frame in range(frames):
+        if draw:
+            anim._draw_next_frame(frame, blit=blit)
+        else:
+            anim._func(frame)
+    return frames / (time.perf_counter() - start)
+
+
+def main(largest=100_000, frames=50):
+    print(f"{'size':>8} {'setup':>8} {'update':>9} {'draw':>9} {'blit':>9}")
+    size = 100
+    while size <= largest:
+        result = naive_greedy_sketch(random_pd(size), minimal=False, engine="grid")
+        n = min(frames, len(result["perm"]))
+        start = time.perf_counter()
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        anim = viz.make_greedy_sketch_animation(result, ax=fig.add_subplot())
+        setup = time.perf_counter() - start
+        # Only timing the setup, so skip the warning about never drawing it
+        anim._draw_was_started = True
+        update = fps(result, n, blit=False, draw=False)
+        draw = fps(result, n, blit=False, draw=True)
+        blit = fps(result, n, blit=True, draw=True)
+        print(
+            f"{size:>8} {setup:>7.2f}s {update:>5.0f}fps {draw:>5.1f}fps "
+            f"{blit:>5.1f}fps"
+        )
+        size *= 10
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
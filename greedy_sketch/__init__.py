@@ -1 +1,2 @@
-from greedy_sketch.sketch import DIAGONAL, naive_greedy_sketch
+from greedy_sketch.sketch import DIAGONAL, naive_greedy_sketch, resume_greedy_sketch
+from greedy_sketch.storage import load_sketch, save_sketch
@@ -0,0 +1,267 @@
+"""Functions for sketching and comparing many persistence diagrams at once."""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from greedy_sketch.sketch import (
+    naive_greedy_sketch,
+    sketch_bd,
+    sketch_points,
+    unique_points,
+)
+
+_TRANSPORT_KEYS = ["step", "source", "target", "count"]
+
+# Persistence diagrams of the batch, attached once per worker process
+_diagrams = None
+# Sketches being compared, sent once per worker process
+_sketches = None
+
+
+def batch_greedy_sketch(diagrams, n=-1, workers=None, engine="numpy", **kwargs):
+    """Generate greedy sketches of many persistence diagrams in parallel.
+
+    The diagrams are copied once into shared memory, which the workers read
+    without copying, and each result comes back through shared memory as
+    flat arrays. Larger diagrams are handed out first, so that one large
+    diagram doesn't hold up the end of the batch.
+
+    Parameters
+    ----------
+    diagrams : list of numpy.ndarray
+        Persistence diagrams, each a n by 2 array of points.
+    n : int, optional
+        The size of the largest greedy sketch to produce for each diagram.
+        Diagrams with fewer (distinct, with `collapse_duplicates=True`)
+        points get a full greedy permutation. By default every greedy
+        permutation is complete.
+    workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs. With one
+        worker, the diagrams are sketched in this process.
+    engine : str, default="numpy"
+        Engine to use, see `greedy_sketch.sketch.naive_greedy_sketch`.
+    **kwargs
+        Passed on to `greedy_sketch.sketch.naive_greedy_sketch`.
+
+    Returns
+    -------
+    list of dict
+        The result of `naive_greedy_sketch` with `minimal=True` and
+        `dict_plans=False` for every diagram, in the order of `diagrams`.
+    """
+    workers = workers or os.cpu_count() or 1
+    diagrams = [np.asarray(pd, dtype=float).reshape(-1, 2) for pd in diagrams]
+    kwargs = dict(kwargs, engine=engine, minimal=True, dict_plans=False)
+
+    if workers == 1 or len(diagrams) <= 1:
+        return [_greedy_sketch(pd, n, kwargs) for pd in diagrams]
+
+    bounds = np.cumsum([0] + [len(pd) for pd in diagrams])
+    shm = shared_memory.SharedMemory(create=True, size=max(1, bounds[-1] * 16))
+    try:
+        np.ndarray((bounds[-1], 2), buffer=shm.buf)[:] = np.concatenate(
+            diagrams + [np.empty((0, 2))]
+        )
+        results = [None] * len(diagrams)
+        # Longest first, since sketching time grows faster than linearly
+        order = sorted(range(len(diagrams)), key=lambda i: -len(diagrams[i]))
+        with ProcessPoolExecutor(
+            workers, initializer=_attach, initargs=(shm.name, bounds[-1])
+        ) as pool:
+            futures = [
+                pool.submit(_sketch, bounds[i], bounds[i + 1], n, kwargs) for i in order
+            ]
+            try:
+                for i, future in zip(order, futures):
+                    results[i] = _receive(*future.result())
+            except BaseException:
+                _discard(futures)
+                raise
+        return results
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _greedy_sketch(pd, n, kwargs):
+    """Sketch one diagram, capping `n` at the number of points available."""
+    if kwargs.get("collapse_duplicates"):
+        available = len(unique_points(pd)[0])
+    else:
+        available = len(pd)
+    return naive_greedy_sketch(pd, min(n, available) if n >= 0 else -1, **kwargs)
+
+
+def _attach(name, length):
+    global _diagrams
+    shm = shared_memory.SharedMemory(name=name)
+    _diagrams = (shm, np.ndarray((length, 2), buffer=shm.buf))
+
+
+def _sketch(start, stop, n, kwargs):
+    """Sketch one diagram of the batch in a worker.
+
+    Returns the name of a new shared memory block holding the result, along
+    with the lengths needed to read it back with `_receive`.
+    """
+    ret = _greedy_sketch(_diagrams[1][start:stop], n, kwargs)
+    perm = ret["perm"]
+    transport = np.array([ret["transport"][key] for key in _TRANSPORT_KEYS])
+    shm = shared_memory.SharedMemory(
+        create=True, size=max(1, perm.nbytes + transport.nbytes)
+    )
+    np.ndarray(perm.shape, buffer=shm.buf)[:] = perm
+    out = np.ndarray(transport.shape, dtype=int, buffer=shm.buf, offset=perm.nbytes)
+    out[:] = transport
+    del out
+    shm.close()
+    return shm.name, len(perm), transport.shape[1], ret["transport"]["size"]
+
+
+def _discard(futures):
+    """Free the shared memory of every result not yet received.
+
+    Cancels the futures which haven't started and waits for the rest.
+    """
+    for future in futures:
+        future.cancel()
+    for future in futures:
+        if future.cancelled() or future.exception() is not None:
+            continue
+        name = future.result()[0]
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            # Already received
+            continue
+        shm.close()
+        shm.unlink()
+
+
+def _receive(name, n, rows, size):
+    """Read a result written by `_sketch` and free its shared memory."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        perm = np.ndarray((n, 2), buffer=shm.buf).copy()
+        transport = np.ndarray(
+            (len(_TRANSPORT_KEYS), rows), dtype=int, buffer=shm.buf, offset=perm.nbytes
+        ).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    ret = {"perm": perm, "transport": dict(zip(_TRANSPORT_KEYS, transport))}
+    ret["transport"]["perm"] = perm
+    ret["transport"]["size"] = size
+    return ret
+
+
+def intersketch_bd_matrix(plans_list, k, workers=None, out=None, chunk_size=2048):
+    """Find the bottleneck distances between the greedy sketches of many diagrams.
+
+    Each sketch is built once up front as its distinct points and their
+    multiplicities, which is all `greedy_sketch.sketch.sketch_bd` needs to
+    compare two sketches, and the upper triangle of the
+    distance matrix is split into chunks of about `chunk_size` pairs which
+    are handed out to the workers. Finished chunks are written to the upper
+    triangle of `out` as they come in, a row at a time, and the lower
+    triangle is copied from it at the end in blocks of rows, so `out` can be
+    a memory-mapped file larger than memory.
+
+    Parameters
+    ----------
+    plans_list : list
+        Transportation plans of every persistence diagram, either as lists of
+        dicts or as flat arrays, see `greedy_sketch.sketch.intersketch_bd`.
+    k : int
+        Compare the `k` point greedy sketches of every diagram. Diagrams
+        with shorter greedy permutations use their last sketch.
+    workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs. With one
+        worker, the distances are computed in this process.
+    out : str or numpy.ndarray, optional
+        Where to write the distances. A string is the path of a `.npy` file to
+        create and memory-map. Defaults to a new array.
+    chunk_size : int, default=2048
+        Number of pairs of sketches per chunk of work.
+
+    Returns
+    -------
+    numpy.ndarray
+        The symmetric matrix of bottleneck distances, which is `out` if it
+        was given.
+    """
+    workers = workers or os.cpu_count() or 1
+    sketches = [sketch_points(plans, k) for plans in plans_list]
+    size = len(sketches)
+    if out is None:
+        out = np.zeros((size, size))
+    elif isinstance(out, str):
+        out = np.lib.format.open_memmap(out, mode="w+", shape=(size, size))
+    out[np.diag_indices(size)] = 0
+
+    # Split rows into chunks of at least chunk_size pairs, except for the
+    # last. Row i holds the pairs (i, j) for j > i.
+    chunks, start, pairs = [], 0, 0
+    for i in range(size):
+        pairs += size - 1 - i
+        if pairs >= chunk_size or i == size - 1:
+            chunks.append((start, i + 1))
+            start, pairs = i + 1, 0
+
+    def write(start, stop, dists):
+        for i, row in zip(range(start, stop), dists):
+            out[i, i + 1 :] = row
+
+    if workers == 1 or len(chunks) <= 1:
+        for start, stop in chunks:
+            write(start, stop, _bd_rows(start, stop, sketches))
+    else:
+        with ProcessPoolExecutor(
+            workers, initializer=_send_sketches, initargs=(sketches,)
+        ) as pool:
+            futures = [pool.submit(_bd_rows, start, stop) for start, stop in chunks]
+            for (start, stop), future in zip(chunks, futures):
+                write(start, stop, future.result())
+    _mirror_upper(out)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+def _send_sketches(sketches):
+    global _sketches
+    _sketches = sketches
+
+
+def _bd_rows(start, stop, sketches=None):
+    """Distances from sketches `start` to `stop` to every later sketch.
+
+    Uses the sketches sent to this worker by `_send_sketches` by default.
+    """
+    if sketches is None:
+        sketches = _sketches
+    return [
+        [sketch_bd(sketches[i], sketches[j]) for j in range(i + 1, len(sketches))]
+        for i in range(start, stop)
+    ]
+
+
+def _mirror_upper(out, block_bytes=2**26):
+    """Copy the upper triangle of a square matrix to its lower triangle.
+
+    Works on blocks of whole rows of about `block_bytes`, so a memory-mapped
+    `out` is read and written a few pages per row at a time instead of a
+    column at a time.
+    """
+    size = len(out)
+    rows = max(1, block_bytes // max(size * out.itemsize, 1))
+    for lo in range(0, size, rows):
+        hi = min(lo + rows, size)
+        block = np.array(out[lo:hi, :hi])
+        block[:, :lo] = out[:lo, lo:hi].T
+        square = block[:, lo:]
+        block[:, lo:] = np.triu(square) + np.triu(square, 1).T
+        out[lo:hi, :hi] = block
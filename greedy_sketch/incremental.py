@@ -0,0 +1,430 @@
+"""Greedy sketches of persistence diagrams which change over time."""
+
+from collections import defaultdict, deque
+
+import numpy as np
+
+from greedy_sketch.sketch import (
+    _ENGINES,
+    _RESUMABLE_ENGINES,
+    DIAGONAL,
+    VoronoiHistory,
+    _argmax_dist,
+    _finish_result,
+    _new_state,
+    _start_grid,
+    diagonal_dist,
+    greedy_order,
+)
+
+# Largest number of distances computed at once when placing new points
+_BLOCK = 2**20
+
+
+class IncrementalGreedySketch:
+    """Greedy permutation of a persistence diagram which points join and leave.
+
+    Keeps the full greedy permutation of the current diagram along with the
+    history of the Voronoi cells, and repairs it when points are inserted or
+    removed. Every step of the greedy permutation before the first one whose
+    choice of point changes is kept as is, and the greedy permutation is
+    carried on from there, like `greedy_sketch.sketch.resume_greedy_sketch`.
+
+    Points inserted close to the diagonal or to points already in the
+    diagram only change the end of the greedy permutation, so updating is
+    much cheaper than sketching the diagram again: on 100,000 random points,
+    inserting 10 points of persistence 0.01 takes 0.2s against 11.6s for the
+    grid engine from scratch (`benchmarks/bench_incremental.py`). Points
+    with as much persistence as the rest of the diagram change the greedy
+    permutation early, and save much less. The result is always the same as
+    `naive_greedy_sketch` on the current diagram.
+
+    Parameters
+    ----------
+    pd : numpy.ndarray, optional
+        A n by 2 array of finite points to start from.
+    engine : {"numpy", "grid"}, default="grid"
+        Engine used to carry on the greedy permutation, see
+        `greedy_sketch.sketch.naive_greedy_sketch`.
+
+    Attributes
+    ----------
+    points : numpy.ndarray
+        The current persistence diagram. Inserted points are appended, and
+        removed points dropped keeping the order of the rest.
+    order : numpy.ndarray
+        Index into `points` of every point of the greedy permutation.
+    dist : numpy.ndarray
+        Distance from every point of the greedy permutation to the sketch
+        before it, like "dist" of `naive_greedy_sketch`.
+    rnn : numpy.ndarray
+        Index into `order` of the nearest sketch point of every point, which
+        is the point itself once the greedy permutation is complete.
+    reused : int
+        Number of steps of the greedy permutation kept by the last update.
+    """
+
+    def __init__(self, pd=None, engine="grid"):
+        if engine not in _RESUMABLE_ENGINES:
+            raise ValueError(
+                f"Unknown engine {engine!r}, expected one of {sorted(_RESUMABLE_ENGINES)}"
+            )
+        self.engine = engine
+        self.points = np.empty((0, 2))
+        self.order = np.empty(0, dtype=int)
+        self.dist = np.empty(0)
+        self.rnn = np.empty(0, dtype=int)
+        self.reused = 0
+        # Voronoi history: in sketch `_step`, point `_point` moved to the cell
+        # of sketch point `_step - 1`
+        self._step = np.empty(0, dtype=int)
+        self._point = np.empty(0, dtype=int)
+        if pd is not None:
+            self.insert(pd)
+
+    def __len__(self):
+        return len(self.points)
+
+    def insert(self, points):
+        """Add points to the persistence diagram.
+
+        Parameters
+        ----------
+        points : numpy.ndarray
+            A m by 2 array of finite points.
+        """
+        new = np.asarray(points, dtype=float).reshape(-1, 2)
+        if not np.isfinite(new).all():
+            raise ValueError(
+                "Persistence diagram has non-finite points, drop them before sketching"
+            )
+        first = len(self.points)
+        start, step, point = _place(self.points, self.order, self.dist, new)
+        keep = self._step <= start
+        self.points = np.concatenate((self.points, new))
+        self._repair(
+            start,
+            np.concatenate((self._step[keep], step)),
+            np.concatenate((self._point[keep], point + first)),
+        )
+
+    def remove(self, points):
+        """Remove points from the persistence diagram.
+
+        Each row of `points` removes one point of the diagram with the same
+        coordinates, the one inserted last.
+
+        Parameters
+        ----------
+        points : numpy.ndarray
+            A m by 2 array of points of the persistence diagram.
+        """
+        gone = np.zeros(len(self.points), dtype=bool)
+        for x in np.asarray(points, dtype=float).reshape(-1, 2):
+            matches = np.flatnonzero((self.points == x).all(axis=1) & ~gone)
+            if not len(matches):
+                raise ValueError(f"Point {tuple(x)} is not in the persistence diagram")
+            gone[matches[-1]] = True
+
+        # Nothing changes before the first removed point of the greedy
+        # permutation, and the greedy permutation gets shorter
+        chosen = np.flatnonzero(gone[self.order])
+        start = min(chosen[0] if len(chosen) else len(self.order), (~gone).sum())
+        index = np.cumsum(~gone) - 1
+        keep = (self._step <= start) & ~gone[self._point]
+        self.points = self.points[~gone]
+        self.order = index[self.order[:start]]
+        self._repair(start, self._step[keep], index[self._point[keep]])
+
+    def _repair(self, start, step, point):
+        """Recompute the greedy permutation from step `start`."""
+        self.order, self.dist, self.rnn, self._step, self._point = _finish_from(
+            self.points, self.order, self.dist, start, step, point, self.engine
+        )
+        self.reused = start
+
+    def result(self, dict_plans=False, snapshot_every="auto"):
+        """The greedy sketch of the current persistence diagram.
+
+        Returns
+        -------
+        dict
+            The same as `naive_greedy_sketch(self.points, minimal=False)`.
+        """
+        return _history_result(
+            self.points,
+            self.order,
+            self.dist,
+            self._step,
+            self._point,
+            dict_plans,
+            snapshot_every,
+        )
+
+
+def warm_greedy_sketch(
+    pd, previous, matching=None, engine="grid", dict_plans=False, snapshot_every="auto"
+):
+    """Sketch a persistence diagram reusing the greedy permutation of a similar one.
+
+    Meant for sequences of diagrams which change a little from one to the
+    next, like those of consecutive time windows (a vineyard). The greedy
+    permutation of `previous` is taken as the candidate order of the points
+    of `pd` which it shares. Candidates are accepted for as long as none of
+    the other points of `pd` is further from the sketch, which only needs
+    the distances from those points to the accepted sketch points, and the
+    greedy permutation is carried on from the first rejected candidate.
+
+    Only points with exactly the same coordinates can be reused, since any
+    move changes the distances the greedy permutation depends on. Points
+    matched to a point which moved count as new.
+
+    Parameters
+    ----------
+    pd : numpy.ndarray
+        A n by 2 array of finite points in the persistence diagram.
+    previous : dict
+        The result of `naive_greedy_sketch` with `minimal=False`, or of this
+        function, on the previous diagram.
+    matching : numpy.ndarray, optional
+        Index of the corresponding point of the previous diagram for every
+        point of `pd`, or -1 for new points. Defaults to matching points with
+        the same coordinates, in order.
+    engine : {"numpy", "grid"}, default="grid"
+        Engine used to carry on the greedy permutation, see
+        `greedy_sketch.sketch.naive_greedy_sketch`.
+    dict_plans, snapshot_every : optional
+        See `greedy_sketch.sketch.naive_greedy_sketch`.
+
+    Returns
+    -------
+    dict
+        The same as `naive_greedy_sketch(pd, minimal=False)`, plus
+
+        "reused": The number of steps of the greedy permutation of `previous`
+        which were kept.
+    """
+    if engine not in _RESUMABLE_ENGINES:
+        raise ValueError(
+            f"Unknown engine {engine!r}, expected one of {sorted(_RESUMABLE_ENGINES)}"
+        )
+    pts = np.asarray(pd, dtype=float).reshape(-1, 2)
+    if not np.isfinite(pts).all():
+        raise ValueError(
+            "Persistence diagram has non-finite points, drop them before sketching"
+        )
+    old_pts = np.asarray(previous["persistence_diagram"], dtype=float).reshape(-1, 2)
+    if matching is None:
+        matching = _match_equal(pts, old_pts)
+    matching = np.asarray(matching, dtype=int)
+    if len(matching) != len(pts):
+        raise ValueError("Matching needs one entry for every point of the diagram")
+
+    # Reuse unchanged points whose order agrees with the previous diagram, so
+    # that ties still resolve to the same point
+    matched = matching >= 0
+    same = np.zeros(len(pts), dtype=bool)
+    same[matched] = (pts[matched] == old_pts[matching[matched]]).all(axis=1)
+    old = np.where(same, matching, -1)
+    running = np.maximum.accumulate(np.concatenate(([-1], old)))[:-1]
+    old[old <= running] = -1
+    index = np.full(len(old_pts), -1)
+    index[old[old >= 0]] = np.flatnonzero(old >= 0)
+
+    # Candidate order, up to the first point of the previous greedy
+    # permutation which isn't reused
+    old_order = greedy_order(previous)
+    candidates = index[old_order]
+    missing = np.flatnonzero(candidates < 0)
+    candidates = candidates[: missing[0] if len(missing) else len(candidates)]
+    new = np.flatnonzero(old < 0)
+    start, step, point = _place(
+        pts, candidates, previous["dist"][: len(candidates), 0], pts[new], new
+    )
+    start = min(start, len(pts))
+
+    history = previous["voronoi"]
+    keep = (history.step <= start) & (index[history.point] >= 0)
+    order, dist, _, step, point = _finish_from(
+        pts,
+        candidates,
+        previous["dist"][:, 0],
+        start,
+        np.concatenate((history.step[keep], step)),
+        np.concatenate((index[history.point[keep]], new[point])),
+        engine,
+    )
+    ret = _history_result(pts, order, dist, step, point, dict_plans, snapshot_every)
+    ret["persistence_diagram"] = pd
+    ret["reused"] = start
+    return ret
+
+
+def _match_equal(pts, old_pts):
+    """Index of a point of `old_pts` with the same coordinates as every point of `pts`.
+
+    Repeated points are matched in order, and points without a match get -1.
+    """
+    unmatched = defaultdict(deque)
+    for j, x in enumerate(map(tuple, old_pts.tolist())):
+        unmatched[x].append(j)
+    return np.array(
+        [
+            unmatched[x].popleft() if unmatched[x] else -1
+            for x in map(tuple, pts.tolist())
+        ],
+        dtype=int,
+    )
+
+
+def _place(pts, order, dist, new, new_index=None):
+    """Find where new points join the greedy permutation `order` of `pts`.
+
+    Follows the new points through the greedy permutation until the first
+    step where one of them is further from the sketch than the point the
+    greedy permutation picked, or as far with a smaller index, which is the
+    first step to recompute.
+
+    Parameters
+    ----------
+    pts : numpy.ndarray
+        The points of the persistence diagram.
+    order : numpy.ndarray
+        Index into `pts` of every point picked so far.
+    dist : numpy.ndarray
+        Distance of every point of `order` to the sketch before it.
+    new : numpy.ndarray
+        The new points.
+    new_index : numpy.ndarray, optional
+        Index of the new points, to break ties with. By default they come
+        after all points of `order`.
+
+    Returns
+    -------
+    start : int
+        The first step whose choice of point changes.
+    step, point : numpy.ndarray
+        The Voronoi history of the new points up to sketch `start`, with
+        points as indices into `new`.
+    """
+    # distance of every new point to the sketch before the current step
+    nearest = diagonal_dist(new)
+    rows = max(1, _BLOCK // max(len(new), 1))
+    steps, points = [], []
+    for lo in range(0, len(order), rows):
+        chosen = order[lo : lo + rows]
+        centers = pts[chosen]
+        dists = np.maximum(
+            np.abs(new[None, :, 0] - centers[:, None, 0]),
+            np.abs(new[None, :, 1] - centers[:, None, 1]),
+        )
+        before = np.minimum.accumulate(np.vstack((nearest, dists)))[:-1]
+        picked = dist[lo : lo + rows, None]
+        wins = before > picked
+        if new_index is not None:
+            # Except at distance 0, where the point picked before is kept
+            ties = (before == picked) & (picked > 0)
+            wins |= ties & (new_index[None, :] < chosen[:, None])
+        changed = np.flatnonzero(wins.any(axis=1))
+        end = changed[0] if len(changed) else len(centers)
+        step, point = np.nonzero(dists[:end] < before[:end])
+        steps.append(step + lo + 1)
+        points.append(point)
+        if len(changed):
+            return lo + end, np.concatenate(steps), np.concatenate(points)
+        nearest = np.minimum(before[-1], dists[-1])
+    empty = [np.empty(0, dtype=int)]
+    return len(order), np.concatenate(steps + empty), np.concatenate(points + empty)
+
+
+def _finish_from(pts, order, dist, start, step, point, engine):
+    """Carry on the greedy permutation of `pts` from step `start`.
+
+    `order` and `dist` hold at least the first `start` steps of the greedy
+    permutation, and `step` and `point` the Voronoi history of all points up
+    to sketch `start`.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The complete `order`, `dist`, nearest neighbors and Voronoi history
+        `step` and `point`.
+    """
+    by_step = np.argsort(step, kind="stable")
+    step, point = step[by_step].astype(int), point[by_step].astype(int)
+
+    state = _new_state(pts, False, None)
+    state["step"] = start
+    state["order"][:start] = order[:start]
+    state["perm"][:start] = pts[order[:start]]
+    state["dist_seq"][:start, 0] = dist[:start]
+    # Points only ever move to newer sketch points
+    np.maximum.at(state["rnn"], point, step - 1)
+    rnn = state["rnn"]
+    centers = np.vstack((state["perm"][:start], [DIAGONAL]))[rnn]
+    state["dist"] = np.where(
+        rnn < 0,
+        state["dist"],
+        np.maximum(
+            np.abs(pts[:, 1] - centers[:, 1]), np.abs(pts[:, 0] - centers[:, 0])
+        ),
+    )
+    furthest = order[start - 1] if start else 0
+    if engine == "grid":
+        state["furthest"] = furthest
+        _start_grid(state)
+    else:
+        state["furthest"], state["max_dist"] = _argmax_dist(state["dist"], furthest)
+
+    _ENGINES[engine](pts, len(pts), False, None, None, state)
+
+    moved = state["voronoi_changes"]
+    lengths = [len(m) for m in moved]
+    step = np.concatenate(
+        (step, np.repeat(np.arange(start + 1, len(pts) + 1), lengths))
+    )
+    point = np.concatenate([point] + moved)
+    return state["order"], state["dist_seq"][:, 0], state["rnn"], step, point
+
+
+def _history_result(pts, order, dist, step, point, dict_plans, snapshot_every):
+    """The result of `naive_greedy_sketch` with `minimal=False` from a Voronoi history."""
+    perm = pts[order]
+    ret = {
+        "perm": perm,
+        "transport": _transport(perm, len(pts), step, point),
+        "dist": dist[:, None],
+        "voronoi": VoronoiHistory(perm, len(pts), step, point, step - 1),
+    }
+    return _finish_result(
+        ret,
+        {
+            "persistence_diagram": pts,
+            "minimal": False,
+            "dict_plans": dict_plans,
+            "inverse": None,
+            "snapshot_every": snapshot_every,
+        },
+    )
+
+
+def _transport(perm, size, step, point):
+    """Flat transportation plans built from a Voronoi history."""
+    # Each move takes a point from the cell it moved to last, or from the
+    # diagonal the first time
+    by_point = np.lexsort((step, point))
+    step, point = step[by_point], point[by_point]
+    source = np.full(len(step), -1)
+    same = point[1:] == point[:-1]
+    source[1:][same] = step[:-1][same] - 1
+    key = step * (len(perm) + 1) + source + 1
+    key, count = np.unique(key, return_counts=True)
+    step = key // (len(perm) + 1)
+    return {
+        "step": step,
+        "source": key % (len(perm) + 1) - 1,
+        "target": step - 1,
+        "count": count,
+        "perm": perm,
+        "size": size,
+    }
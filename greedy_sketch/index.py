@@ -0,0 +1,227 @@
+"""Nearest neighbor search over many persistence diagrams using their sketches."""
+
+import bisect
+
+import numpy as np
+import persim
+
+from greedy_sketch.sketch import (
+    naive_greedy_sketch,
+    resume_greedy_sketch,
+    sketch_bd,
+    sketch_points,
+)
+
+# Version of the file layout written by `SketchIndex.save`
+_FORMAT_VERSION = 1
+
+
+class SketchIndex:
+    """Index of persistence diagrams for bottleneck distance queries.
+
+    The k point greedy sketch of a diagram is within its greedy radius `r_k`
+    of the diagram (the next value of "dist" of `naive_greedy_sketch`), so by
+    the triangle inequality the bottleneck distance between two diagrams is
+    within `r_k + s_k` of the distance between their k point sketches. The
+    index stores sketches of every diagram at a few increasing sizes and
+    answers queries by comparing sketches first, dropping diagrams whose
+    lower bound rules them out and refining the rest with larger sketches.
+    Exact distances are only computed for the diagrams left at the end.
+
+    Parameters
+    ----------
+    diagrams : list of numpy.ndarray
+        Persistence diagrams, each a n by 2 array of finite points.
+    levels : tuple of int, default=(8, 32, 128)
+        Sizes of the sketches to compare, from coarsest to finest.
+    exact : callable, default=persim.bottleneck
+        Exact bottleneck distance between two persistence diagrams.
+
+    Attributes
+    ----------
+    evaluated : int
+        Number of exact distances computed by all queries so far.
+    avoided : int
+        Number of exact distances the queries so far didn't need to compute,
+        compared with computing the distance to every diagram.
+    """
+
+    def __init__(self, diagrams, levels=(8, 32, 128), exact=persim.bottleneck):
+        self.levels = sorted(levels)
+        self.exact = exact
+        self.diagrams = [np.asarray(pd, dtype=float).reshape(-1, 2) for pd in diagrams]
+        self.sketches, self.radii = [], []
+        for pd in self.diagrams:
+            sketches, radii = _sketch_levels(pd, self.levels)
+            self.sketches.append(sketches)
+            self.radii.append(radii)
+        # radii[i, l] is the greedy radius of diagram i at level l
+        self.radii = np.array(self.radii).reshape(len(self.diagrams), len(self.levels))
+        self.evaluated = 0
+        self.avoided = 0
+
+    def __len__(self):
+        return len(self.diagrams)
+
+    def nearest(self, pd, k=1):
+        """Find the `k` diagrams closest to `pd` in bottleneck distance.
+
+        Returns
+        -------
+        indices : numpy.ndarray
+            Indices of the closest diagrams, closest first.
+        distances : numpy.ndarray
+            Their bottleneck distances to `pd`.
+        """
+        pd = np.asarray(pd, dtype=float).reshape(-1, 2)
+        k = min(k, len(self))
+
+        def cutoff(upper):
+            # Some k diagrams are at most this far away
+            return np.partition(upper, k - 1)[k - 1] if k else -np.inf
+
+        candidates, lower, upper = self._refine(pd, cutoff)
+        # Exact distances in order of their lower bounds, until the next lower
+        # bound is further than the kth closest diagram found
+        found = []
+        for i in np.argsort(lower, kind="stable"):
+            if len(found) >= k and lower[i] > found[k - 1][0]:
+                break
+            bisect.insort(found, (self._exact(pd, candidates[i]), candidates[i]))
+        self.avoided += len(self) - len(found)
+        found = found[:k]
+        return (
+            np.array([i for _, i in found], dtype=int),
+            np.array([d for d, _ in found], dtype=float),
+        )
+
+    def within(self, pd, radius):
+        """Find every diagram within bottleneck distance `radius` of `pd`.
+
+        Diagrams whose upper bound is within `radius` are taken without
+        computing their exact distance.
+
+        Returns
+        -------
+        numpy.ndarray
+            Indices of the diagrams within `radius`, in increasing order.
+        """
+        pd = np.asarray(pd, dtype=float).reshape(-1, 2)
+        candidates, lower, upper = self._refine(pd, lambda upper: radius)
+        inside = list(candidates[upper <= radius])
+        unsure = candidates[upper > radius]
+        for i in unsure:
+            if self._exact(pd, i) <= radius:
+                inside.append(i)
+        self.avoided += len(self) - len(unsure)
+        return np.array(sorted(inside), dtype=int)
+
+    def save(self, path):
+        """Write the index to a `.npz` file, see `SketchIndex.load`.
+
+        The exact distance function isn't saved.
+        """
+        arrays = {
+            "version": np.array(_FORMAT_VERSION),
+            "levels": np.array(self.levels, dtype=int),
+            "radii": self.radii,
+            "counts": np.array([self.evaluated, self.avoided]),
+        }
+        arrays.update(_pack("diagram", self.diagrams))
+        for level in range(len(self.levels)):
+            sketches = [sketches[level] for sketches in self.sketches]
+            arrays.update(_pack(f"points{level}", [points for points, _ in sketches]))
+            arrays.update(_pack(f"mult{level}", [mult for _, mult in sketches]))
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path, exact=persim.bottleneck):
+        """Read an index written by `SketchIndex.save`."""
+        with np.load(path) as arrays:
+            if int(arrays["version"]) != _FORMAT_VERSION:
+                raise ValueError(
+                    f"Unsupported sketch index version {int(arrays['version'])}"
+                )
+            index = cls.__new__(cls)
+            index.levels = arrays["levels"].tolist()
+            index.exact = exact
+            index.radii = arrays["radii"]
+            index.evaluated, index.avoided = arrays["counts"].tolist()
+            index.diagrams = _unpack(arrays, "diagram")
+            levels = [
+                zip(_unpack(arrays, f"points{level}"), _unpack(arrays, f"mult{level}"))
+                for level in range(len(index.levels))
+            ]
+            index.sketches = [list(sketches) for sketches in zip(*levels)]
+        return index
+
+    def _refine(self, pd, cutoff):
+        """Narrow down the diagrams to compare `pd` with exactly.
+
+        At each level, diagrams whose lower bound is above `cutoff(upper)`
+        are dropped, where `upper` holds the upper bounds of the diagrams
+        left.
+
+        Returns
+        -------
+        candidates : numpy.ndarray
+            Indices of the diagrams left.
+        lower, upper : numpy.ndarray
+            Bounds on their distances to `pd` from the finest sketches.
+        """
+        sketches, radii = _sketch_levels(pd, self.levels)
+        candidates = np.arange(len(self))
+        lower = np.zeros(len(self))
+        upper = np.full(len(self), np.inf)
+        for level, (sketch, radius) in enumerate(zip(sketches, radii)):
+            if not len(candidates):
+                break
+            approx = np.array(
+                [sketch_bd(sketch, self.sketches[i][level]) for i in candidates]
+            )
+            slack = radius + self.radii[candidates, level]
+            # Keep the tightest bounds seen so far
+            lower = np.maximum(lower, approx - slack)
+            upper = np.minimum(upper, approx + slack)
+            keep = lower <= cutoff(upper)
+            candidates, lower, upper = candidates[keep], lower[keep], upper[keep]
+        return candidates, lower, upper
+
+    def _exact(self, pd, i):
+        self.evaluated += 1
+        return float(self.exact(pd, self.diagrams[i]))
+
+
+def _sketch_levels(pd, levels):
+    """Greedy sketches of `pd` of every size in `levels` and their radii."""
+    sketches, radii = [], []
+    # Keep what's needed to resume up to every level but the last
+    ret = naive_greedy_sketch(
+        pd,
+        min(levels[0], len(pd)),
+        engine="grid",
+        dict_plans=False,
+        resumable=len(levels) > 1,
+    )
+    for level, k in enumerate(levels):
+        k = min(k, len(pd))
+        if len(ret["perm"]) < k:
+            ret = resume_greedy_sketch(ret, k, resumable=level < len(levels) - 1)
+        sketches.append(sketch_points(ret["transport"], k))
+        radii.append(ret["radius"])
+    return sketches, radii
+
+
+def _pack(name, arrays):
+    """Concatenate arrays of different lengths for `np.savez`."""
+    lengths = [len(array) for array in arrays]
+    return {
+        name: np.concatenate(arrays) if arrays else np.empty(0),
+        f"{name}_offsets": np.cumsum([0] + lengths),
+    }
+
+
+def _unpack(arrays, name):
+    """Inverse of `_pack`."""
+    data, offsets = arrays[name], arrays[f"{name}_offsets"]
+    return [data[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
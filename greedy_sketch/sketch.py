@@ -1,13 +1,20 @@
-from collections import defaultdict
+import heapq
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-import persim
 
 X, Y = 0, 1
 
 # point (0,0) is the diagonal
 DIAGONAL = (0, 0)
 
+# Points per chunk of the "threaded" engine, so that a chunk's points,
+# distances and nearest neighbors stay in a core's cache
+THREAD_CHUNK = 2**15
+
 
 def diagonal_point(x):
     """Get point closest to x on diagonal."""
@@ -19,29 +26,125 @@ def l_inf(x1, x2):
     return max(abs(x1[Y] - x2[Y]), abs(x1[X] - x2[X]))
 
 
-def naive_greedy_sketch(pd, n=-1, minimal=True):
+def diagonal_dist(pts):
+    """Compute l-infinity distance of every point in `pts` to the diagonal."""
+    mid = (pts[:, X] + pts[:, Y]) / 2
+    return np.maximum(np.abs(pts[:, Y] - mid), np.abs(pts[:, X] - mid))
+
+
+def l_inf_many(pts, x):
+    """Compute l-infinity distance of every point in `pts` to the point `x`."""
+    return np.maximum(np.abs(pts[:, Y] - x[Y]), np.abs(pts[:, X] - x[X]))
+
+
+def naive_greedy_sketch(
+    pd,
+    n=-1,
+    minimal=True,
+    engine="python",
+    dict_plans=True,
+    collapse_duplicates=False,
+    snapshot_every="auto",
+    tolerance=None,
+    time_budget=None,
+    max_points=None,
+    progress=None,
+    resumable=False,
+):
     """Generate greedy permutation and sketches of points in persistence diagram.
 
-    Runs in O(n^2).
+    The "python", "numpy" and "threaded" engines run in O(n^2). The "grid" engine only
+    visits points which can move to the new sketch point, which in practice
+    scales close to linearly. Measured on a single core with
+    `python benchmarks/bench_engines.py 1000 10000 100000 1000000` on random
+    diagrams (full permutation, `minimal=True`):
+
+    =========  ========  ========  ========  ========
+    points     python    numpy     threaded  grid
+    =========  ========  ========  ========  ========
+    1,000      1.6s      0.07s     0.08s     0.14s
+    10,000     166s      0.51s     0.55s     0.58s
+    100,000              106s      54s       11s
+    1,000,000                                143s
+    =========  ========  ========  ========  ========
 
     Parameters
     ----------
     pd : numpy.ndarray
-        A n by 2 array of points in the persistence diagram.
+        A n by 2 array of points in the persistence diagram. All points must
+        be finite, so drop points with infinite death first, e.g. with
+        `pd[np.isfinite(pd).all(axis=1)]`.
     n : int, optional
         The size of the largest greedy sketch to produce. By default this is
         all points of the persistence diagrams.
     minimal : bool, default=False
         Whether to include extra information, detailed in the "Returns".
+    engine : {"python", "numpy", "grid", "threaded"}, default="python"
+        How to compute the greedy permutation. "python" visits every point
+        one at a time. "numpy" keeps the nearest neighbors as indices into the
+        greedy permutation and updates all points with whole-array
+        operations, which is much faster for large diagrams. "grid"
+        additionally buckets the points so each step only updates points
+        close enough to the new sketch point to move. "threaded" splits the
+        work of the numpy engine into chunks updated in parallel threads, for
+        single large diagrams on machines with many cores. All engines give
+        identical results.
+    dict_plans : bool, default=True
+        Whether to also return "transport_plans", the transport plans as
+        dicts keyed by points. Turn this off for large diagrams, "transport"
+        holds the same information in a fraction of the memory.
+    collapse_duplicates : bool, default=False
+        Whether to merge repeated points of `pd` into one point weighted by
+        how often it occurs before computing the greedy permutation, see
+        `unique_points`. The greedy permutation then holds every distinct
+        point once, so `n` is at most the number of distinct points, while
+        multiplicities and Voronoi cells still count every point of `pd`.
+    snapshot_every : int or "auto", default="auto"
+        With `minimal=False`, store the full Voronoi cells of every
+        `snapshot_every`th sketch in "voronoi", see `VoronoiHistory`. "auto"
+        picks the spacing so the snapshots take about as much memory as the
+        recorded changes. `None` stores no snapshots.
+    tolerance : float, optional
+        Stop at the smallest sketch within `tolerance` of the persistence
+        diagram, i.e. once the distance from every point to the sketch (the
+        next value of "dist") is at most `tolerance`. The bottleneck distance
+        between the diagram and that sketch is at most `tolerance` too.
+        Needs the "numpy", "grid" or "threaded" engine.
+    time_budget : float, optional
+        Stop once this many seconds have been spent on the greedy permutation.
+        At least one point is added before the clock is checked. Needs the
+        "numpy", "grid" or "threaded" engine.
+    max_points : int, optional
+        Stop once this many points have been added to the greedy permutation.
+        Unlike `n`, this counts from where a resumed sketch left off, see
+        `resume_greedy_sketch`. Needs the "numpy", "grid" or "threaded"
+        engine.
+    progress : callable, optional
+        Called as `progress(step, reassigned, elapsed)` after each point is
+        added to the greedy permutation, with the number of points in the
+        greedy permutation so far, the number of points which moved to the
+        Voronoi cell of the new point (distinct points with
+        `collapse_duplicates=True`), and the seconds spent so far. Nothing is
+        timed when it's None.
+    resumable : bool, default=False
+        Whether to keep the "state" of a greedy permutation cut short by `n`,
+        so that `resume_greedy_sketch` can extend it. It takes memory linear
+        in the size of `pd`, so by default only permutations stopped by a
+        stopping criterion keep it. Needs the "numpy", "grid" or "threaded"
+        engine.
 
     Returns
     -------
     dict
         "perm": The points ordered in the order of the greedy permutation.
 
-        "transport_plans": The changes of the mass of points over successive
-        sketches. Taking the sum up to some sketch will give you the
-        multiplicity of each point.
+        "transport": The changes of the mass of points over successive
+        sketches as flat arrays, see `transport_from_plans`. Taking the sum up
+        to some sketch will give you the multiplicity of each point, see
+        `compute_mult`.
+
+        "transport_plans" (when `dict_plans=True`): The same changes as a list
+        of dicts, one per sketch, mapping points to their change in mass.
 
         "dist" (when `minimal=False`): A list of distances between each point
         in the original persistence diagram and the greedy sketch. The first
@@ -50,21 +153,214 @@ def naive_greedy_sketch(pd, n=-1, minimal=True):
         persistence diagram (`pd`) and the greedy sketch. Distance is
         determined by the `l_inf` metric.
 
-        "voronoi" (when `minimal=False`): A list of the discrete Voronoi cells
-        for each sketch. The first index `i` is the `i`th greedy sketch to look
-        at and the second index `j` is the point in the greedy sketch which the
-        `j`th point in the original persistence diagram maps to.
+        "voronoi" (when `minimal=False`): A `VoronoiHistory` of the discrete
+        Voronoi cells for each sketch. The first index `i` is the `i`th greedy
+        sketch to look at and the second index `j` is the point in the greedy
+        sketch which the `j`th point in the original persistence diagram maps
+        to.
+
+        "sketches" (when `minimal=False`): A `SketchSequence` of full
+        descriptions of each greedy sketch.
 
-        "sketches" (when `minimal=False`): A list of full descriptions of each
-        greedy sketch.
+        "stopped" (with every engine but "python"): Why the greedy
+        permutation ended, one of "n" (it reached `n` points), "tolerance",
+        "time_budget" or "max_points".
+
+        "radius" (with every engine but "python"): The distance from
+        the furthest point of `pd` to the last sketch.
+
+        "state" (when a stopping criterion ended the greedy permutation, or it
+        stopped at `n` with `resumable=True`): What `resume_greedy_sketch`
+        needs to carry on.
     """
 
     if n > len(pd):
         raise ValueError(
             "Length of greedy permutation greater than number of points in persistence diagram"
         )
+    if engine not in _ENGINES:
+        raise ValueError(
+            f"Unknown engine {engine!r}, expected one of {sorted(_ENGINES)}"
+        )
+    stopping = (tolerance, time_budget, max_points)
+    if engine not in _RESUMABLE_ENGINES and (
+        stopping != (None, None, None) or resumable
+    ):
+        raise ValueError(
+            f"Stopping criteria and resumable=True need one of the engines {sorted(_RESUMABLE_ENGINES)}"
+        )
+    if len(pd) and not np.isfinite(np.asarray(pd, dtype=float)).all():
+        # The engines would disagree on infinite distances, so don't guess
+        raise ValueError(
+            "Persistence diagram has non-finite points, drop them before sketching"
+        )
+
+    if collapse_duplicates:
+        pts, weights, inverse = unique_points(pd)
+        if n > len(pts):
+            raise ValueError(
+                "Length of greedy permutation greater than number of distinct points in persistence diagram"
+            )
+    else:
+        pts, weights = pd, None
     if n < 0:
-        n = len(pd)
+        n = len(pts)
+
+    options = {
+        "persistence_diagram": pd,
+        "minimal": minimal,
+        "engine": engine,
+        "dict_plans": dict_plans,
+        "inverse": inverse if collapse_duplicates else None,
+        "snapshot_every": snapshot_every,
+        "resumable": resumable,
+    }
+    if engine in _RESUMABLE_ENGINES:
+        stop = _stopping_rule(0, tolerance, time_budget, max_points)
+        ret = _ENGINES[engine](pts, n, minimal, weights, stop, progress=progress)
+    else:
+        ret = _ENGINES[engine](pts, n, minimal, weights, progress=progress)
+    return _finish_result(ret, options)
+
+
+def resume_greedy_sketch(
+    result,
+    n=-1,
+    tolerance=None,
+    time_budget=None,
+    max_points=None,
+    progress=None,
+    resumable=False,
+):
+    """Extend a greedy permutation which stopped early.
+
+    Carries on from where `naive_greedy_sketch` (or a previous call to this
+    function) stopped, without recomputing the points already found, and
+    returns the same result as if the longer greedy permutation had been
+    computed in one go. `result` itself is left as is, so it can be resumed
+    more than once.
+
+    Parameters
+    ----------
+    result : dict
+        A result of `naive_greedy_sketch` or `resume_greedy_sketch` with a
+        "state", i.e. whose greedy permutation stopped early or was computed
+        with `resumable=True`.
+    n : int, optional
+        The size of the largest greedy sketch to produce. By default the
+        greedy permutation is completed.
+    tolerance, time_budget, max_points : optional
+        Stopping criteria, see `naive_greedy_sketch`. `time_budget` and
+        `max_points` count from the point where `result` stopped.
+    progress : callable, optional
+        See `naive_greedy_sketch`. Steps count from the start of the greedy
+        permutation, and elapsed time from the start of this call.
+    resumable : bool, default=False
+        Whether to keep the "state" when the greedy permutation stops at `n`,
+        see `naive_greedy_sketch`.
+
+    Returns
+    -------
+    dict
+        The longer greedy permutation, with the options `result` was
+        computed with, see `naive_greedy_sketch`.
+    """
+    if "state" not in result:
+        raise ValueError(
+            "Greedy permutation is complete or wasn't computed with resumable=True, nothing to resume"
+        )
+    state = _copy_state(result["state"])
+    options = dict(result["options"], resumable=resumable)
+    if n < 0:
+        n = len(state["pts"])
+    if n > len(state["pts"]):
+        raise ValueError(
+            "Length of greedy permutation greater than number of points in persistence diagram"
+        )
+    if n < state["step"]:
+        raise ValueError(
+            f"Greedy permutation already has {state['step']} points, more than {n}"
+        )
+
+    stop = _stopping_rule(state["step"], tolerance, time_budget, max_points)
+    ret = _ENGINES[options["engine"]](
+        state["pts"],
+        n,
+        options["minimal"],
+        state["weights"],
+        stop,
+        state,
+        progress=progress,
+    )
+    return _finish_result(ret, options)
+
+
+def _stopping_rule(start, tolerance, time_budget, max_points):
+    """Build the `stop(i, radius)` callback of the numpy and grid engines.
+
+    It is called before adding the `i`th point of the greedy permutation,
+    which is at distance `radius` from the sketch so far, and returns why
+    to stop there, if at all. `start` is the first `i` it will be called
+    with.
+    """
+    if tolerance is None and time_budget is None and max_points is None:
+        return None
+    started = time.perf_counter()
+
+    def stop(i, radius):
+        if tolerance is not None and radius <= tolerance:
+            return "tolerance"
+        if max_points is not None and i - start >= max_points:
+            return "max_points"
+        if (
+            time_budget is not None
+            and i > start
+            and time.perf_counter() - started >= time_budget
+        ):
+            return "time_budget"
+        return None
+
+    return stop
+
+
+def _finish_result(ret, options):
+    """Add everything `naive_greedy_sketch` returns on top of the engine's."""
+    if not options["minimal"]:
+        if options["inverse"] is not None:
+            ret["voronoi"] = _expand_voronoi(ret["voronoi"], options["inverse"])
+        voronoi = ret["voronoi"]
+        snapshot_every = options["snapshot_every"]
+        if snapshot_every == "auto":
+            snapshot_every = -(
+                -len(ret["perm"]) * voronoi.size // max(len(voronoi.step), 1)
+            )
+        voronoi.take_snapshots(snapshot_every)
+
+    if "transport" not in ret:
+        ret["transport"] = transport_from_plans(ret["perm"], ret["transport_plans"])
+    if not options["dict_plans"]:
+        ret.pop("transport_plans", None)
+    elif "transport_plans" not in ret:
+        ret["transport_plans"] = transport_to_plans(ret["transport"])
+
+    if not options["minimal"]:
+        ret["sketches"] = SketchSequence(ret["transport"])
+        ret["persistence_diagram"] = options["persistence_diagram"]
+    if "state" in ret and ret["stopped"] == "n" and not options["resumable"]:
+        # Nothing stopped the greedy permutation early, so it was cut short on
+        # purpose
+        del ret["state"]
+    if "state" in ret:
+        ret["options"] = options
+
+    return ret
+
+
+def _python_greedy_sketch(pd, n, minimal, weights=None, progress=None):
+    """Compute the greedy sketch one point at a time in pure Python."""
+    started = time.perf_counter() if progress is not None else None
+    if weights is None:
+        weights = [1] * len(pd)
 
     # To be returned at all times
     # stores points of pd ordered in a greedy permutation
@@ -76,8 +372,8 @@ def naive_greedy_sketch(pd, n=-1, minimal=True):
     # sequence of greedy distances
     dist_seq = np.empty((n, 1))
     if not minimal:
-        # discrete voronoi cells for each sketch
-        voronoi = np.empty((n + 1, len(pd), 2))
+        # (sketch, point) for every point moving to a new voronoi cell
+        voronoi_changes = []
 
     # store reverse nearest neighbor of all points of pd
     rnn = np.empty((len(pd), 2))
@@ -98,12 +394,10 @@ def naive_greedy_sketch(pd, n=-1, minimal=True):
         if dist[i] > max_dist:
             max_dist = dist[i]
             furthest = i
-    # initialize first transportation plan and first voronoi diagram
+    # initialize first transportation plan
     transport = defaultdict(int)
-    transport[DIAGONAL] = len(pd)
+    transport[DIAGONAL] = int(sum(weights))
     transport_plans.append(transport)
-    if not minimal:
-        voronoi[0] = rnn.copy()
 
     for i in range(n):
         # print(f"Current round: {i} furthest point: {pd[furthest]}, index: {furthest}")
@@ -114,22 +408,26 @@ def naive_greedy_sketch(pd, n=-1, minimal=True):
 
         # temporary variable to store mass movement within successive sketches
         transport = defaultdict(int)
+        reassigned = 0
         for j in range(len(pd)):
             if l_inf(pd[j], pd[furthest]) >= dist[j]:
                 continue
+            reassigned += 1
 
             # print(
             #     f"j: {j}, point: {pd[j]}, old rnn: {rnn[j]}, old distance = {dist[j]:0.2f}, new rnn: {pd[furthest]}, new distance = {l_inf(pd[j], pd[furthest]):0.2f}"
             # )
 
             # one point lost by old RNN of j
-            transport[tuple(rnn[j])] -= 1
+            transport[tuple(rnn[j])] -= int(weights[j])
 
             rnn[j] = pd[furthest].copy()
             dist[j] = l_inf(pd[j], pd[furthest])
+            if not minimal:
+                voronoi_changes.append((i + 1, j))
 
             # one point gained by new RNN of j
-            transport[tuple(rnn[j])] += 1
+            transport[tuple(rnn[j])] += int(weights[j])
 
         # update max_dist and select next furthest point
         max_dist = 0
@@ -138,24 +436,513 @@ def naive_greedy_sketch(pd, n=-1, minimal=True):
                 max_dist = dist[j]
                 furthest = j
 
-        # store current voronoi diagram
-        if not minimal:
-            voronoi[i + 1] = rnn.copy()
-
         # append mass movement from previous sketch to the transportation plan
         transport_plans.append(transport)
+        if progress is not None:
+            progress(i + 1, reassigned, time.perf_counter() - started)
 
     ret = {"perm": perm, "transport_plans": transport_plans}
 
     if not minimal:
         ret["dist"] = dist_seq
-        ret["voronoi"] = voronoi
-        ret["sketches"] = generate_sketches(perm, transport_plans, n)
-        ret["persistence_diagram"] = pd
+        step, point = np.array(voronoi_changes, dtype=int).reshape(-1, 2).T
+        ret["voronoi"] = VoronoiHistory(perm, len(pd), step, point, step - 1)
+
+    return ret
+
+
+def _numpy_greedy_sketch(
+    pd, n, minimal, weights=None, stop=None, state=None, progress=None
+):
+    """Compute the greedy sketch with whole-array operations.
+
+    Nearest neighbors are stored as indices into the greedy permutation, with
+    -1 standing for the diagonal.
+    """
+    if state is None:
+        state = _new_state(pd, minimal, weights)
+        state["furthest"], state["max_dist"] = _argmax_dist(state["dist"], 0)
+
+    pts, rnn, dist = state["pts"], state["rnn"], state["dist"]
+    stopped = "n"
+    started = time.perf_counter() if progress is not None else None
+    while state["step"] < n:
+        i, furthest = state["step"], state["furthest"]
+        if stop is not None:
+            stopped = stop(i, state["max_dist"]) or stopped
+            if stopped != "n":
+                break
+        state["order"][i] = furthest
+        state["perm"][i] = pts[furthest]
+        state["dist_seq"][i] = state["max_dist"]
+
+        new_dist = l_inf_many(pts, pts[furthest])
+        moved = np.flatnonzero(new_dist < dist)
+
+        _record_moves(
+            state["moves"], i + 1, rnn[moved], i, _weights_of(state["weights"], moved)
+        )
+        rnn[moved] = i
+        dist[moved] = new_dist[moved]
+
+        # Like the python engine, keep the previous furthest point when every
+        # point already sits on its nearest neighbor
+        state["furthest"], state["max_dist"] = _argmax_dist(dist, furthest)
+
+        if not minimal:
+            state["voronoi_changes"].append(moved)
+        state["step"] += 1
+        if progress is not None:
+            progress(state["step"], len(moved), time.perf_counter() - started)
+
+    return _state_result(state, stopped)
+
+
+def _threaded_greedy_sketch(
+    pd, n, minimal, weights=None, stop=None, state=None, progress=None
+):
+    """Compute the greedy sketch like the numpy engine, on chunks in parallel.
+
+    The points are split into chunks of `THREAD_CHUNK`, and every step
+    updates the distances and nearest neighbors of each chunk and finds its
+    furthest point in a thread pool. NumPy releases the GIL in the array
+    operations, so the chunks run on as many cores as there are threads.
+    The furthest points of the chunks are then reduced to the furthest
+    point overall, breaking ties by index like the numpy engine.
+    """
+    if state is None:
+        state = _new_state(pd, minimal, weights)
+        state["furthest"], state["max_dist"] = _argmax_dist(state["dist"], 0)
+
+    pts, rnn, dist = state["pts"], state["rnn"], state["dist"]
+    chunks = [slice(lo, lo + THREAD_CHUNK) for lo in range(0, len(pts), THREAD_CHUNK)]
+
+    def update(chunk, i, center):
+        new_dist = l_inf_many(pts[chunk], center)
+        moved = np.flatnonzero(new_dist < dist[chunk])
+        lost_by = rnn[chunk][moved]
+        rnn[chunk][moved] = i
+        dist[chunk][moved] = new_dist[moved]
+        furthest = int(np.argmax(dist[chunk]))
+        return moved + chunk.start, lost_by, chunk.start + furthest
+
+    stopped = "n"
+    started = time.perf_counter() if progress is not None else None
+    threads = min(len(chunks), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max(threads, 1)) as pool:
+        # Handing a single chunk to a thread only adds overhead
+        run = pool.map if threads > 1 else map
+        while state["step"] < n:
+            i, furthest = state["step"], state["furthest"]
+            if stop is not None:
+                stopped = stop(i, state["max_dist"]) or stopped
+                if stopped != "n":
+                    break
+            state["order"][i] = furthest
+            state["perm"][i] = pts[furthest]
+            state["dist_seq"][i] = state["max_dist"]
+
+            results = list(
+                run(update, chunks, [i] * len(chunks), [pts[furthest]] * len(chunks))
+            )
+            moved = np.concatenate([result[0] for result in results])
+            lost_by = np.concatenate([result[1] for result in results])
+            _record_moves(
+                state["moves"], i + 1, lost_by, i, _weights_of(state["weights"], moved)
+            )
+
+            # The first chunk with the largest distance has the smallest index
+            best = max(results, key=lambda result: dist[result[2]])[2]
+            if dist[best] > 0:
+                state["furthest"], state["max_dist"] = best, dist[best]
+            else:
+                state["max_dist"] = 0
+
+            if not minimal:
+                state["voronoi_changes"].append(moved)
+            state["step"] += 1
+            if progress is not None:
+                progress(state["step"], len(moved), time.perf_counter() - started)
+
+    return _state_result(state, stopped)
+
+
+def _argmax_dist(dist, furthest):
+    """Furthest point from the sketch and its distance, keeping `furthest` on 0."""
+    if len(dist) and dist.max() > 0:
+        furthest = int(np.argmax(dist))
+        return furthest, dist[furthest]
+    return furthest, 0
+
+
+def _new_state(pd, minimal, weights):
+    """Everything the numpy and grid engines need to carry on sketching."""
+    pts = np.asarray(pd, dtype=float).reshape(-1, 2)
+    return {
+        "pts": pts,
+        "weights": weights,
+        # index into perm of the reverse nearest neighbor of all points of pd
+        "rnn": np.full(len(pts), -1),
+        # distance of every point to its reverse nearest neighbor
+        "dist": diagonal_dist(pts),
+        "furthest": 0,
+        "max_dist": 0,
+        # number of points of the greedy permutation found so far
+        "step": 0,
+        # index into pts of every point of the greedy permutation
+        "order": np.empty(len(pts), dtype=int),
+        "perm": np.empty((len(pts), 2)),
+        "dist_seq": np.empty((len(pts), 1)),
+        "moves": _new_moves(),
+        # points moving to a new voronoi cell in each sketch
+        "voronoi_changes": None if minimal else [],
+    }
+
+
+def _copy_state(state):
+    """Copy of an engine state which can be resumed without changing `state`."""
+    copy = dict(state)
+    for key in ["rnn", "dist", "order", "perm", "dist_seq"]:
+        copy[key] = state[key].copy()
+    copy["moves"] = {key: list(column) for key, column in state["moves"].items()}
+    if state["voronoi_changes"] is not None:
+        copy["voronoi_changes"] = list(state["voronoi_changes"])
+    if "heap" in state:
+        copy["heap"] = list(state["heap"])
+    return copy
+
+
+def _state_result(state, stopped):
+    """The result of the numpy and grid engines so far."""
+    pts, weights, step = state["pts"], state["weights"], state["step"]
+    perm = state["perm"][:step]
+    size = len(pts) if weights is None else int(weights.sum())
+    ret = {
+        "perm": perm,
+        "transport": _finish_moves(state["moves"], perm, size),
+        "stopped": stopped,
+        "radius": float(state["max_dist"]),
+    }
+    if step < len(pts):
+        ret["state"] = state
+
+    if state["voronoi_changes"] is not None:
+        ret["dist"] = state["dist_seq"][:step]
+        ret["voronoi"] = _finish_voronoi_changes(
+            state["voronoi_changes"], perm, len(pts)
+        )
 
     return ret
 
 
+def _new_moves():
+    return {"step": [], "source": [], "target": [], "count": []}
+
+
+def _weights_of(weights, moved):
+    return None if weights is None else weights[moved]
+
+
+def _record_moves(moves, step, lost_by, gained_by, weights=None):
+    """Record points moving from `lost_by` to `gained_by` in sketch `step`.
+
+    `lost_by` holds the old nearest neighbor index of every moved point and
+    `gained_by` is the index of their new nearest neighbor, both into the
+    greedy permutation. `weights` optionally gives how many points each moved
+    point stands for.
+    """
+    if weights is None:
+        counts = Counter(lost_by.tolist())
+    else:
+        counts = defaultdict(int)
+        for j, w in zip(lost_by.tolist(), weights.tolist()):
+            counts[j] += w
+    for j, c in counts.items():
+        moves["step"].append(step)
+        moves["source"].append(j)
+        moves["target"].append(gained_by)
+        moves["count"].append(c)
+
+
+def _finish_moves(moves, perm, size):
+    """Turn moves gathered by `_record_moves` into flat transport arrays."""
+    transport = {key: np.array(moves[key], dtype=int) for key in moves}
+    transport["perm"] = perm
+    transport["size"] = size
+    return transport
+
+
+def unique_points(pd):
+    """Merge repeated points of a persistence diagram.
+
+    Parameters
+    ----------
+    pd : numpy.ndarray
+        A n by 2 array of points in the persistence diagram.
+
+    Returns
+    -------
+    points : numpy.ndarray
+        Every distinct point of `pd`, in the order they first occur.
+    weights : numpy.ndarray
+        How many times each point of `points` occurs in `pd`.
+    inverse : numpy.ndarray
+        Index into `points` of every point of `pd`.
+    """
+    pts = np.asarray(pd, dtype=float).reshape(-1, 2)
+    _, first, inverse, weights = np.unique(
+        pts, axis=0, return_index=True, return_inverse=True, return_counts=True
+    )
+    # Keeping the order of first occurrence makes ties in the greedy
+    # permutation resolve the same as without merging
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return pts[first[order]], weights[order], rank[inverse.ravel()]
+
+
+def _expand_voronoi(history, inverse):
+    """Turn a `VoronoiHistory` of distinct points into one of all points.
+
+    `inverse` is the index of the distinct point of every point, see
+    `unique_points`.
+    """
+    order = np.argsort(inverse, kind="stable")
+    starts = np.searchsorted(inverse[order], np.arange(history.size + 1))
+    lengths = np.diff(starts)[history.point]
+    point = order[_concat_ranges(starts[history.point], lengths)]
+    step = np.repeat(history.step, lengths)
+    center = np.repeat(history.center, lengths)
+    return VoronoiHistory(history.perm, len(inverse), step, point, center)
+
+
+def _finish_voronoi_changes(voronoi_changes, perm, size):
+    """Turn the points moved in each sketch into a `VoronoiHistory`."""
+    lengths = [len(moved) for moved in voronoi_changes]
+    step = np.repeat(np.arange(1, len(lengths) + 1), lengths)
+    point = np.concatenate(voronoi_changes) if lengths else np.empty(0, dtype=int)
+    return VoronoiHistory(perm, size, step, point, step - 1)
+
+
+def _build_grid(pts):
+    """Bucket points into a uniform square grid for l-infinity box queries.
+
+    Returns
+    -------
+    dict
+        "order": Indices of `pts` sorted by grid cell, row by row.
+
+        "start": Offsets into "order" where each cell starts, with one extra
+        trailing entry. Cell `(cx, cy)` holds
+        `order[start[cy * size + cx]:start[cy * size + cx + 1]]`.
+
+        "lo", "width", "size": Lower corner of the grid, width of a cell along
+        each axis and number of cells along each axis.
+    """
+    # Aim for a handful of points per occupied cell. Persistence diagrams only
+    # fill the half of their bounding box above the diagonal.
+    size = max(1, int(np.sqrt(len(pts) / 2)))
+    lo = pts.min(axis=0) if len(pts) else np.zeros(2)
+    hi = pts.max(axis=0) if len(pts) else np.zeros(2)
+    width = np.where(hi > lo, (hi - lo) / size, 1)
+    cell = _grid_cell(pts, lo, width, size)
+    cell_id = cell[:, Y] * size + cell[:, X]
+    order = np.argsort(cell_id, kind="stable")
+    start = np.searchsorted(cell_id[order], np.arange(size * size + 1))
+    return {"order": order, "start": start, "lo": lo, "width": width, "size": size}
+
+
+def _grid_cell(pts, lo, width, size):
+    """Grid cell of every point of `pts`, clipped to the grid."""
+    return np.clip(((pts - lo) // width).astype(int), 0, size - 1)
+
+
+def _grid_query(grid, x, r):
+    """Indices of all points within l-infinity distance `r` of `x`.
+
+    May also return some points slightly further away.
+    """
+    size = grid["size"]
+    (lo_x, lo_y), (width_x, width_y) = grid["lo"].tolist(), grid["width"].tolist()
+    # Pad by a cell so rounding can never drop a point on the boundary. This
+    # runs once per greedy step, so stick to Python scalars.
+    x0 = min(max(int((x[X] - r - lo_x) // width_x) - 1, 0), size - 1)
+    y0 = min(max(int((x[Y] - r - lo_y) // width_y) - 1, 0), size - 1)
+    x1 = min(max(int((x[X] + r - lo_x) // width_x) + 1, 0), size - 1)
+    y1 = min(max(int((x[Y] + r - lo_y) // width_y) + 1, 0), size - 1)
+
+    # The cells of one grid row are contiguous in "order"
+    rows = np.arange(y0, y1 + 1) * size
+    starts = grid["start"][rows + x0]
+    ends = grid["start"][rows + x1 + 1]
+    return grid["order"][_concat_ranges(starts, ends - starts)]
+
+
+def _concat_ranges(starts, lengths):
+    """Concatenation of `range(start, start + length)` for every pair."""
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+def _grid_greedy_sketch(
+    pd, n, minimal, weights=None, stop=None, state=None, progress=None
+):
+    """Compute the greedy sketch, only visiting points which may move.
+
+    When the furthest point `c` at distance `r` from the sketch is added,
+    only points within distance `r` of `c` can get closer to the sketch,
+    since no point is further than `r` from its nearest neighbor. Those are
+    found with a uniform grid, and the next furthest point is kept on a heap
+    instead of being searched for.
+    """
+    if state is None:
+        state = _new_state(pd, minimal, weights)
+        _start_grid(state)
+
+    pts, rnn, dist, heap = state["pts"], state["rnn"], state["dist"], state["heap"]
+    stopped = "n"
+    started = time.perf_counter() if progress is not None else None
+    while state["step"] < n:
+        i, furthest, max_dist = state["step"], state["furthest"], state["max_dist"]
+        if stop is not None:
+            stopped = stop(i, max_dist) or stopped
+            if stopped != "n":
+                break
+        state["order"][i] = furthest
+        state["perm"][i] = pts[furthest]
+        state["dist_seq"][i] = max_dist
+
+        near = _grid_query(state["grid"], pts[furthest].tolist(), max_dist)
+        new_dist = l_inf_many(pts[near], pts[furthest])
+        closer = new_dist < dist[near]
+        moved = near[closer]
+
+        _record_moves(
+            state["moves"], i + 1, rnn[moved], i, _weights_of(state["weights"], moved)
+        )
+        rnn[moved] = i
+        dist[moved] = new_dist[closer]
+        for d, j in zip((-new_dist[closer]).tolist(), moved.tolist()):
+            heapq.heappush(heap, (d, j))
+
+        _pop_furthest(state)
+
+        if not minimal:
+            state["voronoi_changes"].append(moved)
+        state["step"] += 1
+        if progress is not None:
+            progress(state["step"], len(moved), time.perf_counter() - started)
+
+    return _state_result(state, stopped)
+
+
+def _start_grid(state):
+    """Add the grid and heap of the grid engine to a state and find the furthest point."""
+    state["grid"] = _build_grid(state["pts"])
+    # Max-heap of (-distance, index). Distances only ever shrink, so entries
+    # whose distance no longer matches `dist` are stale and skipped. Ties pop
+    # the smallest index first, like `np.argmax`.
+    state["heap"] = list(zip((-state["dist"]).tolist(), range(len(state["pts"]))))
+    heapq.heapify(state["heap"])
+    _pop_furthest(state)
+
+
+def _pop_furthest(state):
+    """Update the furthest point of a grid engine state from its heap."""
+    heap, dist = state["heap"], state["dist"]
+    while heap and -heap[0][0] != dist[heap[0][1]]:
+        heapq.heappop(heap)
+    # Keep the previous furthest point when every point already sits on its
+    # nearest neighbor, like the python engine
+    if heap and -heap[0][0] > 0:
+        state["furthest"], state["max_dist"] = heap[0][1], -heap[0][0]
+    else:
+        state["max_dist"] = 0
+
+
+_ENGINES = {
+    "python": _python_greedy_sketch,
+    "numpy": _numpy_greedy_sketch,
+    "grid": _grid_greedy_sketch,
+    "threaded": _threaded_greedy_sketch,
+}
+# Engines which can stop early and be resumed
+_RESUMABLE_ENGINES = {"numpy", "grid", "threaded"}
+
+
+def transport_from_plans(perm, transport_plans):
+    """Convert transportation plans from dicts keyed by points to flat arrays.
+
+    Parameters
+    ----------
+    perm : numpy.ndarray
+        The points ordered in the order of the greedy permutation.
+    transport_plans : list of dict
+        Transportation plans as returned in "transport_plans" by
+        `naive_greedy_sketch`.
+
+    Returns
+    -------
+    dict
+        "step", "source", "target", "count": Parallel integer arrays, sorted
+        by "step". Each row says that in sketch "step", "count" points moved
+        from the sketch point "source" to the sketch point "target". Sketch
+        points are indexes into "perm", and the diagonal is -1.
+
+        "perm": `perm` itself.
+
+        "size": Number of points in the persistence diagram, which all start
+        on the diagonal in sketch 0.
+    """
+    index = {}
+    for j, point in enumerate(perm):
+        index.setdefault(tuple(point), j)
+    index[DIAGONAL] = -1
+
+    moves = _new_moves()
+    for step, plan in enumerate(transport_plans[1:], 1):
+        for point, count in plan.items():
+            if count < 0:
+                moves["step"].append(step)
+                moves["source"].append(index[tuple(point)])
+                moves["target"].append(step - 1)
+                moves["count"].append(-count)
+    return _finish_moves(moves, perm, sum(transport_plans[0].values()))
+
+
+def transport_to_plans(transport):
+    """Convert transportation plans from flat arrays to dicts keyed by points.
+
+    Inverse of `transport_from_plans`.
+    """
+    perm = transport["perm"]
+    keys = [tuple(point) for point in perm] + [DIAGONAL]
+    plans = [defaultdict(int)]
+    plans[0][DIAGONAL] = transport["size"]
+    plans.extend(defaultdict(int) for _ in range(len(perm)))
+    for step, source, target, count in zip(
+        transport["step"].tolist(),
+        transport["source"].tolist(),
+        transport["target"].tolist(),
+        transport["count"].tolist(),
+    ):
+        plans[step][keys[source]] -= count
+        plans[step][keys[target]] += count
+    return plans
+
+
+def truncate_transport(transport, k):
+    """Restrict flat transportation plans to the first `k` greedy sketches.
+
+    The flat counterpart of slicing `transport_plans[:k + 1]`.
+    """
+    rows = np.searchsorted(transport["step"], k, side="right")
+    truncated = {key: transport[key][:rows] for key in _new_moves()}
+    truncated["perm"] = transport["perm"][:k]
+    truncated["size"] = transport["size"]
+    return truncated
+
+
 def generate_sketches(perm, transport_plans, n=-1):
     """Generate a series of `n+1` greedy sketches of the given persistence diagram.
 
@@ -164,10 +951,14 @@ def generate_sketches(perm, transport_plans, n=-1):
     perm : numpy.ndarray
         The points ordered in the order of the greedy permutation for the
         persistence diagram.
+    transport_plans : list of dict or dict
+        Transportation plans, either as dicts keyed by points or as flat
+        arrays.
 
     Returns
     ------
         A series of `n+1` greedy sketches of the given persistence diagram.
+        Use `SketchSequence` to only compute sketches as they are needed.
     """
     if n > len(perm):
         raise ValueError(
@@ -175,34 +966,166 @@ def generate_sketches(perm, transport_plans, n=-1):
         )
     if n < 0:
         n = len(perm)
-    if len(transport_plans) != n+1:
+    if isinstance(transport_plans, dict):
+        transport = transport_plans
+    elif len(transport_plans) != n + 1:
         raise ValueError(
             "Mismatch between transportation plan length and greedy permutation"
         )
-    sketches = []
-    mult_dict = defaultdict(int)
-    
-    for i in range(n + 1):
-        points = np.empty((i+1, 2))
-        mult = np.empty(i+1)
-        for p in transport_plans[i]:
-            mult_dict[p] += transport_plans[i][p]
-        for j in range(i):
-            points[j][X] = perm[j][X]
-            points[j][Y] = perm[j][Y]
-            mult[j] = mult_dict[tuple(perm[j])]
-        points[i] = [0,0]
-        mult[i] = mult_dict[(0,0)]
-        sketches.append((points, mult))
-    return sketches
-
-
-def compute_mult(transport_plans):
-    """
-    Input is a series of transportation plans for n sketches ordered in greedy permutation
-    Output is pointwise multiplicity of nth sketch
-    """
-    # test if ordering of sketches is greedy
+    else:
+        transport = transport_from_plans(perm, transport_plans)
+
+    return list(SketchSequence(truncate_transport(transport, n)))
+
+
+class SketchSequence:
+    """Lazy sequence of the greedy sketches of a persistence diagram.
+
+    Behaves like the list returned by `generate_sketches`, but only computes
+    a sketch when it is accessed. Multiplicities are found by replaying the
+    flat transportation plans from the closest sketch computed so far, so
+    stepping through the sketches in order costs about as much as computing
+    them all once. Slicing gives another lazy `SketchSequence`.
+
+    Parameters
+    ----------
+    transport : dict
+        Flat transportation plans, see `transport_from_plans`.
+    checkpoint_every : int, optional
+        Store the multiplicities of every `checkpoint_every`th sketch up
+        front, so that any sketch can be reached by replaying at most
+        `checkpoint_every` steps. Takes memory quadratic in the length of
+        the greedy permutation divided by `checkpoint_every`.
+    starts : numpy.ndarray, optional
+        The first row of the moves of every sketch, plus one past the end,
+        see `transport_starts`. Found from "step" by default, which reads all
+        of it, so pass it in when the transport arrays are memory-mapped.
+    """
+
+    def __init__(self, transport, checkpoint_every=None, starts=None, _indices=None):
+        self.transport = transport
+        self.perm = transport["perm"]
+        self._indices = range(len(self.perm) + 1) if _indices is None else _indices
+        # first row of every sketch's moves, plus one past the end
+        if starts is None:
+            starts = transport_starts(transport["step"], len(self.perm))
+        self._starts = starts
+        # mass of the sketch points of sketch self._at, with the diagonal last
+        self._mass = np.zeros(len(self.perm) + 1, dtype=int)
+        self._mass[-1] = transport["size"]
+        self._at = 0
+        self._checkpoints = {}
+        if checkpoint_every:
+            for k in range(0, len(self.perm) + 1, checkpoint_every):
+                self._seek(k)
+                self._checkpoints[k] = self._mult()
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __iter__(self):
+        for k in self._indices:
+            yield self._sketch(k)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return self._view(self._indices[k])
+        return self._sketch(self._indices[k])
+
+    def _view(self, indices):
+        view = SketchSequence.__new__(SketchSequence)
+        view.__dict__.update(self.__dict__)
+        view._indices = indices
+        # Each view replays on its own copy of the working state
+        view._mass = self._mass.copy()
+        return view
+
+    def _sketch(self, k):
+        self._seek(k)
+        points = np.empty((k + 1, 2))
+        points[:k] = self.perm[:k]
+        points[k] = DIAGONAL
+        return points, self._mult()
+
+    def _mult(self):
+        return np.append(self._mass[: self._at], self._mass[-1])
+
+    def _seek(self, k):
+        """Bring the working multiplicities to sketch `k`."""
+        start = self._starts
+        checkpoint = max((c for c in self._checkpoints if c <= k), default=None)
+        if checkpoint is not None and (
+            start[k + 1] - start[checkpoint + 1] + checkpoint
+            < abs(start[k + 1] - start[self._at + 1])
+        ):
+            mult = self._checkpoints[checkpoint]
+            self._mass[checkpoint : max(checkpoint, self._at)] = 0
+            self._mass[:checkpoint] = mult[:-1]
+            self._mass[-1] = mult[-1]
+            self._at = checkpoint
+
+        rows = slice(start[min(k, self._at) + 1], start[max(k, self._at) + 1])
+        gain, lose = self.transport["target"][rows], self.transport["source"][rows]
+        if k < self._at:
+            # Undo the moves of the sketches after k
+            gain, lose = lose, gain
+        np.add.at(self._mass, gain, self.transport["count"][rows])
+        np.subtract.at(self._mass, lose, self.transport["count"][rows])
+        self._at = k
+
+
+def transport_starts(step, n):
+    """First row of every sketch in `step`, plus one past the end.
+
+    Parameters
+    ----------
+    step : numpy.ndarray
+        The sorted "step" of flat transportation plans or of a
+        `VoronoiHistory`.
+    n : int
+        Length of the greedy permutation.
+
+    Returns
+    -------
+    numpy.ndarray
+        `n + 2` offsets, where the rows of sketch `k` are
+        `starts[k]:starts[k + 1]`.
+    """
+    return np.searchsorted(step, np.arange(n + 2), side="left")
+
+
+def compute_mult(transport_plans, k=None):
+    """Compute pointwise multiplicity of a greedy sketch.
+
+    Parameters
+    ----------
+    transport_plans : list of dict or dict
+        Either the transportation plans of sketches 0 through `k` as dicts
+        keyed by points, or flat transportation plans (see
+        `transport_from_plans`).
+    k : int, optional
+        Sketch to compute the multiplicities of when given flat
+        transportation plans. Defaults to the largest sketch.
+
+    Returns
+    -------
+    collections.defaultdict or numpy.ndarray
+        For dicts, the multiplicity of every point. For flat plans, an array
+        of the multiplicities of the first `k` points of the greedy
+        permutation followed by the multiplicity of the diagonal.
+    """
+    if isinstance(transport_plans, dict):
+        transport = transport_plans
+        if k is None:
+            k = len(transport["perm"])
+        rows = np.searchsorted(transport["step"], k, side="right")
+        count = transport["count"][:rows]
+        # The diagonal is the last entry, which is where -1 indexes to
+        source = transport["source"][:rows] % (k + 1)
+        mult = np.bincount(transport["target"][:rows], count, minlength=k + 1)
+        mult -= np.bincount(source, count, minlength=k + 1)
+        mult[-1] += transport["size"]
+        return mult.astype(int)
 
     multiplicity = defaultdict(int)
     for i in range(len(transport_plans)):
@@ -211,6 +1134,65 @@ def compute_mult(transport_plans):
     return multiplicity
 
 
+def sketch_points(transport_plans, k=None):
+    """Distinct points of a greedy sketch and their multiplicities.
+
+    Parameters
+    ----------
+    transport_plans : list of dict or dict
+        Transportation plans, either as dicts keyed by points or as flat
+        arrays.
+    k : int, optional
+        Sketch to describe. Defaults to the last sketch of the plans.
+
+    Returns
+    -------
+    points : numpy.ndarray
+        The points of the sketch, including the diagonal as `(0, 0)`.
+    mult : numpy.ndarray
+        The multiplicity of each point of `points`.
+    """
+    if isinstance(transport_plans, dict):
+        if k is not None:
+            transport_plans = truncate_transport(transport_plans, k)
+        points = np.vstack((transport_plans["perm"], [DIAGONAL]))
+        return points, compute_mult(transport_plans)
+    if k is not None:
+        transport_plans = transport_plans[: k + 1]
+    mult = compute_mult(transport_plans)
+    points = np.array(list(mult.keys()), dtype=float).reshape(-1, 2)
+    return points, np.array(list(mult.values()), dtype=int)
+
+
+def greedy_order(result):
+    """Index into the persistence diagram of every point of a greedy permutation.
+
+    Recovered from the Voronoi history of a result with `minimal=False`: a
+    point picked at some distance from the sketch moves to its own cell in
+    the next sketch, along with any copies of it, of which the first is the
+    one picked. A point picked at distance 0 is the point picked before.
+
+    Parameters
+    ----------
+    result : dict
+        The result of `naive_greedy_sketch` with `minimal=False`.
+
+    Returns
+    -------
+    numpy.ndarray
+        For every point of "perm", the index of that point in
+        "persistence_diagram".
+    """
+    history, dist = result["voronoi"], result["dist"][:, 0]
+    pts = np.asarray(result["persistence_diagram"], dtype=float).reshape(-1, 2)
+    order = np.full(len(dist), len(pts))
+    own = (pts[history.point] == history.perm[history.center]).all(axis=1)
+    np.minimum.at(order, history.center[own], history.point[own])
+    for i in np.flatnonzero(dist <= 0).tolist():
+        order[i] = order[i - 1] if i else 0
+    return order
+
+
 def intersketch_bd(transport_plans_a, transport_plans_b):
     """Find the bottleneck distance between two greedy sketches.
 
@@ -218,37 +1200,275 @@ def intersketch_bd(transport_plans_a, transport_plans_b):
     ----------
     transport_plans_a, transport_plans_b
         Transportation plans of arbitrary persistence diagrams. Each plan
-        corresponds to one persistence diagram.
+        corresponds to one persistence diagram and may either be a list of
+        dicts, compared at its last sketch, or flat plans, compared at their
+        largest sketch (see `truncate_transport`).
 
     Returns
     -------
     float
         Bottleneck distance between the two sketches.
     """
+    return sketch_bd(sketch_points(transport_plans_a), sketch_points(transport_plans_b))
+
+
+def sketch_bd(sketch_a, sketch_b):
+    """Find the bottleneck distance between two diagrams with repeated points.
+
+    Gives the same distance as `persim.bottleneck` on the diagrams with every
+    point repeated by its multiplicity, but only looks at the distinct
+    points, so it takes time depending on the size of the sketches rather
+    than of the persistence diagrams they sketch. Binary searches over the
+    candidate distances for the smallest one at which every point can be
+    matched, checking each with a maximum flow.
+
+    Parameters
+    ----------
+    sketch_a, sketch_b : tuple of (numpy.ndarray, numpy.ndarray)
+        Distinct points and their multiplicities, like the sketches in
+        `generate_sketches` or returned by `sketch_points`.
+
+    Returns
+    -------
+    float
+        Bottleneck distance between the two diagrams.
+    """
+    points_a, mult_a = _finite_points(*sketch_a)
+    points_b, mult_b = _finite_points(*sketch_b)
+
+    cross = np.maximum(
+        np.abs(points_a[:, None, X] - points_b[None, :, X]),
+        np.abs(points_a[:, None, Y] - points_b[None, :, Y]),
+    )
+    # Same as persim, which is what sketches were compared with before
+    diag_a = 0.5 * (points_a[:, Y] - points_a[:, X])
+    diag_b = 0.5 * (points_b[:, Y] - points_b[:, X])
+    candidates = np.unique(np.concatenate((cross.ravel(), diag_a, diag_b, [0])))
+
+    # Smallest candidate at which a matching exists. The largest diagonal
+    # distance always works by matching everything to the diagonal.
+    lo, hi = 0, len(candidates) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        d = candidates[mid]
+        if _can_match(mult_a, mult_b, cross <= d, diag_a <= d, diag_b <= d):
+            hi = mid
+        else:
+            lo = mid + 1
+    return float(candidates[lo])
+
+
+def _finite_points(points, mult):
+    """Drop points with no multiplicity or infinite death, like persim."""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    mult = np.asarray(mult, dtype=int)
+    keep = (mult > 0) & np.isfinite(points[:, Y])
+    return points[keep], mult[keep]
+
+
+def _can_match(mult_a, mult_b, close, a_to_diag, b_to_diag):
+    """Whether all points of two diagrams can be matched within a distance.
+
+    `close[i, j]` says whether point `i` of the first diagram may match point
+    `j` of the second, and `a_to_diag` and `b_to_diag` whether points may
+    match the diagonal. Solved as a maximum flow where every point of either
+    diagram has to send its multiplicity to a point of the other diagram or
+    the diagonal, and the diagonal can match the diagonal freely.
+    """
+    ka, kb = len(mult_a), len(mult_b)
+    total_a, total_b = int(mult_a.sum()), int(mult_b.sum())
+    # Nodes: source, points of a, diagonal matching b, points of b, diagonal
+    # matching a, sink
+    source, diag_for_b, diag_for_a, sink = 0, ka + 1, ka + kb + 2, ka + kb + 3
+    unbounded = total_a + total_b + 1
+
+    capacity = np.zeros((sink + 1, sink + 1), dtype=np.int64)
+    capacity[source, 1 : ka + 1] = mult_a
+    capacity[source, diag_for_b] = total_b
+    capacity[ka + 2 : ka + kb + 2, sink] = mult_b
+    capacity[diag_for_a, sink] = total_a
+    capacity[1 : ka + 1, ka + 2 : ka + kb + 2] = close * unbounded
+    capacity[1 : ka + 1, diag_for_a] = a_to_diag * unbounded
+    capacity[diag_for_b, ka + 2 : ka + kb + 2] = b_to_diag * unbounded
+    capacity[diag_for_b, diag_for_a] = unbounded
+
+    return _max_flow(capacity, source, sink) == total_a + total_b
+
+
+def _max_flow(capacity, source, sink):
+    """Edmonds-Karp maximum flow on a dense capacity matrix, modified in place."""
+    flow = 0
+    while True:
+        # Breadth first search for the shortest augmenting path
+        parent = np.full(len(capacity), -1)
+        parent[source] = source
+        frontier = [source]
+        while frontier and parent[sink] == -1:
+            nxt = []
+            for u in frontier:
+                for v in np.flatnonzero((capacity[u] > 0) & (parent == -1)):
+                    parent[v] = u
+                    nxt.append(v)
+            frontier = nxt
+        if parent[sink] == -1:
+            return flow
+
+        path = [sink]
+        while path[-1] != source:
+            path.append(parent[path[-1]])
+        us, vs = path[:0:-1], path[-2::-1]
+        push = capacity[us, vs].min()
+        capacity[us, vs] -= push
+        capacity[vs, us] += push
+        flow += int(push)
+
+
+class VoronoiHistory:
+    """Discrete Voronoi cells of every greedy sketch, stored as changes.
+
+    Only the points which move to a new cell are stored for each sketch,
+    instead of the cell of every point for every sketch. Indexing like
+    `history[i]` or `history[i, j]` gives the same points as indexing the
+    dense `(n + 1, len(pd), 2)` array of nearest sketch points.
+
+    Parameters
+    ----------
+    perm : numpy.ndarray
+        The points ordered in the order of the greedy permutation.
+    size : int
+        Number of points in the persistence diagram.
+    step, point, center : numpy.ndarray
+        Parallel integer arrays, sorted by "step". Each row says that in
+        sketch `step`, point `point` of the persistence diagram moved to the
+        cell of `perm[center]`.
+    snapshot_every : int, optional
+        Store the full Voronoi cells of every `snapshot_every`th sketch, so
+        that `voronoi_at` only has to replay the changes since the closest
+        snapshot. Takes memory proportional to `size` for every snapshot.
+    starts : numpy.ndarray, optional
+        The first change of every sketch, plus one past the end, see
+        `transport_starts`. Found from `step` by default.
+    snapshots : dict, optional
+        Full Voronoi cells of some sketches keyed by sketch, like those taken
+        with `snapshot_every`, e.g. read back from disk. Used instead of
+        taking snapshots.
+    """
+
+    def __init__(
+        self,
+        perm,
+        size,
+        step,
+        point,
+        center,
+        snapshot_every=None,
+        starts=None,
+        snapshots=None,
+    ):
+        self.perm = perm
+        self.size = size
+        self.step = step
+        self.point = point
+        self.center = center
+        # first change of every sketch, plus one past the end
+        if starts is None:
+            starts = transport_starts(step, len(perm))
+        self._starts = starts
+        # centers[-1] is the diagonal, so centers[cells] maps indices to points
+        self._centers = np.vstack((perm, [DIAGONAL]))
+        self._snapshots = {0: np.full(size, -1)}
+        if snapshots is not None:
+            self._snapshots.update(snapshots)
+        else:
+            self.take_snapshots(snapshot_every)
+        # changes sorted by point, built by `cells_of` when first needed
+        self._by_point = None
+
+    def __len__(self):
+        return len(self.perm) + 1
+
+    def __getitem__(self, key):
+        k, rest = (key[0], key[1:]) if isinstance(key, tuple) else (key, ())
+        if k < 0:
+            k += len(self)
+        return self._centers[self.voronoi_at(k)][rest]
+
+    def take_snapshots(self, snapshot_every):
+        """Store the full Voronoi cells of every `snapshot_every`th sketch.
+
+        Replaces any snapshots taken before. Does nothing for `None`.
+        """
+        if not snapshot_every:
+            return
+        self._snapshots = {0: self._snapshots[0]}
+        cells = self._snapshots[0]
+        for k in range(snapshot_every, len(self.perm) + 1, snapshot_every):
+            # Replay from the previous snapshot rather than from the start
+            cells = cells.copy()
+            rows = slice(self._starts[k - snapshot_every + 1], self._starts[k + 1])
+            np.maximum.at(cells, self.point[rows], self.center[rows])
+            self._snapshots[k] = cells
+
+    def voronoi_at(self, k):
+        """Index into `perm` of the nearest sketch point of every point in sketch `k`.
+
+        The diagonal is -1.
+        """
+        if not 0 <= k < len(self):
+            raise IndexError(f"sketch {k} out of range")
+        # Points only ever move to newer sketch points, so the latest move of
+        # each point is the one with the largest center
+        snapshot = max(c for c in self._snapshots if c <= k)
+        cells = self._snapshots[snapshot].copy()
+        rows = slice(self._starts[snapshot + 1], self._starts[k + 1])
+        np.maximum.at(cells, self.point[rows], self.center[rows])
+        return cells
+
+    def cells_of(self, points, ks):
+        """Index into `perm` of the nearest sketch point of single points.
+
+        Looks up only the changes of the points asked for, so it doesn't
+        depend on `size` like `voronoi_at` does.
+
+        Parameters
+        ----------
+        points, ks : numpy.ndarray
+            Parallel integer arrays, asking for the cell of point `points[i]`
+            of the persistence diagram in sketch `ks[i]`.
+
+        Returns
+        -------
+        numpy.ndarray
+            The index into `perm` of every cell asked for, with -1 for the
+            diagonal.
+        """
+        points, ks = np.asarray(points, dtype=int), np.asarray(ks, dtype=int)
+        # Changes keyed by point then step, as one sortable integer
+        stride = len(self.perm) + 2
+        if self._by_point is None:
+            order = np.lexsort((self.step, self.point))
+            self._by_point = (
+                self.point[order] * stride + self.step[order],
+                self.center[order],
+            )
+        keys, centers = self._by_point
+        # Latest change of each point up to its sketch
+        last = np.searchsorted(keys, points * stride + ks, "right") - 1
+        found = (last >= 0) & (keys[np.maximum(last, 0)] // stride == points)
+        cells = np.full(len(points), -1)
+        cells[found] = centers[last[found]]
+        return cells
+
+    def changes(self):
+        """Iterate over the points moving to a new cell in each sketch.
 
-    # if len(perm_a)+1 != len(transport_plans_a):
-    #     raise ValueError(
-    #         "Mismatch between transportation plans and permutation for sketch a"
-    #     )
-    # if len(perm_b)+1 != len(transport_plans_b):
-    #     raise ValueError(
-    #         "Mismatch between transportation plans and permutation for sketch b"
-    #     )
-
-    mult_a = compute_mult(transport_plans_a)
-    mult_b = compute_mult(transport_plans_b)
-    sketch_a = np.empty((transport_plans_a[0][DIAGONAL], 2))
-    sketch_b = np.empty((transport_plans_b[0][DIAGONAL], 2))
-    points_a = mult_a.keys()
-    points_b = mult_b.keys()
-    i = 0
-    for point in points_a:
-        for count in range(mult_a[tuple(point)]):
-            sketch_a[i] = point
-            i += 1
-    i = 0
-    for point in points_b:
-        for count in range(mult_b[tuple(point)]):
-            sketch_b[i] = point
-            i += 1
-    return persim.bottleneck(sketch_a, sketch_b, matching=False)
+        Yields
+        ------
+        tuple of (int, numpy.ndarray, numpy.ndarray)
+            The sketch `k` from 1 through `n`, the points of the persistence
+            diagram which moved to a new cell in it, and the index into
+            `perm` of their new nearest sketch points.
+        """
+        for k in range(1, len(self)):
+            rows = slice(self._starts[k], self._starts[k + 1])
+            yield k, self.point[rows], self.center[rows]
@@ -0,0 +1,173 @@
+"""Saving greedy sketches to disk and loading them back lazily."""
+
+import json
+import os
+
+import numpy as np
+
+from greedy_sketch.sketch import (
+    SketchSequence,
+    VoronoiHistory,
+    transport_starts,
+    transport_to_plans,
+)
+
+# Version of the layout written by `save_sketch`. Bump it whenever the layout
+# changes, and keep `load_sketch` reading the older versions.
+FORMAT_VERSION = 2
+
+_TRANSPORT_KEYS = ["step", "source", "target", "count"]
+_VORONOI_KEYS = ["step", "point", "center"]
+
+
+def save_sketch(result, path):
+    """Write the result of `naive_greedy_sketch` to a directory.
+
+    Every array is stored as its own `.npy` file, next to a `meta.json`
+    describing the result, so that `load_sketch` can memory-map each one:
+
+    ==========================  ============================================
+    file                        contents
+    ==========================  ============================================
+    meta.json                   format version, "size", "stopped", "radius"
+                                and which optional arrays are present
+    perm.npy                    "perm"
+    transport_{key}.npy         "transport" step, source, target and count
+    transport_starts.npy        first row of every sketch in "transport"
+    dist.npy                    "dist", when present
+    voronoi_{key}.npy           `VoronoiHistory` step, point and center,
+                                when present
+    voronoi_starts.npy          first change of every sketch in "voronoi"
+    voronoi_snapshot_steps.npy  sketches with a snapshot in "voronoi"
+    voronoi_snapshots.npy       full Voronoi cells of each of those sketches
+    persistence_diagram.npy     "persistence_diagram", when present
+    ==========================  ============================================
+
+    Parameters
+    ----------
+    result : dict
+        The result of `naive_greedy_sketch`, with any options. The state of
+        an incomplete greedy permutation isn't saved, so a loaded result
+        can't be resumed.
+    path : str
+        Directory to write to, created if needed. Existing files of a sketch
+        are overwritten.
+    """
+    os.makedirs(path, exist_ok=True)
+    # A directory without a meta.json holds no sketch, so the old meta.json
+    # mustn't describe the arrays while they're being rewritten
+    try:
+        os.remove(os.path.join(path, "meta.json"))
+    except FileNotFoundError:
+        pass
+    perm = np.asarray(result["perm"], dtype=float).reshape(-1, 2)
+    transport = result["transport"]
+    arrays = {"perm": perm}
+    for key in _TRANSPORT_KEYS:
+        arrays[f"transport_{key}"] = np.asarray(transport[key], dtype=np.int64)
+    arrays["transport_starts"] = transport_starts(transport["step"], len(perm))
+    if "dist" in result:
+        arrays["dist"] = np.asarray(result["dist"], dtype=float)
+    if "voronoi" in result:
+        voronoi = result["voronoi"]
+        for key in _VORONOI_KEYS:
+            arrays[f"voronoi_{key}"] = np.asarray(getattr(voronoi, key), dtype=np.int64)
+        arrays["voronoi_starts"] = voronoi._starts
+        # Sketch 0 has every point in the cell of the diagonal
+        steps = sorted(k for k in voronoi._snapshots if k > 0)
+        arrays["voronoi_snapshot_steps"] = np.array(steps, dtype=np.int64)
+        arrays["voronoi_snapshots"] = np.array(
+            [voronoi._snapshots[k] for k in steps], dtype=np.int64
+        ).reshape(len(steps), voronoi.size)
+    if "persistence_diagram" in result:
+        arrays["persistence_diagram"] = np.asarray(
+            result["persistence_diagram"], dtype=float
+        ).reshape(-1, 2)
+
+    meta = {
+        "format": "greedy_sketch",
+        "version": FORMAT_VERSION,
+        "size": int(transport["size"]),
+        "arrays": sorted(arrays),
+    }
+    if "voronoi" in result:
+        meta["voronoi_size"] = int(result["voronoi"].size)
+    for key in ["stopped", "radius"]:
+        if key in result:
+            meta[key] = result[key]
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+    # Written last, so a directory with a meta.json holds a complete sketch
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+
+def load_sketch(path, mmap=True, dict_plans=False):
+    """Read a result written by `save_sketch`.
+
+    With `mmap=True`, arrays are memory-mapped rather than read, and only
+    the parts needed are read from disk as they are used. "sketches" replays
+    the transportation plans up to the sketch asked for, so looking at an
+    early sketch of a large result only reads the start of the files.
+
+    Parameters
+    ----------
+    path : str
+        Directory written by `save_sketch`.
+    mmap : bool, default=True
+        Whether to memory-map the arrays read-only instead of reading them.
+    dict_plans : bool, default=False
+        Whether to also build "transport_plans", which reads all of the
+        transportation plans.
+
+    Returns
+    -------
+    dict
+        The keys of the result that was saved, plus "sketches" when it has
+        "dist". See `naive_greedy_sketch`.
+    """
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("format") != "greedy_sketch":
+        raise ValueError(f"{path} doesn't hold a greedy sketch")
+    if meta["version"] > FORMAT_VERSION:
+        raise ValueError(
+            f"Greedy sketch format version {meta['version']} is newer than "
+            f"the supported version {FORMAT_VERSION}"
+        )
+
+    def load(name):
+        return np.load(
+            os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None
+        )
+
+    arrays = {name: load(name) for name in meta["arrays"]}
+    perm = arrays["perm"]
+    transport = {key: arrays[f"transport_{key}"] for key in _TRANSPORT_KEYS}
+    transport["perm"] = perm
+    transport["size"] = meta["size"]
+    ret = {"perm": perm, "transport": transport}
+    if dict_plans:
+        ret["transport_plans"] = transport_to_plans(transport)
+    if "dist" in arrays:
+        ret["dist"] = arrays["dist"]
+        ret["sketches"] = SketchSequence(transport, starts=arrays["transport_starts"])
+    if "voronoi_step" in arrays:
+        # Version 1 didn't save the snapshots
+        snapshots = {}
+        if "voronoi_snapshots" in arrays:
+            steps = arrays["voronoi_snapshot_steps"].tolist()
+            snapshots = dict(zip(steps, arrays["voronoi_snapshots"]))
+        ret["voronoi"] = VoronoiHistory(
+            perm,
+            meta["voronoi_size"],
+            *[arrays[f"voronoi_{key}"] for key in _VORONOI_KEYS],
+            starts=arrays["voronoi_starts"],
+            snapshots=snapshots,
+        )
+    if "persistence_diagram" in arrays:
+        ret["persistence_diagram"] = arrays["persistence_diagram"]
+    for key in ["stopped", "radius"]:
+        if key in meta:
+            ret[key] = meta[key]
+    return ret
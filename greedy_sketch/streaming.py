@@ -0,0 +1,177 @@
+"""Approximate greedy sketches of persistence diagrams too large for memory."""
+
+import os
+
+import numpy as np
+
+from greedy_sketch.sketch import (
+    _finish_result,
+    _numpy_greedy_sketch,
+    diagonal_dist,
+)
+
+# Largest number of distances computed at once
+_BLOCK = 2**20
+
+
+def streaming_greedy_sketch(pd, n, chunk_size=2**16, dict_plans=True):
+    """Sketch a persistence diagram in one pass over its points.
+
+    Keeps at most `n` sketch points and a radius `r`, reading the diagram a
+    chunk at a time (the doubling algorithm for k-center, with the diagonal
+    as an extra center which is always there). A point within `2r` of a
+    sketch point or of the diagonal adds to the nearest one's multiplicity,
+    and any other point becomes a sketch point. When there are more than `n`
+    sketch points, `r` grows to at least twice its value and to the
+    smallest distance between sketch points, and every sketch point within
+    `r` of the diagonal or of an earlier sketch point is merged into it.
+
+    Every point stays within `2r` of the sketch point it counts towards,
+    so the bottleneck distance between the diagram and the sketch is at
+    most `2r`, which is returned as "bound". That is at most 8 times the
+    radius of the best `n` point sketch, so at most 8 times the greedy
+    radius (the next value of "dist" of `naive_greedy_sketch`). Once the
+    diagram has been read, the sketch points are ordered by their own greedy
+    permutation, weighted by multiplicity, so smaller sketches are also
+    available.
+
+    Parameters
+    ----------
+    pd : numpy.ndarray, str or iterable of numpy.ndarray
+        The persistence diagram as a n by 2 array, the path of a `.npy` file
+        holding it, which is memory-mapped, or an iterable of chunks of
+        points. All points must be finite.
+    n : int
+        The largest number of sketch points to keep.
+    chunk_size : int, default=65536
+        Number of points to read at a time from an array or file.
+    dict_plans : bool, default=True
+        See `naive_greedy_sketch`.
+
+    Returns
+    -------
+    dict
+        "perm", "transport", "transport_plans" (when `dict_plans=True`) and
+        "stopped" like `naive_greedy_sketch` with `minimal=True`, where
+        multiplicities count the points of the whole diagram but are
+        approximate, plus
+
+        "approximate": True, since the sketches aren't the greedy sketches
+        of the diagram.
+
+        "bound": Bottleneck distance between the diagram and its last sketch
+        is at most this. Sketch `k` is within `bound` plus the distance
+        between its last two sketch points (its own greedy radius) of the
+        diagram.
+    """
+    if n < 1:
+        raise ValueError("Streaming sketches need at least one sketch point")
+    centers = np.empty((0, 2))
+    weights = np.empty(0, dtype=int)
+    radius = 0.0
+    size = 0
+    for chunk in _chunks(pd, chunk_size):
+        chunk = np.asarray(chunk, dtype=float).reshape(-1, 2)
+        if not np.isfinite(chunk).all():
+            raise ValueError(
+                "Persistence diagram has non-finite points, drop them before sketching"
+            )
+        size += len(chunk)
+        centers, weights, radius = _add_chunk(centers, weights, radius, chunk, n)
+
+    ret = _numpy_greedy_sketch(centers, len(centers), True, weights)
+    # Points counted towards the diagonal never move
+    ret["transport"]["size"] = size
+    ret = _finish_result(
+        ret,
+        {
+            "persistence_diagram": None,
+            "minimal": True,
+            "dict_plans": dict_plans,
+            "inverse": None,
+            "snapshot_every": None,
+            "resumable": False,
+        },
+    )
+    del ret["radius"]
+    ret["approximate"] = True
+    ret["bound"] = 2 * radius
+    return ret
+
+
+def _chunks(pd, chunk_size):
+    """Chunks of a diagram given as an array, a `.npy` file or chunks already."""
+    if isinstance(pd, (str, os.PathLike)):
+        pd = np.load(pd, mmap_mode="r")
+    if not isinstance(pd, np.ndarray):
+        yield from pd
+        return
+    for start in range(0, len(pd), chunk_size):
+        yield pd[start : start + chunk_size]
+
+
+def _add_chunk(centers, weights, radius, chunk, n):
+    """Count a chunk of points towards the sketch, see `streaming_greedy_sketch`."""
+    dist, nearest = _nearest(chunk, centers)
+    covered = dist <= 2 * radius
+    weights = weights.copy()
+    np.add.at(weights, nearest[covered & (nearest >= 0)], 1)
+
+    # The rest one at a time, since each may cover the ones after it
+    for x in chunk[~covered]:
+        d, j = _nearest(x[None], centers)
+        if d[0] <= 2 * radius:
+            if j[0] >= 0:
+                weights[j[0]] += 1
+            continue
+        centers = np.vstack((centers, x))
+        weights = np.append(weights, 1)
+        while len(centers) > n:
+            centers, weights, radius = _merge(centers, weights, radius)
+    return centers, weights, radius
+
+
+def _nearest(pts, centers):
+    """Distance from every point to the sketch and index of its nearest center.
+
+    The diagonal is -1, and wins ties.
+    """
+    dist = diagonal_dist(pts)
+    nearest = np.full(len(pts), -1)
+    # Bound the memory of the distance matrix
+    rows = max(1, _BLOCK // max(len(centers), 1))
+    for lo in range(0, len(pts) if len(centers) else 0, rows):
+        block = pts[lo : lo + rows]
+        to_centers = np.maximum(
+            np.abs(block[:, None, 0] - centers[None, :, 0]),
+            np.abs(block[:, None, 1] - centers[None, :, 1]),
+        )
+        closest = np.argmin(to_centers, axis=1)
+        d = to_centers[np.arange(len(block)), closest]
+        closer = d < dist[lo : lo + rows]
+        nearest[lo : lo + rows][closer] = closest[closer]
+        dist[lo : lo + rows] = np.minimum(dist[lo : lo + rows], d)
+    return dist, nearest
+
+
+def _merge(centers, weights, radius):
+    """Grow the radius and merge sketch points closer than it."""
+    pairwise = np.maximum(
+        np.abs(centers[:, None, 0] - centers[None, :, 0]),
+        np.abs(centers[:, None, 1] - centers[None, :, 1]),
+    )
+    pairwise[np.diag_indices(len(centers))] = np.inf
+    closest = min(pairwise.min(), diagonal_dist(centers).min())
+    radius = max(2 * radius, closest)
+
+    kept = []
+    weights = weights.copy()
+    for j, x in enumerate(centers):
+        if diagonal_dist(x[None])[0] <= radius:
+            continue
+        close = [i for i in kept if pairwise[i, j] <= radius]
+        if close:
+            weights[min(close, key=lambda i: pairwise[i, j])] += weights[j]
+        else:
+            kept.append(j)
+    return centers[kept], weights[kept], radius
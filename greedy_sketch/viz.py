@@ -7,8 +7,10 @@ import numpy as np
 import persim
 import ripser
 from matplotlib import animation
+from matplotlib.collections import EllipseCollection
+from matplotlib.colors import to_hex, to_rgba
 
-from greedy_sketch.sketch import DIAGONAL, diagonal_point
+from greedy_sketch.sketch import greedy_order, transport_starts
 
 # Cool paper about these colors: https://eleanormaclure.files.wordpress.com/2011/03/colour-coding.pdf
 # White, black, and grey removed
@@ -44,9 +46,16 @@ def make_greedy_sketch_animation(
     colors=DEFAULT_COLORS,
     diagonal_color=DEFAULT_DIAGONAL_COLOR,
     ax=None,
+    blit=False,
 ):
     """Create matplotlib `Animation` of greedy sketch and bottleneck distance.
 
+    Everything drawn is worked out before the first frame: the colors of the
+    points moving to a new Voronoi cell in each frame and the lines showing
+    the bottleneck distance. Going forward a frame only recolors the points
+    that moved, so apart from drawing, the cost of a frame doesn't depend on
+    the size of the persistence diagram.
+
     Parameters
     ----------
     greedy_sketch : dict
@@ -62,6 +71,9 @@ def make_greedy_sketch_animation(
     ax : matplotlib.axes.Axes, optional
         Axis to draw the animation onto. Defaults to the current axis of
         `matplotlib.pyplot`.
+    blit : bool, default=False
+        Whether to only redraw the animated artists in each frame, see
+        `matplotlib.animation.FuncAnimation`.
 
     Returns
     -------
@@ -76,29 +88,39 @@ def make_greedy_sketch_animation(
     fig = ax.figure
 
     # Unpack greedy_sketch
-    sketches = np.array(greedy_sketch["sketches"], dtype=object).T[0]
-    perm = greedy_sketch["perm"]
+    perm = np.asarray(greedy_sketch["perm"], dtype=float).reshape(-1, 2)
     voronoi = greedy_sketch["voronoi"]
-    orig_pts = greedy_sketch["persistence_diagram"]
+    orig_pts = np.asarray(greedy_sketch["persistence_diagram"], dtype=float)
+    # We don't show the last frame, so we can always show the bottleneck
+    # distance
+    n_frames = len(greedy_sketch["sketches"]) - 1
 
-    colors = itertools.cycle(colors)
-    point_colors = {
-        tuple(point): next(colors)
-        for point in sorted(perm, key=lambda p: np.linalg.norm(p))
-    }
-    point_colors[DIAGONAL] = diagonal_color
+    cell_colors = _cell_colors(perm, colors, diagonal_color)
+
+    # Points moving to a new cell in each frame, so going forward a frame only
+    # recolors those points
+    changes = [None] + [
+        (pts, cell_colors[cells]) for _k, pts, cells in voronoi.changes()
+    ]
+    state = {"frame": 0}
+
+    main_lines, sub_lines = _bottleneck_lines(greedy_sketch, n_frames)
 
     ax.set_title("Incremental Greedy Sketches")
-    graph = ax.scatter(
-        [point[0] for point in orig_pts], [point[1] for point in orig_pts], s=5
-    )
-    [bneck_main_line] = ax.plot(-1, -1, color="black")
+    graph = ax.scatter(*orig_pts.T, s=5, animated=blit)
+    graph.set_facecolors(cell_colors[voronoi.voronoi_at(0)])
+    sketch_graph = ax.scatter([], [], s=20, color="black", animated=blit)
+    newest_graph = ax.scatter([], [], s=20, color="red", animated=blit)
+    [bneck_main_line] = ax.plot(-1, -1, color="black", animated=blit)
     # Densly dotted linestyle from
     # https://matplotlib.org/stable/gallery/lines_bars_and_markers/linestyles.html
-    [bneck_sub_line] = ax.plot(-1, -1, color="black", linestyle=(0, (1, 1)))
+    [bneck_sub_line] = ax.plot(
+        -1, -1, color="black", linestyle=(0, (1, 1)), animated=blit
+    )
+    artists = (graph, sketch_graph, newest_graph, bneck_main_line, bneck_sub_line)
 
     # Draw the diagonal, scale axes to a little past the final death
-    final_death = max(death for birth, death in orig_pts)
+    final_death = orig_pts[:, Y].max()
     persim.plot_diagrams(
         np.zeros((1, 2)),
         xy_range=[0, final_death * 1.1, 0, final_death * 1.1],
@@ -111,68 +133,157 @@ def make_greedy_sketch_animation(
         # This prevents the final frame from being displayed as if it were a
         # still figure
         plt.close(fig)
+        return artists
 
-    def animate(frame):
-        # Add the sketch point
-        pts = np.concatenate((orig_pts, sketches[frame]), axis=0)
-
-        # Draw points
-        graph.set_offsets(pts)
-        graph.set_facecolors(
-            # Color other points based on their nearest neighbor
-            [point_colors[tuple(voronoi[frame, i])] for i, _pt in enumerate(orig_pts)]
-            # Color all old sketch points
-            + ["black"] * (frame - 1)
-            # Color new sketch point
-            + ["red"]
-        )
-        graph.set_sizes(
-            # Make other points small
-            [5] * len(orig_pts)
-            # Make sketch points large
-            + [20] * (frame)
-        )
+    def update_colors(frame):
+        # Recolor the points in place, without copying every color
+        facecolors = graph.get_facecolors()
+        if frame == state["frame"] + 1:
+            moved, moved_colors = changes[frame]
+            facecolors[moved] = moved_colors
+        elif frame != state["frame"]:
+            facecolors[:] = cell_colors[voronoi.voronoi_at(frame)]
+        graph.stale = True
+        state["frame"] = frame
 
-        # Show bottleneck distance
-        bneck = perm[frame]
-        # We get the first point where the match occurs. This returns two
-        # identical indexes because bottleneck is 2D I believe.
-        bneck_idx = np.where(orig_pts == bneck)[0][0]
-        bneck_nn = voronoi[frame, bneck_idx]
-        if tuple(bneck_nn) == DIAGONAL:
-            bneck_nn = diagonal_point(bneck)
-
-        # We draw these such that the main line always comes from the
-        # bottleneck point.
-        # The way to read this is if we want to draw a line from (x1,y1) to
-        # (x2,y2) we do line.set_data([x1, x2], [y1, y2])
-        if abs(bneck[0] - bneck_nn[0]) > abs(bneck[Y] - bneck_nn[Y]):
-            # The horizontal line (x) is the main line
-            bneck_main_line.set_data([bneck[X], bneck_nn[X]], [bneck[Y], bneck[Y]])
-            bneck_sub_line.set_data([bneck_nn[X], bneck_nn[X]], [bneck[Y], bneck_nn[Y]])
-        else:
-            # The vertical line (y) is the main line
-            bneck_main_line.set_data([bneck[X], bneck[X]], [bneck[Y], bneck_nn[Y]])
-            bneck_sub_line.set_data([bneck[X], bneck_nn[X]], [bneck_nn[Y], bneck_nn[Y]])
+    def animate(frame):
+        update_colors(frame)
+        sketch_graph.set_offsets(perm[: max(frame - 1, 0)])
+        newest_graph.set_offsets(perm[max(frame - 1, 0) : frame])
+        bneck_main_line.set_data(*main_lines[frame])
+        bneck_sub_line.set_data(*sub_lines[frame])
+        return artists
 
     return animation.FuncAnimation(
         fig,
         animate,
         init_func=init_animation,
-        # We don't show the last frame, so we can always show the bottleneck
-        # distance
-        frames=len(sketches) - 1,
+        frames=n_frames,
         interval=500,
+        blit=blit,
     )
 
 
+def greedy_sketch_animation_data(
+    greedy_sketch, colors=DEFAULT_COLORS, diagonal_color=DEFAULT_DIAGONAL_COLOR
+):
+    """Everything drawn by `make_greedy_sketch_animation`, as plain arrays.
+
+    Lets another renderer, like a web page, draw the same animation without
+    matplotlib: the points of each frame are colored by replaying the
+    Voronoi changes up to that frame.
+
+    Parameters
+    ----------
+    greedy_sketch : dict
+        Greedy sketch generated by `greedy_sketch.sketch.naive_greedy_sketch`
+        with `minimal=False`.
+    colors, diagonal_color : optional
+        See `make_greedy_sketch_animation`.
+
+    Returns
+    -------
+    dict
+        "persistence_diagram": The n by 2 array of points of the diagram.
+
+        "perm": The points of the greedy permutation, where frame `k` shows
+        the first `k` of them.
+
+        "radii": Bottleneck distance between each sketch and the diagram.
+
+        "cell_colors": Hex-string color of the Voronoi cell of every point of
+        "perm", with the diagonal last.
+
+        "changes": The Voronoi changes, as "point" and "center" arrays, with
+        the points moving to the cell of `perm[center]` in frame `k` between
+        `starts[k]` and `starts[k + 1]`. Every point starts in the cell of
+        the diagonal, which is center -1.
+
+        "main_lines", "sub_lines": The bottleneck lines of every frame, each
+        line as `((x1, x2), (y1, y2))`.
+
+        "limit": Both axes go from 0 to this.
+    """
+    perm = np.asarray(greedy_sketch["perm"], dtype=float).reshape(-1, 2)
+    voronoi = greedy_sketch["voronoi"]
+    orig_pts = np.asarray(greedy_sketch["persistence_diagram"], dtype=float)
+    main_lines, sub_lines = _bottleneck_lines(
+        greedy_sketch, len(greedy_sketch["sketches"]) - 1
+    )
+    return {
+        "persistence_diagram": orig_pts,
+        "perm": perm,
+        "radii": np.asarray(greedy_sketch["dist"], dtype=float)[:, 0],
+        "cell_colors": [
+            to_hex(color) for color in _cell_colors(perm, colors, diagonal_color)
+        ],
+        "changes": {
+            "starts": transport_starts(voronoi.step, len(perm)),
+            "point": voronoi.point,
+            "center": voronoi.center,
+        },
+        "main_lines": main_lines,
+        "sub_lines": sub_lines,
+        "limit": orig_pts[:, Y].max() * 1.1,
+    }
+
+
+def _cell_colors(perm, colors, diagonal_color):
+    """RGBA colors of the Voronoi cells by index into perm, with the diagonal last."""
+    colors = itertools.cycle(colors)
+    cell_colors = np.empty((len(perm) + 1, 4))
+    for i in np.argsort(np.linalg.norm(perm, axis=1), kind="stable"):
+        cell_colors[i] = to_rgba(next(colors))
+    cell_colors[-1] = to_rgba(diagonal_color)
+    return cell_colors
+
+
+def _bottleneck_lines(greedy_sketch, n_frames):
+    """Lines showing the bottleneck distance in each frame of the animation."""
+    perm = np.asarray(greedy_sketch["perm"], dtype=float).reshape(-1, 2)
+    voronoi = greedy_sketch["voronoi"]
+    # The bottleneck distance of each frame is from the next point of the
+    # greedy permutation to the sketch point of its Voronoi cell
+    frames = np.arange(n_frames)
+    bneck = perm[frames]
+    cells = voronoi.cells_of(greedy_order(greedy_sketch)[frames], frames)
+    bneck_nn = np.where(
+        (cells == -1)[:, None],
+        ((bneck[:, X] + bneck[:, Y]) / 2)[:, None],
+        perm[cells],
+    )
+    # We draw these such that the main line always comes from the bottleneck
+    # point. Each line is ((x1, x2), (y1, y2)) to draw from (x1, y1) to
+    # (x2, y2) with line.set_data.
+    horizontal = np.abs(bneck[:, X] - bneck_nn[:, X]) > np.abs(
+        bneck[:, Y] - bneck_nn[:, Y]
+    )
+    # The horizontal line (x) is the main line, or else the vertical line (y)
+    corner = np.where(
+        horizontal[:, None],
+        np.column_stack((bneck_nn[:, X], bneck[:, Y])),
+        np.column_stack((bneck[:, X], bneck_nn[:, Y])),
+    )
+    main_lines = np.stack((bneck, corner), axis=2)
+    sub_lines = np.stack((corner, bneck_nn), axis=2)
+    return main_lines, sub_lines
+
+
 LIVE_POINT_COLOR = "#FF4500FF"
 DEAD_POINT_COLOR = "#FF450066"
 
 
-def make_persistent_homology_animation(points, data_ax=None, pd_ax=None):
+def make_persistent_homology_animation(
+    points, data_ax=None, pd_ax=None, n_perm=None, frames=110
+):
     """Create matplotlib `Animation` of building persistence diagram set of 2d points.
 
+    Which points of the diagram are born and which have died in each frame is
+    worked out before the first frame, from the births and deaths sorted
+    against the ball radius of every frame, and the balls are one collection
+    whose sizes are set at once. So apart from drawing, a frame costs little
+    even for large point clouds.
+
     Parameters
     ----------
     points : numpy.ndarray
@@ -186,6 +297,15 @@ def make_persistent_homology_animation(points, data_ax=None, pd_ax=None):
         Axis to draw the persistence diagram being built onto. Defaults to a
         subplot of the current `matplotlib.pyplot` figure. Must be part of the
         same figure as `data_ax`.
+    n_perm : int, optional
+        Compute the persistence diagram of a greedy subsample of this many
+        points instead of all of them, see `ripser.ripser`, which is much
+        faster for large point clouds. Balls are only drawn around the
+        subsample, and the plot shows its covering radius `r`: the diagram
+        is within bottleneck distance `2r` of the diagram of all points.
+    frames : int, default=110
+        Number of frames. Each frame grows the balls by 1% of the final
+        death, so the default goes a little past it.
 
     Returns
     -------
@@ -209,19 +329,47 @@ def make_persistent_homology_animation(points, data_ax=None, pd_ax=None):
     if data_ax.figure is not pd_ax.figure:
         raise ValueError("data_ax and pd_ax must be from same figure")
     fig = data_ax.figure
+    points = np.asarray(points, dtype=float)
 
     # Build persistence diagram and calculate how we need to scale the axes for
     # it
-    pd = ripser.ripser(points)["dgms"][1]
-    final_death = max(death for birth, death in pd)
+    subsampled = n_perm is not None and n_perm < len(points)
+    rips = ripser.ripser(points, n_perm=n_perm if subsampled else None)
+    pd = rips["dgms"][1]
+    centers = points[rips["idx_perm"]] if subsampled else points
+    final_death = pd[:, Y].max()
     pd_ax_lim = final_death * 1.1
     radius_arrow_offset = pd_ax_lim / 50
 
+    # Distance shown in every frame, the points of the diagram born by each
+    # frame, which come first when sorted by birth, and the frame each point
+    # dies in
+    dists = np.arange(frames) * (final_death / 100)
+    pd = pd[np.argsort(pd[:, X], kind="stable")]
+    born = np.searchsorted(pd[:, X], dists, side="left")
+    died_at = np.searchsorted(dists, pd[:, Y], side="right")
+    point_colors = np.array([to_rgba(DEAD_POINT_COLOR), to_rgba(LIVE_POINT_COLOR)])
+
     # Build initial state of the plots
-    balls = [
-        data_ax.add_patch(plt.Circle(point, 10, color="lightblue")) for point in points
-    ]
-    data_ax.plot(*points.T, "o")
+    diameters = np.zeros(len(centers))
+    balls = EllipseCollection(
+        diameters,
+        diameters,
+        0,
+        units="xy",
+        offsets=centers,
+        offset_transform=data_ax.transData,
+        color="lightblue",
+    )
+    data_ax.add_collection(balls, autolim=False)
+    if subsampled:
+        data_ax.plot(*points.T, ".", color="grey")
+    data_ax.plot(*centers.T, "o")
+    # Leave room for the balls up to the final death
+    data_ax.update_datalim(
+        np.concatenate((centers - final_death / 2, centers + final_death / 2))
+    )
+    data_ax.autoscale_view()
     [radius_arrow] = pd_ax.plot(
         [radius_arrow_offset], [-radius_arrow_offset], marker=(3, 0, 45), markersize=10
     )
@@ -229,36 +377,48 @@ def make_persistent_homology_animation(points, data_ax=None, pd_ax=None):
     persim.plot_diagrams(
         np.zeros((1, 2)), ax=pd_ax, xy_range=[0, pd_ax_lim, 0, pd_ax_lim], legend=False
     )
+    if subsampled:
+        pd_ax.text(
+            0.98,
+            0.02,
+            f"greedy subsample of {n_perm} points\n"
+            f"approximation radius {rips['r_cover']:.3g}",
+            transform=pd_ax.transAxes,
+            ha="right",
+            va="bottom",
+            fontsize="small",
+        )
 
     def init_animation():
         # This prevents the final frame from being displayed as if it were a
         # still figure
         plt.close(fig)
+        return balls, pd_graph, radius_arrow
 
     def animate(frame):
         # Inflate balls
-        for ball in balls:
-            ball.set_radius(frame * 0.5 * (final_death / 100))
-        dist = frame * (final_death / 100)
+        diameters[:] = dists[frame]
+        balls.set_widths(diameters)
+        balls.set_heights(diameters)
+        dist = dists[frame]
         # Plot points for living and dead loops according to ball radius. For
         # loops that are still alive, plot them as if they're about to die, a
         # bit transparent
-        pd_pts = [(birth, min(death, dist)) for birth, death in pd if birth < dist]
+        pd_pts = pd[: born[frame]].copy()
+        np.minimum(pd_pts[:, Y], dist, out=pd_pts[:, Y])
         pd_graph.set_offsets(pd_pts)
         pd_graph.set_facecolors(
-            [
-                LIVE_POINT_COLOR if death < dist else DEAD_POINT_COLOR
-                for birth, death in pd_pts
-            ]
+            point_colors[(died_at[: born[frame]] <= frame).astype(int)]
         )
         radius_arrow.set_data(
             [dist + radius_arrow_offset], [dist - radius_arrow_offset]
         )
+        return balls, pd_graph, radius_arrow
 
     return animation.FuncAnimation(
         fig,
         animate,
         init_func=init_animation,
-        frames=110,
+        frames=frames,
         interval=50,
     )
@@ -16,7 +16,7 @@ setuptools.setup(
     url="https://github.com/Dinokaiz2/greedy-sketch-viz",
     install_requires=[
         "persim",
-        "matplotlib",
+        "matplotlib>=3.6",
         "numpy",
     ],
     packages=setuptools.find_packages(),
@@ -25,5 +25,5 @@ setuptools.setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires=">=3.6",
+    python_requires=">=3.8",
 )
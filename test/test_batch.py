@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pytest
+
+from greedy_sketch import batch
+from greedy_sketch import sketch as gs
+from greedy_sketch.batch import batch_greedy_sketch, intersketch_bd_matrix
+
+
+def random_pds(count, seed, max_size=120):
+    rng = np.random.default_rng(seed)
+    pds = []
+    for size in rng.integers(0, max_size, count):
+        births = rng.uniform(0, 100, size)
+        pds.append(np.column_stack((births, births + rng.exponential(20, size))))
+    return pds
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_batch_matches_single(workers):
+    """Case: Batch sketches match sketching each diagram on its own, in input order"""
+    pds = random_pds(12, 0)
+    results = batch_greedy_sketch(pds, n=40, workers=workers)
+    assert len(results) == len(pds)
+    for pd, result in zip(pds, results):
+        expected = gs.naive_greedy_sketch(pd, min(40, len(pd)), engine="numpy")
+        assert (result["perm"] == expected["perm"]).all()
+        for key in ["step", "source", "target", "count"]:
+            assert (result["transport"][key] == expected["transport"][key]).all()
+        assert result["transport"]["size"] == len(pd)
+        assert (result["transport"]["perm"] == result["perm"]).all()
+
+
+def test_batch_passes_options():
+    """Case: Batch sketching passes options on to naive_greedy_sketch"""
+    pds = [[[2, 4], [2, 4], [3, 6]], [[2, 4]]]
+    results = batch_greedy_sketch(pds, workers=2, collapse_duplicates=True)
+    assert (results[0]["perm"] == [[3, 6], [2, 4]]).all()
+    assert (gs.compute_mult(results[0]["transport"]) == [1, 2, 0]).all()
+    assert (results[1]["perm"] == [[2, 4]]).all()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_intersketch_bd_matrix(workers, tmp_path):
+    """Case: Distance matrix matches pairwise intersketch_bd"""
+    pds = [pd for pd in random_pds(7, 1, max_size=30) if len(pd)]
+    plans_list = [r["transport"] for r in batch_greedy_sketch(pds, workers=1)]
+    expected = np.zeros((len(pds), len(pds)))
+    for i, a in enumerate(plans_list):
+        for j, b in enumerate(plans_list):
+            expected[i, j] = gs.intersketch_bd(
+                gs.truncate_transport(a, 3), gs.truncate_transport(b, 3)
+            )
+
+    matrix = intersketch_bd_matrix(plans_list, 3, workers, chunk_size=4)
+    assert np.allclose(matrix, expected)
+
+    path = str(tmp_path / "matrix.npy")
+    intersketch_bd_matrix(plans_list, 3, workers, out=path, chunk_size=4)
+    assert np.allclose(np.load(path, mmap_mode="r"), expected)
+
+
+def test_intersketch_bd_matrix_leaves_no_sketches():
+    """Case: Computing distances in this process doesn't keep the sketches around"""
+    pds = [pd for pd in random_pds(4, 2, max_size=30) if len(pd)]
+    plans_list = [r["transport"] for r in batch_greedy_sketch(pds, workers=1)]
+    intersketch_bd_matrix(plans_list, 3, workers=1)
+    assert batch._sketches is None
+
+
+def test_mirror_upper():
+    """Case: Upper triangle copied to the lower one across blocks of rows"""
+    upper = np.triu(np.random.default_rng(4).uniform(size=(9, 9)))
+    out = upper.copy()
+    # Two rows of 9 floats per block
+    batch._mirror_upper(out, block_bytes=2 * 9 * 8)
+    assert (out == upper + np.triu(upper, 1).T).all()
+
+
+def test_intersketch_bd_matrix_dict_plans():
+    """Case: Distance matrix accepts dict transport plans"""
+    default_pd = [[2, 4], [3, 6], [4, 8], [5, 10], [6, 24], [7, 35], [10, 50], [12, 60]]
+    plans = gs.naive_greedy_sketch(default_pd)["transport_plans"]
+    double_plans = gs.naive_greedy_sketch([[2, 4], [3, 6]])["transport_plans"]
+    matrix = intersketch_bd_matrix([plans, double_plans], 1, workers=1)
+    assert (matrix == [[0, 24], [24, 0]]).all()
+
+
+def test_batch_error_frees_results():
+    """Case: A failing diagram doesn't leak the shared memory of the others"""
+    # The largest diagram is handed out first, so the others finish after it
+    bad = np.vstack(random_pds(1, 3, max_size=2) + [[[0, np.inf]]] * 500)
+    pds = random_pds(6, 2) + [bad]
+    before = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else None
+    with pytest.raises(ValueError):
+        batch_greedy_sketch(pds, workers=2)
+    if before is not None:
+        assert set(os.listdir("/dev/shm")) <= before
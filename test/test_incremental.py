@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from greedy_sketch import sketch as gs
+from greedy_sketch.incremental import IncrementalGreedySketch, warm_greedy_sketch
+
+
+def random_pd(size, seed):
+    rng = np.random.default_rng(seed)
+    births = rng.integers(0, 30, size)
+    return np.column_stack((births, births + rng.integers(0, 15, size))).astype(float)
+
+
+def assert_matches_cold_start(inc):
+    assert_same_result(inc.points, inc.result(dict_plans=True))
+
+
+def assert_same_result(pd, actual):
+    expected = gs.naive_greedy_sketch(pd, minimal=False, engine="numpy")
+    assert (expected["perm"] == actual["perm"]).all()
+    assert (expected["dist"] == actual["dist"]).all()
+    assert expected["transport_plans"] == actual["transport_plans"]
+    for k in range(len(expected["perm"]) + 1):
+        assert (
+            expected["voronoi"].voronoi_at(k) == actual["voronoi"].voronoi_at(k)
+        ).all()
+
+
+@pytest.mark.parametrize("engine", ["numpy", "grid"])
+def test_insert_remove_match_cold_start(engine):
+    """Case: Inserting and removing points gives the sketch of the new diagram"""
+    rng = np.random.default_rng(0)
+    inc = IncrementalGreedySketch(random_pd(40, 1), engine=engine)
+    assert_matches_cold_start(inc)
+    for seed in range(2, 14):
+        # Integer points, so some inserted points repeat existing ones
+        inc.insert(random_pd(rng.integers(0, 5), seed))
+        assert_matches_cold_start(inc)
+        inc.remove(inc.points[rng.choice(len(inc), 2, replace=False)])
+        assert_matches_cold_start(inc)
+
+
+def test_insert_near_diagonal_reuses_prefix():
+    """Case: Points close to the diagonal only change the end of the permutation"""
+    inc = IncrementalGreedySketch(random_pd(60, 3))
+    inc.insert([[10, 10.5]])
+    assert inc.reused >= len(inc) - 20
+    assert_matches_cold_start(inc)
+
+
+def test_remove_missing_point():
+    """Case: Removing a point which isn't in the diagram is an error"""
+    inc = IncrementalGreedySketch([[2, 4]])
+    with pytest.raises(ValueError):
+        inc.remove([[3, 6]])
+    inc.remove([[2, 4]])
+    assert len(inc) == 0
+    assert len(inc.result()["perm"]) == 0
+
+
+@pytest.mark.parametrize("engine", ["numpy", "grid"])
+def test_warm_start_matches_cold_start(engine):
+    """Case: Warm-started sketches of a changing diagram match cold starts"""
+    rng = np.random.default_rng(4)
+    pd = random_pd(50, 5)
+    previous = gs.naive_greedy_sketch(pd, minimal=False)
+    for seed in range(6, 26):
+        pd = np.vstack((pd[rng.random(len(pd)) > 0.1], random_pd(3, seed)))
+        if seed % 3 == 0:
+            pd = pd[rng.permutation(len(pd))]
+        previous = warm_greedy_sketch(pd, previous, engine=engine, dict_plans=True)
+        assert_same_result(pd, previous)
+
+
+def test_warm_start_reuses_steps():
+    """Case: Warm start keeps the greedy permutation up to the first change"""
+    pd = random_pd(60, 6)
+    previous = gs.naive_greedy_sketch(pd, minimal=False)
+    ret = warm_greedy_sketch(np.vstack((pd, [[10, 10.5]])), previous)
+    assert ret["reused"] >= 40
+    assert warm_greedy_sketch(pd, previous)["reused"] == len(pd)
+    # With a matching that leaves every point out, nothing is reused
+    ret = warm_greedy_sketch(
+        pd, previous, matching=np.full(len(pd), -1), dict_plans=True
+    )
+    assert ret["reused"] == 0
+    assert_same_result(pd, ret)
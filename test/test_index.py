@@ -0,0 +1,57 @@
+import numpy as np
+import persim
+import pytest
+
+from greedy_sketch.index import SketchIndex
+
+
+def clustered_pds(count, seed, size=15):
+    """Diagrams around a few different centers, so most are far from a query."""
+    rng = np.random.default_rng(seed)
+    pds = []
+    for center in rng.integers(0, 4, count):
+        births = rng.uniform(0, 10, size) + 40 * center
+        pds.append(np.column_stack((births, births + rng.exponential(5, size))))
+    return pds
+
+
+@pytest.fixture
+def index():
+    return SketchIndex(clustered_pds(16, 0), levels=(2, 6))
+
+
+@pytest.mark.parametrize("k", [1, 3])
+def test_nearest_matches_brute_force(index, k):
+    """Case: Nearest neighbors match comparing the query with every diagram"""
+    for query in clustered_pds(3, 1):
+        expected = sorted(persim.bottleneck(query, pd) for pd in index.diagrams)[:k]
+        indices, distances = index.nearest(query, k)
+        assert list(distances) == expected
+        for i, d in zip(indices, distances):
+            assert persim.bottleneck(query, index.diagrams[i]) == d
+    assert index.avoided > 0
+    assert index.evaluated + index.avoided == 3 * len(index)
+
+
+def test_within_matches_brute_force(index):
+    """Case: Range queries match comparing the query with every diagram"""
+    for query in clustered_pds(3, 2):
+        distances = np.array([persim.bottleneck(query, pd) for pd in index.diagrams])
+        radius = np.median(distances)
+        expected = np.flatnonzero(distances <= radius)
+        assert (index.within(query, radius) == expected).all()
+
+
+def test_save_load(index, tmp_path):
+    """Case: A saved index answers queries the same after loading"""
+    query = clustered_pds(1, 3)[0]
+    expected = index.nearest(query, 2)
+    index.save(tmp_path / "index.npz")
+    loaded = SketchIndex.load(tmp_path / "index.npz")
+    assert loaded.levels == index.levels
+    assert (loaded.radii == index.radii).all()
+    for a, b in zip(loaded.diagrams, index.diagrams):
+        assert (a == b).all()
+    actual = loaded.nearest(query, 2)
+    assert (actual[0] == expected[0]).all()
+    assert (actual[1] == expected[1]).all()
@@ -1,3 +1,7 @@
+import numpy as np
+import persim
+import pytest
+
 from greedy_sketch import sketch as gs
 
 default_pd = [[2, 4], [3, 6], [4, 8], [5, 10], [6, 24], [7, 35], [10, 50], [12, 60]]
@@ -139,3 +143,390 @@ def test_intersketch_bd_diff():
 
     bd = gs.intersketch_bd(transport_plans[:2], double_transport_plans[:2])
     assert bd == 24
+
+
+def random_pd(size, seed, integer=False):
+    """Random persistence diagram with deaths after births"""
+    rng = np.random.default_rng(seed)
+    if integer:
+        births = rng.integers(0, 10, size)
+        deaths = births + rng.integers(0, 10, size)
+    else:
+        births = rng.uniform(0, 100, size)
+        deaths = births + rng.exponential(20, size)
+    return np.column_stack((births, deaths)).astype(float)
+
+
+def assert_same_sketch(expected, actual):
+    assert (expected["perm"] == actual["perm"]).all()
+    assert expected["transport_plans"] == actual["transport_plans"]
+    assert (expected["dist"] == actual["dist"]).all()
+    for k in range(len(expected["voronoi"])):
+        assert (expected["voronoi"][k] == actual["voronoi"][k]).all()
+        assert (
+            expected["voronoi"].voronoi_at(k) == actual["voronoi"].voronoi_at(k)
+        ).all()
+
+
+@pytest.mark.parametrize("engine", ["numpy", "grid", "threaded"])
+@pytest.mark.parametrize("pd", [single_pd, double_pd, default_pd])
+def test_engine_default_pds(engine, pd):
+    """Case: Engine matches python engine on the fixed pds"""
+    expected = gs.naive_greedy_sketch(pd, minimal=False)
+    actual = gs.naive_greedy_sketch(pd, minimal=False, engine=engine)
+    assert_same_sketch(expected, actual)
+
+
+@pytest.mark.parametrize("engine", ["numpy", "grid", "threaded"])
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("integer", [False, True])
+def test_engine_random_pds(engine, seed, integer):
+    """Case: Engine matches python engine on random pds, including ties and duplicates"""
+    pd = random_pd(60, seed, integer)
+    expected = gs.naive_greedy_sketch(pd, minimal=False)
+    actual = gs.naive_greedy_sketch(pd, minimal=False, engine=engine)
+    assert_same_sketch(expected, actual)
+
+
+@pytest.mark.parametrize("engine", ["numpy", "grid", "threaded"])
+def test_engine_partial(engine):
+    """Case: Engine matches python engine for a partial greedy permutation"""
+    pd = random_pd(40, 0)
+    expected = gs.naive_greedy_sketch(pd, n=10)
+    actual = gs.naive_greedy_sketch(pd, n=10, engine=engine)
+    assert (expected["perm"] == actual["perm"]).all()
+    assert expected["transport_plans"] == actual["transport_plans"]
+
+
+def test_unknown_engine():
+    """Case: Unknown engine rejected"""
+    with pytest.raises(ValueError):
+        gs.naive_greedy_sketch(default_pd, engine="fortran")
+
+
+@pytest.mark.parametrize("integer", [False, True])
+def test_threaded_engine_chunks(monkeypatch, integer):
+    """Case: Threaded engine matches numpy engine when split into many chunks"""
+    monkeypatch.setattr(gs, "THREAD_CHUNK", 7)
+    monkeypatch.setattr(gs.os, "cpu_count", lambda: 4)
+    pd = random_pd(60, 3, integer)
+    expected = gs.naive_greedy_sketch(pd, minimal=False, engine="numpy")
+    actual = gs.naive_greedy_sketch(pd, minimal=False, engine="threaded")
+    assert_same_sketch(expected, actual)
+
+
+def test_grid_engine_large_pd():
+    """Case: Grid engine matches numpy engine on a pd large enough to prune"""
+    pd = random_pd(2000, 1)
+    expected = gs.naive_greedy_sketch(pd, engine="numpy")
+    actual = gs.naive_greedy_sketch(pd, engine="grid")
+    assert (expected["perm"] == actual["perm"]).all()
+    assert expected["transport_plans"] == actual["transport_plans"]
+
+
+def test_transport_arrays():
+    """Case: Correct flat transportation plans computed for an 8 point pd"""
+    transport = gs.naive_greedy_sketch(default_pd)["transport"]
+    assert transport["size"] == 8
+    assert (transport["step"] == [1, 2, 3, 4, 5, 6, 7, 8]).all()
+    assert (transport["source"] == [-1, -1, 0, -1, -1, -1, -1, -1]).all()
+    assert (transport["target"] == [0, 1, 2, 3, 4, 5, 6, 7]).all()
+    assert (transport["count"] == [2, 1, 1, 1, 1, 1, 1, 1]).all()
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy", "grid", "threaded"])
+def test_transport_round_trip(engine):
+    """Case: Flat and dict transportation plans convert into each other"""
+    pd_sketch = gs.naive_greedy_sketch(random_pd(50, 3), engine=engine)
+    transport = gs.transport_from_plans(pd_sketch["perm"], pd_sketch["transport_plans"])
+    for key in ["step", "source", "target", "count"]:
+        assert (transport[key] == pd_sketch["transport"][key]).all()
+    assert gs.transport_to_plans(pd_sketch["transport"]) == pd_sketch["transport_plans"]
+
+
+def test_mult_arrays():
+    """Case: compute_mult on flat plans agrees with compute_mult on dicts"""
+    pd_sketch = gs.naive_greedy_sketch(random_pd(50, 4))
+    perm = pd_sketch["perm"]
+    for k in [0, 1, 7, 50]:
+        mult = gs.compute_mult(pd_sketch["transport"], k)
+        expected = gs.compute_mult(pd_sketch["transport_plans"][: k + 1])
+        assert mult[-1] == expected[(0, 0)]
+        for point, count in zip(perm[:k], mult[:-1]):
+            assert count == expected[tuple(point)]
+
+
+def test_mult_duplicate_points():
+    """Case: Flat plans keep coinciding sketch points apart"""
+    pd_sketch = gs.naive_greedy_sketch([[2, 4], [2, 4], [2, 4]], engine="numpy")
+    # Once every point is covered, the greedy permutation repeats its last point
+    assert (gs.compute_mult(pd_sketch["transport"]) == [3, 0, 0, 0]).all()
+
+
+def test_intersketch_bd_arrays():
+    """Case: intersketch_bd agrees on flat and dict plans"""
+    pd_sketch = gs.naive_greedy_sketch(default_pd, dict_plans=False)
+    assert "transport_plans" not in pd_sketch
+    transport = pd_sketch["transport"]
+    bd = gs.intersketch_bd(
+        gs.truncate_transport(transport, 1), gs.truncate_transport(transport, 8)
+    )
+    assert bd == 14
+
+
+def test_generate_sketches_arrays():
+    """Case: generate_sketches agrees on flat and dict plans"""
+    pd_sketch = gs.naive_greedy_sketch(default_pd)
+    from_dicts = gs.generate_sketches(pd_sketch["perm"], pd_sketch["transport_plans"])
+    from_arrays = gs.generate_sketches(pd_sketch["perm"], pd_sketch["transport"])
+    assert len(from_dicts) == len(from_arrays) == 9
+    for (points_a, mult_a), (points_b, mult_b) in zip(from_dicts, from_arrays):
+        assert (points_a == points_b).all()
+        assert (mult_a == mult_b).all()
+    assert (from_arrays[1][1] == [2, 6]).all()
+
+
+def test_sketch_sequence():
+    """Case: SketchSequence matches generate_sketches in any access order"""
+    pd_sketch = gs.naive_greedy_sketch(random_pd(30, 5), minimal=False)
+    expected = gs.generate_sketches(pd_sketch["perm"], pd_sketch["transport_plans"])
+    for checkpoint_every in [None, 4]:
+        seq = gs.SketchSequence(pd_sketch["transport"], checkpoint_every)
+        assert len(seq) == 31
+        order = list(range(31)) + [30, 3, 17, 0, 25, 9, 9, 2]
+        for k in order:
+            points, mult = seq[k]
+            assert (points == expected[k][0]).all()
+            assert (mult == expected[k][1]).all()
+
+
+def test_sketch_sequence_slice():
+    """Case: Slicing and iterating a SketchSequence"""
+    seq = gs.naive_greedy_sketch(default_pd, minimal=False)["sketches"]
+    assert len(seq[2:7:2]) == 3
+    assert (seq[2:7:2][1][1] == seq[4][1]).all()
+    assert [len(mult) for points, mult in seq[-3:]] == [7, 8, 9]
+    assert (seq[-1][1] == [1, 1, 1, 1, 1, 1, 1, 1, 0]).all()
+
+
+def test_voronoi_changes():
+    """Case: Correct voronoi changes recorded for a pd"""
+    voronoi = gs.naive_greedy_sketch(default_pd, minimal=False)["voronoi"]
+    changes = list(voronoi.changes())
+    assert len(changes) == 8
+    k, points, centers = changes[0]
+    assert k == 1
+    assert (points == [6, 7]).all()
+    assert (centers == [0, 0]).all()
+    k, points, centers = changes[2]
+    assert (points == [6]).all()
+    assert (centers == [2]).all()
+    assert (voronoi.voronoi_at(3) == [-1, -1, -1, -1, -1, 1, 2, 0]).all()
+    assert (voronoi[3, 6] == [10, 50]).all()
+
+
+def test_voronoi_snapshots():
+    """Case: Voronoi cells agree with and without snapshots"""
+    voronoi = gs.naive_greedy_sketch(random_pd(40, 6), minimal=False)["voronoi"]
+    snapshotted = gs.VoronoiHistory(
+        voronoi.perm, voronoi.size, voronoi.step, voronoi.point, voronoi.center, 7
+    )
+    for k in range(len(voronoi)):
+        assert (voronoi.voronoi_at(k) == snapshotted.voronoi_at(k)).all()
+
+
+def test_voronoi_cells_of():
+    """Case: Cells of single points agree with the whole Voronoi diagram"""
+    voronoi = gs.naive_greedy_sketch(random_pd(40, 7), minimal=False)["voronoi"]
+    points, ks = np.meshgrid(np.arange(voronoi.size), np.arange(len(voronoi)))
+    cells = voronoi.cells_of(points.ravel(), ks.ravel()).reshape(ks.shape)
+    for k in range(len(voronoi)):
+        assert (cells[k] == voronoi.voronoi_at(k)).all()
+
+
+@pytest.mark.parametrize("integer", [False, True])
+def test_greedy_order(integer):
+    """Case: The greedy order indexes every point of the permutation"""
+    pd = random_pd(40, 8, integer=integer)
+    result = gs.naive_greedy_sketch(pd, minimal=False)
+    assert (pd[gs.greedy_order(result)] == result["perm"]).all()
+
+
+def test_unique_points():
+    """Case: Repeated points merged in order of first occurrence"""
+    points, weights, inverse = gs.unique_points([[3, 6], [2, 4], [3, 6], [3, 6]])
+    assert (points == [[3, 6], [2, 4]]).all()
+    assert (weights == [3, 1]).all()
+    assert (inverse == [0, 1, 0, 0]).all()
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy", "grid", "threaded"])
+def test_collapse_duplicates(engine):
+    """Case: Merging repeated points gives the same sketches as keeping them"""
+    pd = random_pd(80, 7, integer=True)
+    expected = gs.naive_greedy_sketch(pd, minimal=False, engine="numpy")
+    actual = gs.naive_greedy_sketch(
+        pd, minimal=False, engine=engine, collapse_duplicates=True
+    )
+    distinct = len(gs.unique_points(pd)[0])
+    assert len(actual["perm"]) == distinct < len(pd)
+    assert (actual["perm"] == expected["perm"][:distinct]).all()
+    assert (actual["dist"] == expected["dist"][:distinct]).all()
+    for k in range(distinct + 1):
+        assert (
+            gs.compute_mult(actual["transport"], k)
+            == gs.compute_mult(expected["transport"], k)
+        ).all()
+        assert (
+            actual["voronoi"].voronoi_at(k) == expected["voronoi"].voronoi_at(k)
+        ).all()
+    assert actual["transport_plans"][0] == {(0, 0): 80}
+
+
+def test_collapse_duplicates_too_long():
+    """Case: Greedy permutation cannot be longer than the distinct points"""
+    with pytest.raises(ValueError):
+        gs.naive_greedy_sketch([[2, 4], [2, 4]], n=2, collapse_duplicates=True)
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_sketch_bd_matches_persim(seed):
+    """Case: sketch_bd matches persim on diagrams expanded by multiplicity"""
+    rng = np.random.default_rng(seed)
+    sketches = []
+    for size in rng.integers(0, 6, 2):
+        points = random_pd(size, rng.integers(1000), integer=True)
+        sketches.append((points, rng.integers(0, 4, size)))
+    expanded = [np.repeat(points, mult, axis=0) for points, mult in sketches]
+    assert gs.sketch_bd(*sketches) == persim.bottleneck(*expanded)
+
+
+def test_sketch_bd_infinite():
+    """Case: sketch_bd ignores points with infinite death, like persim"""
+    sketch_a = (np.array([[0, np.inf], [1, 5]]), np.array([3, 1]))
+    sketch_b = (np.array([[1, 4]]), np.array([2]))
+    assert gs.sketch_bd(sketch_a, sketch_b) == 1.5
+
+
+def test_sketch_bd_large_multiplicities():
+    """Case: sketch_bd matches persim on sketches with large multiplicities"""
+    seq = gs.naive_greedy_sketch(random_pd(150, 8), minimal=False)["sketches"]
+    for a, b in [(3, 5), (1, 8), (0, 4)]:
+        expanded = [
+            np.repeat(points, mult, axis=0) for points, mult in (seq[a], seq[b])
+        ]
+        assert gs.sketch_bd(seq[a], seq[b]) == persim.bottleneck(*expanded)
+
+
+@pytest.mark.parametrize("snapshot_every", ["auto", None, 1, 3])
+def test_naive_greedy_sketch_snapshots(snapshot_every):
+    """Case: Voronoi snapshot spacing passed through naive_greedy_sketch"""
+    pd = random_pd(30, 9)
+    expected = gs.naive_greedy_sketch(pd, minimal=False, snapshot_every=None)
+    actual = gs.naive_greedy_sketch(
+        pd, minimal=False, engine="numpy", snapshot_every=snapshot_every
+    )
+    for k in range(len(expected["voronoi"])):
+        assert (expected["voronoi"][k] == actual["voronoi"][k]).all()
+    if snapshot_every == 3:
+        assert sorted(actual["voronoi"]._snapshots) == list(range(0, 31, 3))
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy", "grid", "threaded"])
+def test_non_finite_rejected(engine):
+    """Case: Every engine rejects points with infinite death"""
+    pd = [[0, np.inf], [1, 5], [2, 3], [0.5, 4]]
+    with pytest.raises(ValueError):
+        gs.naive_greedy_sketch(pd, engine=engine)
+    finite = np.array(pd)[np.isfinite(pd).all(axis=1)]
+    expected = gs.naive_greedy_sketch(finite, minimal=False)
+    assert_same_sketch(
+        expected, gs.naive_greedy_sketch(finite, minimal=False, engine=engine)
+    )
+
+
+@pytest.mark.parametrize("engine", ["numpy", "grid", "threaded"])
+@pytest.mark.parametrize("collapse", [False, True])
+def test_resume_matches_full(engine, collapse):
+    """Case: Resuming a stopped greedy permutation gives the full one"""
+    pd = random_pd(60, 10, integer=True)
+    options = dict(minimal=False, engine=engine, collapse_duplicates=collapse)
+    expected = gs.naive_greedy_sketch(pd, **options)
+    partial = gs.naive_greedy_sketch(pd, max_points=7, **options)
+    assert partial["stopped"] == "max_points"
+    assert len(partial["perm"]) == 7
+    middle = gs.resume_greedy_sketch(partial, n=20, resumable=True)
+    assert middle["stopped"] == "n"
+    assert_same_sketch(expected, gs.resume_greedy_sketch(middle))
+    # The partial result is left as is, so it can be resumed again
+    assert len(partial["perm"]) == 7
+    assert_same_sketch(expected, gs.resume_greedy_sketch(partial))
+
+
+@pytest.mark.parametrize("engine", ["numpy", "grid", "threaded"])
+def test_tolerance(engine):
+    """Case: Tolerance stops at the smallest sketch within tolerance"""
+    pd = random_pd(100, 11)
+    full = gs.naive_greedy_sketch(pd, minimal=False, engine="numpy")
+    tolerance = float(full["dist"][12, 0])
+    ret = gs.naive_greedy_sketch(pd, engine=engine, tolerance=tolerance)
+    k = len(ret["perm"])
+    assert ret["stopped"] == "tolerance"
+    assert ret["radius"] <= tolerance < full["dist"][k - 1, 0]
+    sketch = full["sketches"][k]
+    expanded = np.repeat(*sketch, axis=0)
+    assert persim.bottleneck(expanded, pd) <= tolerance
+
+
+def test_time_budget():
+    """Case: An exhausted time budget still adds one point and can be resumed"""
+    pd = random_pd(50, 12)
+    ret = gs.naive_greedy_sketch(pd, minimal=False, engine="grid", time_budget=0)
+    assert ret["stopped"] == "time_budget"
+    assert len(ret["perm"]) == 1
+    expected = gs.naive_greedy_sketch(pd, minimal=False)
+    assert_same_sketch(expected, gs.resume_greedy_sketch(ret))
+
+
+@pytest.mark.parametrize("engine", ["numpy", "grid", "threaded"])
+def test_resumable(engine):
+    """Case: A permutation cut short by n only keeps its state with resumable=True"""
+    pd = random_pd(60, 15)
+    assert "state" not in gs.naive_greedy_sketch(pd, 8, engine=engine)
+    partial = gs.naive_greedy_sketch(pd, 8, engine=engine, resumable=True)
+    assert "state" not in gs.resume_greedy_sketch(partial, 20)
+    expected = gs.naive_greedy_sketch(pd, engine=engine)
+    assert (gs.resume_greedy_sketch(partial)["perm"] == expected["perm"]).all()
+
+
+def test_stopping_needs_resumable_engine():
+    """Case: Stopping criteria rejected by the python engine"""
+    with pytest.raises(ValueError):
+        gs.naive_greedy_sketch(default_pd, tolerance=1)
+    with pytest.raises(ValueError):
+        gs.naive_greedy_sketch(default_pd, resumable=True)
+    with pytest.raises(ValueError):
+        gs.resume_greedy_sketch(gs.naive_greedy_sketch(default_pd, engine="numpy"))
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy", "grid", "threaded"])
+def test_progress(engine):
+    """Case: Progress reported after every step, counting the points which moved"""
+    pd = random_pd(40, 13)
+    calls = []
+    ret = gs.naive_greedy_sketch(
+        pd, minimal=False, engine=engine, progress=lambda *args: calls.append(args)
+    )
+    steps, reassigned, elapsed = zip(*calls)
+    assert list(steps) == list(range(1, len(pd) + 1))
+    assert sum(reassigned) == len(ret["voronoi"].step)
+    assert list(elapsed) == sorted(elapsed)
+
+
+def test_progress_resumed():
+    """Case: Progress of a resumed sketch counts on from where it stopped"""
+    pd = random_pd(40, 14)
+    ret = gs.naive_greedy_sketch(pd, engine="grid", max_points=10)
+    calls = []
+    gs.resume_greedy_sketch(ret, progress=lambda *args: calls.append(args))
+    assert [step for step, _, _ in calls] == list(range(11, len(pd) + 1))
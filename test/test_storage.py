@@ -0,0 +1,81 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from greedy_sketch import sketch as gs
+from greedy_sketch.storage import load_sketch, save_sketch
+
+
+def random_pd(size, seed):
+    rng = np.random.default_rng(seed)
+    births = rng.uniform(0, 100, size)
+    return np.column_stack((births, births + rng.exponential(20, size)))
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load_full(tmp_path, mmap):
+    """Case: A saved result loads back with the same sketches and Voronoi cells"""
+    expected = gs.naive_greedy_sketch(random_pd(40, 0), minimal=False)
+    save_sketch(expected, tmp_path)
+    actual = load_sketch(tmp_path, mmap=mmap, dict_plans=True)
+    assert isinstance(actual["perm"], np.memmap) == mmap
+    assert (actual["perm"] == expected["perm"]).all()
+    assert (actual["dist"] == expected["dist"]).all()
+    assert (actual["persistence_diagram"] == expected["persistence_diagram"]).all()
+    assert actual["transport_plans"] == expected["transport_plans"]
+    for k in [0, 7, 40, 3]:
+        for a, b in zip(actual["sketches"][k], expected["sketches"][k]):
+            assert (a == b).all()
+        assert (actual["voronoi"][k] == expected["voronoi"][k]).all()
+
+
+def test_save_load_minimal(tmp_path):
+    """Case: A minimal, stopped result keeps its stop reason and radius"""
+    expected = gs.naive_greedy_sketch(random_pd(40, 1), engine="grid", max_points=5)
+    save_sketch(expected, tmp_path)
+    actual = load_sketch(tmp_path)
+    assert set(actual) == {"perm", "transport", "stopped", "radius"}
+    assert actual["stopped"] == "max_points"
+    assert actual["radius"] == expected["radius"]
+    for k in range(6):
+        assert (
+            gs.compute_mult(actual["transport"], k)
+            == gs.compute_mult(expected["transport"], k)
+        ).all()
+
+
+def test_load_newer_version(tmp_path):
+    """Case: Loading a sketch written by a newer format version is an error"""
+    save_sketch(gs.naive_greedy_sketch([[2, 4]]), tmp_path)
+    with open(os.path.join(tmp_path, "meta.json")) as f:
+        meta = json.load(f)
+    meta["version"] += 1
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    with pytest.raises(ValueError):
+        load_sketch(tmp_path)
+
+
+def test_save_load_snapshots(tmp_path):
+    """Case: Voronoi snapshots are saved, so loaded cells don't replay from sketch 0"""
+    expected = gs.naive_greedy_sketch(random_pd(40, 2), minimal=False)
+    save_sketch(expected, tmp_path)
+    voronoi = load_sketch(tmp_path)["voronoi"]
+    assert set(voronoi._snapshots) == set(expected["voronoi"]._snapshots)
+    for k, cells in expected["voronoi"]._snapshots.items():
+        assert (voronoi._snapshots[k] == cells).all()
+
+
+def test_overwrite_removes_meta_first(tmp_path, monkeypatch):
+    """Case: A sketch overwritten part way leaves no meta.json describing it"""
+    save_sketch(gs.naive_greedy_sketch(random_pd(40, 3), minimal=False), tmp_path)
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(np, "save", fail)
+    with pytest.raises(OSError):
+        save_sketch(gs.naive_greedy_sketch(random_pd(20, 4)), tmp_path)
+    assert not os.path.exists(os.path.join(tmp_path, "meta.json"))
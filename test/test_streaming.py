@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from greedy_sketch import sketch as gs
+from greedy_sketch.streaming import streaming_greedy_sketch
+
+
+def random_pd(size, seed):
+    rng = np.random.default_rng(seed)
+    births = rng.uniform(0, 100, size)
+    return np.column_stack((births, births + rng.exponential(20, size)))
+
+
+@pytest.mark.parametrize("n", [1, 5, 30])
+def test_streaming_bound(n):
+    """Case: Streaming sketch is within its bound, at most 8 greedy radii"""
+    pd = random_pd(80, n)
+    ret = streaming_greedy_sketch(pd, n, chunk_size=37)
+    assert ret["approximate"]
+    assert len(ret["perm"]) <= n
+    points, mult = gs.sketch_points(ret["transport"])
+    assert mult.sum() == len(pd)
+    assert (mult >= 0).all()
+    full = (pd, np.ones(len(pd), dtype=int))
+    assert gs.sketch_bd((points, mult), full) <= ret["bound"]
+    radius = gs.naive_greedy_sketch(pd, n, engine="grid")["radius"]
+    assert ret["bound"] <= 8 * radius
+
+
+def test_streaming_inputs(tmp_path):
+    """Case: Arrays, .npy files and chunk iterables give the same sketch"""
+    pd = random_pd(100, 0)
+    np.save(tmp_path / "pd.npy", pd)
+    expected = streaming_greedy_sketch(pd, 10, chunk_size=25)
+    for source in [tmp_path / "pd.npy", str(tmp_path / "pd.npy"), np.split(pd, 4)]:
+        actual = streaming_greedy_sketch(source, 10, chunk_size=25)
+        assert (actual["perm"] == expected["perm"]).all()
+        assert actual["transport_plans"] == expected["transport_plans"]
+        assert actual["bound"] == expected["bound"]
+
+
+def test_streaming_small_diagram_exact():
+    """Case: A diagram with at most n distinct points is sketched exactly"""
+    expected = gs.naive_greedy_sketch(random_pd(8, 1))
+    ret = streaming_greedy_sketch(random_pd(8, 1), 8)
+    assert ret["bound"] == 0
+    assert ret["transport_plans"] == expected["transport_plans"]
@@ -0,0 +1,140 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+import ripser  # noqa: E402
+from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: E402
+from matplotlib.colors import to_hex, to_rgba  # noqa: E402
+from matplotlib.figure import Figure  # noqa: E402
+
+from greedy_sketch import sketch as gs  # noqa: E402
+from greedy_sketch import viz  # noqa: E402
+
+
+def random_pd(size, seed):
+    rng = np.random.default_rng(seed)
+    births = rng.integers(0, 10, size)
+    return np.column_stack((births, births + rng.integers(0, 10, size))).astype(float)
+
+
+def animation(result, blit=False):
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    anim = viz.make_greedy_sketch_animation(result, ax=fig.add_subplot(), blit=blit)
+    fig.canvas.draw()
+    return anim, fig.axes[0]
+
+
+@pytest.mark.parametrize("blit", [False, True])
+def test_animation_frames(blit):
+    """Case: Each frame shows the sketch and the bottleneck distance to it"""
+    pd = random_pd(40, 0)
+    result = gs.naive_greedy_sketch(pd, minimal=False)
+    anim, ax = animation(result, blit)
+    graph, sketch, newest = ax.collections[:3]
+    main_line, sub_line = ax.lines[:2]
+    for frame in range(len(result["perm"])):
+        anim._draw_next_frame(frame, blit=blit)
+        perm = result["perm"]
+        assert (sketch.get_offsets() == perm[: max(frame - 1, 0)]).all()
+        assert (newest.get_offsets() == perm[max(frame - 1, 0) : frame]).all()
+        # Lines from the next point to the closest point of the sketch
+        cells = result["voronoi"].voronoi_at(frame)
+        bneck = perm[frame]
+        cell = cells[(pd == bneck).all(axis=1)][0]
+        nn = gs.diagonal_point(bneck) if cell == -1 else perm[cell]
+        assert (main_line.get_xydata()[0] == bneck).all()
+        assert (sub_line.get_xydata()[1] == nn).all()
+        assert gs.l_inf(bneck, nn) == result["dist"][frame, 0]
+
+
+def test_animation_seek():
+    """Case: Colors are the same going through the frames or jumping to one"""
+    result = gs.naive_greedy_sketch(random_pd(40, 1), minimal=False)
+    anim, ax = animation(result)
+    colors = []
+    for frame in range(len(result["perm"])):
+        anim._draw_next_frame(frame, blit=False)
+        colors.append(ax.collections[0].get_facecolors().copy())
+    for frame in [10, 3, 4, 0, 20]:
+        anim._draw_next_frame(frame, blit=False)
+        assert (ax.collections[0].get_facecolors() == colors[frame]).all()
+    # Points in the same cell have the same color
+    cells = result["voronoi"].voronoi_at(20)
+    for cell in np.unique(cells):
+        assert len(np.unique(colors[20][cells == cell], axis=0)) == 1
+
+
+def test_animation_data():
+    """Case: Replaying the data's changes gives the colors of the animation"""
+    result = gs.naive_greedy_sketch(random_pd(40, 2), minimal=False)
+    data = viz.greedy_sketch_animation_data(result)
+    anim, ax = animation(result)
+    changes = data["changes"]
+    cells = np.full(len(data["persistence_diagram"]), -1)
+    for frame in range(len(result["perm"])):
+        rows = slice(changes["starts"][frame], changes["starts"][frame + 1])
+        cells[changes["point"][rows]] = changes["center"][rows]
+        anim._draw_next_frame(frame, blit=False)
+        colors = [to_hex(color) for color in ax.collections[0].get_facecolors()]
+        assert colors == [data["cell_colors"][cell] for cell in cells]
+        assert (ax.lines[0].get_xydata().T == data["main_lines"][frame]).all()
+        assert (ax.lines[1].get_xydata().T == data["sub_lines"][frame]).all()
+    assert (data["radii"] == result["dist"][:, 0]).all()
+
+
+def circle(size, seed):
+    rng = np.random.default_rng(seed)
+    t = rng.uniform(0, 2 * np.pi, size)
+    return np.column_stack((np.cos(t), np.sin(t))) + rng.normal(0, 0.1, (size, 2))
+
+
+def homology_animation(points, **kwargs):
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    data_ax, pd_ax = fig.subplots(1, 2)
+    anim = viz.make_persistent_homology_animation(points, data_ax, pd_ax, **kwargs)
+    anim._init_draw()
+    return anim, data_ax, pd_ax
+
+
+def test_homology_animation_frames():
+    """Case: Each frame shows the points born so far, dead ones opaque"""
+    points = circle(60, 3)
+    pd = ripser.ripser(points)["dgms"][1]
+    final_death = pd[:, 1].max()
+    anim, data_ax, pd_ax = homology_animation(points)
+    balls = data_ax.collections[0]
+    pd_graph = pd_ax.collections[0]
+    live, dead = to_rgba(viz.LIVE_POINT_COLOR), to_rgba(viz.DEAD_POINT_COLOR)
+    for frame in range(110):
+        anim._draw_next_frame(frame, blit=False)
+        dist = frame * (final_death / 100)
+        # Balls of radius dist / 2 touch once their centers are dist apart
+        assert np.allclose(balls.get_widths(), dist)
+        expected = sorted(
+            (birth, min(death, dist), live if death < dist else dead)
+            for birth, death in pd
+            if birth < dist
+        )
+        shown = sorted(
+            (birth, death, tuple(color))
+            for (birth, death), color in zip(
+                pd_graph.get_offsets().tolist(),
+                np.broadcast_to(pd_graph.get_facecolors(), (len(expected), 4)),
+            )
+        )
+        assert shown == expected
+
+
+def test_homology_animation_subsample():
+    """Case: A subsample has balls around its points and shows its radius"""
+    points = circle(200, 4)
+    rips = ripser.ripser(points, n_perm=30)
+    anim, data_ax, pd_ax = homology_animation(points, n_perm=30)
+    anim._draw_next_frame(50, blit=False)
+    assert (data_ax.collections[0].get_offsets() == points[rips["idx_perm"]]).all()
+    [text] = pd_ax.texts
+    assert f"{rips['r_cover']:.3g}" in text.get_text()
@@ -4,23 +4,157 @@ function isInternetExplorer() {
   return ua.indexOf("MSIE ") > -1 || ua.indexOf("Trident/") > -1;
 }
 
-/* Define the Animation class */
-function Animation(frames, img_id, slider_id, interval, loop_select_id) {
+/* Frames given as image URLs, shown in an <img>. More frames can be pushed
+ * while the animation plays, until `complete` is set. */
+function ImageFrames(frames, img_id) {
   this.img_id = img_id;
+  this.length = 0;
+  this.images = [];
+  this.complete = true;
+
+  for (var i = 0; i < frames.length; i++) {
+    this.push(frames[i]);
+  }
+}
+
+ImageFrames.prototype.push = function (frame) {
+  var image = new Image();
+  image.src = frame;
+  this.images.push(image);
+  this.length = this.images.length;
+};
+
+ImageFrames.prototype.show = function (frame) {
+  document.getElementById(this.img_id).src = this.images[frame].src;
+};
+
+/* Frames drawn on a <canvas> from the data returned by /api/sketch, looking
+ * like viz.make_greedy_sketch_animation */
+var SKETCH_MARGIN = { left: 48, right: 12, top: 32, bottom: 40 };
+
+function SketchFrames(data, canvas_id) {
+  this.canvas_id = canvas_id;
+  this.data = data;
+  // We don't show the last frame, so we can always show the bottleneck
+  // distance
+  this.length = data.perm.length;
+  // Voronoi cell of every point in the last frame shown, by index into perm
+  // with -1 for the diagonal
+  this.frame = 0;
+  this.cells = this.initial_cells();
+}
+
+SketchFrames.prototype.initial_cells = function () {
+  var cells = new Array(this.data.persistence_diagram.length);
+  for (var i = 0; i < cells.length; i++) {
+    cells[i] = -1;
+  }
+  return cells;
+};
+
+SketchFrames.prototype.update_cells = function (frame) {
+  var changes = this.data.changes;
+  var from = this.frame + 1;
+  if (frame < this.frame) {
+    this.cells = this.initial_cells();
+    from = 1;
+  }
+  // Going forward a frame only moves the points that changed cell in it
+  for (var k = from; k <= frame; k++) {
+    for (var i = changes.starts[k]; i < changes.starts[k + 1]; i++) {
+      this.cells[changes.point[i]] = changes.center[i];
+    }
+  }
+  this.frame = frame;
+};
+
+SketchFrames.prototype.show = function (frame) {
+  this.update_cells(frame);
+  var data = this.data;
+  var canvas = document.getElementById(this.canvas_id);
+  var ctx = canvas.getContext("2d");
+  var width = canvas.width - SKETCH_MARGIN.left - SKETCH_MARGIN.right;
+  var height = canvas.height - SKETCH_MARGIN.top - SKETCH_MARGIN.bottom;
+  function x(value) {
+    return SKETCH_MARGIN.left + (value / data.limit) * width;
+  }
+  function y(value) {
+    return SKETCH_MARGIN.top + height - (value / data.limit) * height;
+  }
+  function point(p, radius, color) {
+    ctx.fillStyle = color;
+    ctx.beginPath();
+    ctx.arc(x(p[0]), y(p[1]), radius, 0, 2 * Math.PI);
+    ctx.fill();
+  }
+  function line(l) {
+    ctx.beginPath();
+    ctx.moveTo(x(l[0][0]), y(l[1][0]));
+    ctx.lineTo(x(l[0][1]), y(l[1][1]));
+    ctx.stroke();
+  }
+
+  ctx.clearRect(0, 0, canvas.width, canvas.height);
+  ctx.fillStyle = "black";
+  ctx.strokeStyle = "black";
+  ctx.lineWidth = 1;
+  ctx.setLineDash([]);
+  ctx.font = "14px sans-serif";
+  ctx.textAlign = "center";
+  ctx.fillText(
+    "Incremental Greedy Sketches",
+    SKETCH_MARGIN.left + width / 2,
+    SKETCH_MARGIN.top - 12
+  );
+  ctx.fillText("Birth", SKETCH_MARGIN.left + width / 2, canvas.height - 6);
+  ctx.save();
+  ctx.translate(14, SKETCH_MARGIN.top + height / 2);
+  ctx.rotate(-Math.PI / 2);
+  ctx.fillText("Death", 0, 0);
+  ctx.restore();
+  ctx.strokeRect(SKETCH_MARGIN.left, SKETCH_MARGIN.top, width, height);
+
+  // Diagonal
+  ctx.strokeStyle = "grey";
+  ctx.setLineDash([6, 4]);
+  line([
+    [0, data.limit],
+    [0, data.limit],
+  ]);
+
+  // Points colored by the sketch point of their Voronoi cell, with the
+  // diagonal's color last
+  for (var i = 0; i < this.cells.length; i++) {
+    var cell = this.cells[i];
+    var color_index = cell < 0 ? data.cell_colors.length - 1 : cell;
+    point(data.persistence_diagram[i], 2, data.cell_colors[color_index]);
+  }
+  // Old sketch points in black and the newest in red
+  for (var j = 0; j < frame; j++) {
+    point(data.perm[j], 3.5, j == frame - 1 ? "red" : "black");
+  }
+
+  // Bottleneck distance, densely dotted for the second line
+  ctx.strokeStyle = "black";
+  ctx.setLineDash([]);
+  line(data.main_lines[frame]);
+  ctx.setLineDash([1, 1]);
+  line(data.sub_lines[frame]);
+};
+
+/* Define the Animation class, showing frames from anything with a `length`
+ * and a `show(frame)` method */
+function Animation(frames, slider_id, interval, loop_select_id) {
   this.slider_id = slider_id;
   this.loop_select_id = loop_select_id;
   this.interval = interval;
   this.current_frame = 0;
   this.direction = 0;
   this.timer = null;
-  this.frames = new Array(frames.length);
+  this.frames = frames;
 
-  for (var i = 0; i < frames.length; i++) {
-    this.frames[i] = new Image();
-    this.frames[i].src = frames[i];
-  }
   var slider = document.getElementById(this.slider_id);
-  slider.max = this.frames.length - 1;
+  this.frames_added();
   if (isInternetExplorer()) {
     // switch from oninput to onchange because IE <= 11 does not conform
     // with W3C specification. It ignores oninput and onchange behaves
@@ -31,6 +165,11 @@ function Animation(frames, img_id, slider_id, interval, loop_select_id) {
   this.set_frame(this.current_frame);
 }
 
+/* Call when frames were added to a source which wasn't complete */
+Animation.prototype.frames_added = function () {
+  document.getElementById(this.slider_id).max = this.frames.length - 1;
+};
+
 Animation.prototype.get_loop_state = function () {
   var button_group = document[this.loop_select_id].state;
   for (var i = 0; i < button_group.length; i++) {
@@ -44,9 +183,7 @@ Animation.prototype.get_loop_state = function () {
 
 Animation.prototype.set_frame = function (frame) {
   this.current_frame = frame;
-  document.getElementById(this.img_id).src = this.frames[
-    this.current_frame
-  ].src;
+  this.frames.show(this.current_frame);
   document.getElementById(this.slider_id).value = this.current_frame;
 };
 
@@ -88,6 +225,9 @@ Animation.prototype.anim_step_forward = function () {
   this.current_frame += 1;
   if (this.current_frame < this.frames.length) {
     this.set_frame(this.current_frame);
+  } else if (this.frames.complete === false) {
+    // Wait on the last frame for the next to arrive
+    this.current_frame = this.frames.length - 1;
   } else {
     var loop_state = this.get_loop_state();
     if (loop_state == "loop") {
@@ -1,9 +1,17 @@
 import base64
+import json
 import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 
+import cache
+import jobs
+import metrics
 import numpy as np
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from greedy_sketch import naive_greedy_sketch, viz
 from matplotlib.figure import Figure
 from ripser import ripser
@@ -11,10 +19,270 @@ from ripser import ripser
 logging.basicConfig()
 
 app = Flask(__name__, static_folder="", static_url_path="")
+# Processes rendering frames, 1 to render them in the request's own process
+app.config["RENDER_WORKERS"] = int(
+    os.environ.get("RENDER_WORKERS", os.cpu_count() or 1)
+)
+# Resolution of the frames, and zlib compression level of their PNGs from 0
+# (fastest, largest) to 9 (slowest, smallest)
+app.config["FRAME_DPI"] = float(os.environ.get("FRAME_DPI", 100))
+app.config["PNG_COMPRESS_LEVEL"] = int(os.environ.get("PNG_COMPRESS_LEVEL", 6))
+
+# Largest size of the results cached in memory, and optionally a directory
+# where gunicorn workers share cached results, with its largest size
+app.config["CACHE_MAX_BYTES"] = int(os.environ.get("CACHE_MAX_BYTES", 2**28))
+app.config["CACHE_DIR"] = os.environ.get("CACHE_DIR")
+app.config["CACHE_DISK_MAX_BYTES"] = int(os.environ.get("CACHE_DISK_MAX_BYTES", 2**30))
+
+results = cache.ResultCache(
+    app.config["CACHE_MAX_BYTES"],
+    app.config["CACHE_DIR"],
+    app.config["CACHE_DISK_MAX_BYTES"],
+)
+
+# Jobs run at once, jobs waiting before new ones are turned away, and the
+# limits of every job on its points, seconds and bytes of memory
+app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", os.cpu_count() or 1))
+app.config["JOB_QUEUE_SIZE"] = int(os.environ.get("JOB_QUEUE_SIZE", 32))
+app.config["JOB_MAX_POINTS"] = int(os.environ.get("JOB_MAX_POINTS", 2000))
+app.config["JOB_TIME_LIMIT"] = float(os.environ.get("JOB_TIME_LIMIT", 120))
+app.config["JOB_MEMORY_LIMIT"] = int(os.environ.get("JOB_MEMORY_LIMIT", 2**31))
+
+
+# Whether to time the stages of computing animations for /metrics
+app.config["METRICS"] = os.environ.get("METRICS", "1") != "0"
+
+timers = metrics.StageTimers(app.config["METRICS"])
+
+
+def _cache_job(job):
+    """Cache the stages of an animation job and add its timings, keeping its output."""
+    for stage, key, value in job.result["stages"]:
+        results.put(stage, key, value)
+    timers.add_all(job.result["timings"])
+    job.result = job.result["output"]
+
+
+animation_jobs = jobs.JobQueue(
+    app.config["JOB_WORKERS"],
+    app.config["JOB_QUEUE_SIZE"],
+    app.config["JOB_TIME_LIMIT"],
+    app.config["JOB_MEMORY_LIMIT"],
+    on_done=_cache_job,
+    # What jobs and render workers spend most of their start up importing
+    preload=["flask", "greedy_sketch.viz", "matplotlib.figure", "ripser"],
+)
+
+# Frames per task sent to a render worker
+FRAMES_PER_TASK = 8
+
+_ANIMATION_KEYS = ["perm", "dist", "voronoi", "persistence_diagram", "sketches"]
+
+# Started on the first request, so each gunicorn worker gets its own pool
+_pool = None
+_pool_lock = threading.Lock()
+# The figure of each thread rendering frames, reused for every frame it
+# renders. Request threads rendering in the server's own process each need
+# their own.
+_figures = threading.local()
 
 
 @app.route("/api/animate", methods=["POST"])
 def animate():
+    key, result = sketch_request()
+    if result is None:
+        return "insufficient points"
+    images = results.get_or_compute(
+        "frames", _frames_key(key), lambda: render_frames(result)
+    )
+    return jsonify(images)
+
+
+@app.route("/api/animate/stream", methods=["POST"])
+def animate_stream():
+    """The frames of /api/animate as Server-Sent Events, each sent once ready.
+
+    A "meta" event with the number of frames comes first, then a "frame"
+    event with the index and image of every frame in order, so the first
+    frames can be shown while the rest are rendered. An "error" event is sent
+    instead when there's nothing to animate.
+    """
+    key, result = sketch_request()
+
+    def events():
+        if result is None:
+            yield _event("error", "insufficient points")
+            return
+        yield _event("meta", {"frames": len(result["sketches"]) - 1})
+        cached = results.get("frames", _frames_key(key))
+        runs = [cached] if cached is not None else iter_frames(result)
+        images = []
+        for run in runs:
+            for image in run:
+                yield _event("frame", {"index": len(images), "image": image})
+                images.append(image)
+        if cached is None:
+            results.put("frames", _frames_key(key), images)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        # Send each event right away, even behind a proxy
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/sketch", methods=["POST"])
+def sketch():
+    """The animation as data, for the browser to draw itself.
+
+    A few kilobytes of arrays instead of a PNG for every frame, see
+    `viz.greedy_sketch_animation_data`.
+    """
+    key, result = sketch_request()
+    if result is None:
+        return "insufficient points"
+    data = results.get_or_compute("data", key, lambda: _animation_data(result, timers))
+    return jsonify(data)
+
+
+@app.route("/api/cache")
+def cache_stats():
+    """Hit and miss counts of every cached stage."""
+    return jsonify(results.stats())
+
+
+@app.route("/metrics")
+def metrics_text():
+    """Timings of the stages, cache lookups and jobs, for Prometheus to scrape.
+
+    Answers 404 when METRICS is turned off.
+    """
+    if not timers.enabled:
+        return "metrics are turned off", 404
+    text = metrics.prometheus_text(timers, results.stats(), animation_jobs.states())
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/jobs", methods=["POST"])
+def submit_job():
+    """Start computing an animation in the background.
+
+    Takes `{"points": [[x, y], ...], "output": "data" or "frames"}`, for the
+    output of /api/sketch or /api/animate, and answers 202 with the job's
+    status, including its "id". Answers 413 for more than JOB_MAX_POINTS
+    points, and 503 when JOB_QUEUE_SIZE jobs are waiting already.
+    """
+    points = np.array(request.json["points"], dtype=np.double).reshape(-1, 2)
+    output = request.json.get("output", "data")
+    if output not in ("data", "frames"):
+        return jsonify(error=f"unknown output {output}"), 400
+    if len(points) == 0:
+        return jsonify(error="points must be non-empty"), 400
+    if len(points) > app.config["JOB_MAX_POINTS"]:
+        return (
+            jsonify(error=f"at most {app.config['JOB_MAX_POINTS']} points allowed"),
+            413,
+        )
+
+    # Whatever is cached already doesn't need computing again
+    points_key = cache.points_key(points)
+    diagram = results.get("diagram", points_key)
+    result = key = None
+    if diagram is not None and len(diagram):
+        key = cache.array_key(diagram)
+        result = results.get("sketch", key)
+    if result is not None:
+        output_key = key if output == "data" else _frames_key(key)
+        cached = results.get(output, output_key)
+        if cached is not None:
+            job = animation_jobs.add_done(cached, _output_events(result, cached))
+            return jsonify(job.status()), 202
+
+    settings = (app.config["FRAME_DPI"], app.config["PNG_COMPRESS_LEVEL"])
+    try:
+        job = animation_jobs.submit(
+            _animation_job, points, output, diagram, result, settings, timers.enabled
+        )
+    except jobs.QueueFull as e:
+        return jsonify(error=str(e)), 503, {"Retry-After": "10"}
+    return jsonify(job.status()), 202
+
+
+@app.route("/api/jobs/<job_id>")
+def job_status(job_id):
+    """Status of a job: its "state", number of "events" and any "error"."""
+    job = animation_jobs.get(job_id)
+    if job is None:
+        return jsonify(error="no such job"), 404
+    return jsonify(job.status())
+
+
+@app.route("/api/jobs/<job_id>/events")
+def job_events(job_id):
+    """The events of a job as Server-Sent Events, as they happen.
+
+    Events so far are sent first: "progress" with the "stage" being computed,
+    "meta" with the number of frames once the sketch is done, and "frame" with
+    the index and image of each frame rendered. The last event is the job's
+    final state, "done", "failed" or "cancelled", with its status.
+    """
+    job = animation_jobs.get(job_id)
+    if job is None:
+        return jsonify(error="no such job"), 404
+
+    def events():
+        seen = 0
+        while True:
+            new, finished = job.wait(seen, timeout=15)
+            for name, data in new:
+                yield _event(name, data)
+            seen += len(new)
+            if finished and seen == len(job.events):
+                yield _event(job.state, job.status())
+                return
+            if not new:
+                # Keeps proxies from closing the connection
+                yield ": waiting\n\n"
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/jobs/<job_id>/result")
+def job_result(job_id):
+    """The output of a job which is done, or 409 with its status."""
+    job = animation_jobs.get(job_id)
+    if job is None:
+        return jsonify(error="no such job"), 404
+    if job.state != jobs.DONE:
+        return jsonify(job.status()), 409
+    return jsonify(job.result)
+
+
+@app.route("/api/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Cancel a job, stopping it if it's running."""
+    job = animation_jobs.cancel(job_id)
+    if job is None:
+        return jsonify(error="no such job"), 404
+    return jsonify(job.status())
+
+
+def sketch_request():
+    """The greedy sketch of the 1D persistence diagram of the posted points.
+
+    Returns
+    -------
+    key : str
+        Hash of the persistence diagram, which keys everything computed from
+        the sketch in `results`.
+    result : dict
+        The greedy sketch, or None when the diagram is empty.
+    """
     app.logger.debug(f"received request {request.json}")
     points = np.array(request.json, dtype=np.double)
     if len(points) == 0:
@@ -22,17 +290,178 @@ def animate():
     if points.shape[1] != 2:
         raise Exception("expected 2d points int")
 
-    rips = ripser(points)
-    app.logger.debug(f"using rips={rips}")
-    if len(rips["dgms"][1]) == 0:
-        return "insufficient points"
-
-    fig = Figure()
-    ax = fig.add_subplot()
-    anim = viz.make_greedy_sketch_animation(
-        naive_greedy_sketch(rips["dgms"][1], minimal=False),
-        ax=ax,
+    diagram = results.get_or_compute(
+        "diagram", cache.points_key(points), lambda: _diagram(points, timers)
     )
+    app.logger.debug(f"using diagram={diagram}")
+    if len(diagram) == 0:
+        return None, None
+    key = cache.array_key(diagram)
+    result = results.get_or_compute("sketch", key, lambda: _sketch(diagram, timers))
+    return key, result
+
+
+def _diagram(points, timers):
+    """The 1D persistence diagram of `points`."""
+    with timers.time("ripser"):
+        return ripser(points)["dgms"][1]
+
+
+def _sketch(diagram, timers):
+    """The greedy sketch of `diagram`, with everything the animations need."""
+    with timers.time("greedy_sketch"):
+        return naive_greedy_sketch(diagram, minimal=False)
+
+
+def _animation_data(result, timers):
+    """The output of /api/sketch for the greedy sketch `result`."""
+    with timers.time("animation_data"):
+        return _to_json(viz.greedy_sketch_animation_data(result))
+
+
+def _frames_key(key):
+    """Key of the frames of sketch `key` with the current PNG settings."""
+    return f"{key}-{app.config['FRAME_DPI']}-{app.config['PNG_COMPRESS_LEVEL']}"
+
+
+def _animation_job(report, points, output, diagram, result, settings, timed):
+    """Compute an animation in a job's process, see `submit_job`.
+
+    `diagram` and `result` are the diagram and sketch when they're cached
+    already, or None. Returns the "output" along with the "stages" to cache
+    as `(stage, key, value)`, and the "timings" of the stages when `timed`.
+    """
+    stages = []
+    job_timers = metrics.StageTimers(timed)
+    if diagram is None:
+        report("progress", {"stage": "diagram"})
+        diagram = _diagram(points, job_timers)
+        stages.append(("diagram", cache.points_key(points), diagram))
+    if len(diagram) == 0:
+        raise ValueError("insufficient points")
+    key = cache.array_key(diagram)
+    if result is None:
+        report("progress", {"stage": "sketch"})
+        result = _sketch(diagram, job_timers)
+        stages.append(("sketch", key, result))
+    report("meta", {"frames": len(result["sketches"]) - 1})
+
+    if output == "data":
+        report("progress", {"stage": "data"})
+        data = _animation_data(result, job_timers)
+        stages.append(("data", key, data))
+        return {"stages": stages, "output": data, "timings": job_timers.timings()}
+
+    report("progress", {"stage": "frames"})
+    n_frames = len(result["sketches"]) - 1
+    result = {name: result[name] for name in _ANIMATION_KEYS}
+    images = []
+    for image in _draw_frames(result, 0, n_frames, *settings, job_timers):
+        report("frame", {"index": len(images), "image": image})
+        images.append(image)
+    stages.append(("frames", _frames_key(key), images))
+    return {"stages": stages, "output": images, "timings": job_timers.timings()}
+
+
+def _output_events(result, output):
+    """The events of a job which computed `output` from the sketch `result`."""
+    events = [("meta", {"frames": len(result["sketches"]) - 1})]
+    if isinstance(output, list):
+        events += [
+            ("frame", {"index": index, "image": image})
+            for index, image in enumerate(output)
+        ]
+    return events
+
+
+def render_frames(result):
+    """Render every frame of the animation of `result` as a PNG data URI."""
+    return [image for run in iter_frames(result) for image in run]
+
+
+def iter_frames(result):
+    """Render the frames of the animation of `result` in order, as they're done.
+
+    Frames are split into runs of consecutive frames, rendered in parallel by
+    the pool of render workers, and each run is yielded once it and every run
+    before it are done. Rendering in the request's own process yields every
+    frame on its own instead.
+    """
+    settings = (app.config["FRAME_DPI"], app.config["PNG_COMPRESS_LEVEL"])
+    # Only what the animation needs, to send less to the workers
+    result = {key: result[key] for key in _ANIMATION_KEYS}
+    n_frames = len(result["sketches"]) - 1
+    if app.config["RENDER_WORKERS"] <= 1:
+        for image in _draw_frames(result, 0, n_frames, *settings, timers):
+            yield [image]
+        return
+
+    futures = [
+        _render_pool().submit(
+            _render_run, result, start, stop, *settings, timers.enabled
+        )
+        for start, stop in _runs(n_frames)
+    ]
+    try:
+        for future in futures:
+            images, timings = future.result()
+            timers.add_all(timings)
+            yield images
+    finally:
+        # Don't render what nobody is waiting for anymore
+        for future in futures:
+            future.cancel()
+
+
+def _runs(n_frames):
+    """Split the frames into runs for the render workers, as `(start, stop)`.
+
+    Runs start at one frame and double up to `FRAMES_PER_TASK` frames, so the
+    first frames are ready quickly however many frames there are.
+    """
+    start, size = 0, 1
+    while start < n_frames:
+        yield start, min(start + size, n_frames)
+        start += size
+        size = min(2 * size, FRAMES_PER_TASK)
+
+
+def _render_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Started by a fork server rather than forked from this process,
+            # whose other threads may hold locks at the time of the fork
+            _pool = ProcessPoolExecutor(
+                app.config["RENDER_WORKERS"],
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+    return _pool
+
+
+def _render_run(result, start, stop, dpi, compress_level, timed):
+    """Render frames `start` to `stop` of the animation of `result`.
+
+    Returns the frames, and the timings of rendering them when `timed`.
+    """
+    run_timers = metrics.StageTimers(timed)
+    images = list(_draw_frames(result, start, stop, dpi, compress_level, run_timers))
+    return images, run_timers.timings()
+
+
+def _draw_frames(result, start, stop, dpi, compress_level, timers):
+    """Yield frames `start` to `stop` of the animation of `result` as PNG data URIs.
+
+    Drawing, saving and encoding the frames are timed with `timers`.
+    """
+    if not hasattr(_figures, "figure"):
+        _figures.figure = Figure()
+    figure = _figures.figure
+    with timers.time("animation_setup"):
+        figure.clear()
+        anim = viz.make_greedy_sketch_animation(result, ax=figure.add_subplot())
+        # Set up the frames like `Animation.save` does
+        anim._init_draw()
 
     # Ideally, we'd just return `anim.to_jshtml()`. However, for that to work
     # it has <script> tags inside of the HTML, so if the client were to just
@@ -47,17 +476,38 @@ def animate():
     # filesystem. Instead, it prefers you to save files in a specific format
     # (e.g. gif, mp4), so we have to manually call the private
     # `Animation._draw_next_frame()` to draw the frame and then save that to a
-    # PNG in memory.
-    images = []
-    for data in anim.new_saved_frame_seq():
-        anim._draw_next_frame(data, blit=False)
+    # PNG in memory. The animation can start at any frame, so each worker
+    # only draws its own.
+
+    for frame in range(start, stop):
+        with timers.time("draw"):
+            anim._draw_next_frame(frame, blit=False)
         buf = BytesIO()
-        fig.savefig(buf, format="png")
-        # Must decode bytes to ensure that it gets added to string correctly
-        encoded = base64.encodebytes(buf.getvalue()).decode("ascii")
-        images.append(f"data:image/png;base64,{encoded}")
+        with timers.time("savefig"):
+            figure.savefig(
+                buf,
+                format="png",
+                dpi=dpi,
+                pil_kwargs={"compress_level": compress_level},
+            )
+        with timers.time("base64"):
+            # Must decode bytes to ensure that it gets added to string correctly
+            encoded = base64.encodebytes(buf.getvalue()).decode("ascii")
+        yield f"data:image/png;base64,{encoded}"
 
-    return jsonify(images)
+
+def _event(name, data):
+    """A Server-Sent Event, with `data` as JSON so that it fits on one line."""
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+def _to_json(data):
+    """Turn the numpy arrays and numbers nested in `data` into lists and floats."""
+    if isinstance(data, dict):
+        return {key: _to_json(value) for key, value in data.items()}
+    if isinstance(data, (np.ndarray, np.generic)):
+        return data.tolist()
+    return data
 
 
 @app.route("/")
@@ -0,0 +1,184 @@
+"""Content-addressed cache of the stages of /api/animate.
+
+Each stage (persistence diagram, greedy sketch, rendered frames, ...) is
+cached on its own, keyed by a hash of what it was computed from, so a point
+set submitted again skips every stage, and point sets with the same diagram
+share the sketch and frames.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+
+def points_key(points, decimals=6):
+    """Hash of a point set, the same for any order of the points.
+
+    Points are rounded to `decimals` decimal places first, so the same points
+    sent as slightly different floats share a key.
+    """
+    points = np.round(np.asarray(points, dtype=float).reshape(-1, 2), decimals)
+    # +0.0 turns -0.0 into 0.0, which would hash differently
+    points = points[np.lexsort(points.T[::-1])] + 0.0
+    return array_key(points)
+
+
+def array_key(array):
+    """Hash of an array's shape and values."""
+    array = np.ascontiguousarray(array, dtype=float)
+    digest = hashlib.sha256(repr(array.shape).encode())
+    digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """LRU cache of computed stages, bounded by the size of their pickles.
+
+    Entries are kept in memory, and optionally also in a directory, where
+    every gunicorn worker using the same directory can find them. The
+    directory is bounded separately, dropping the least recently used files.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Largest total size of the pickled entries kept in memory.
+    directory : str, optional
+        Directory to also keep entries in, created if needed.
+    max_disk_bytes : int, default=2**30
+        Largest total size of the files kept in `directory`.
+
+    Attributes
+    ----------
+    hits, disk_hits, misses : collections.Counter
+        Number of lookups of each stage found in memory, found in the
+        directory, and not found.
+    """
+
+    def __init__(self, max_bytes, directory=None, max_disk_bytes=2**30):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.hits = Counter()
+        self.disk_hits = Counter()
+        self.misses = Counter()
+        # (stage, key) -> pickled value, least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, stage, key):
+        """The cached value of `stage` for `key`, or None."""
+        with self._lock:
+            data = self._entries.get((stage, key))
+            if data is not None:
+                self._entries.move_to_end((stage, key))
+                self.hits[stage] += 1
+                return pickle.loads(data)
+        data = self._read(stage, key)
+        with self._lock:
+            if data is None:
+                self.misses[stage] += 1
+                return None
+            self.disk_hits[stage] += 1
+            self._remember(stage, key, data)
+        return pickle.loads(data)
+
+    def put(self, stage, key, value):
+        """Cache `value` as the result of `stage` for `key`."""
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._remember(stage, key, data)
+        self._write(stage, key, data)
+
+    def get_or_compute(self, stage, key, compute):
+        """The cached value of `stage` for `key`, computing and caching it if needed."""
+        value = self.get(stage, key)
+        if value is None:
+            value = compute()
+            self.put(stage, key, value)
+        return value
+
+    def stats(self):
+        """Hit and miss counts of every stage, plus the sizes of the cache."""
+        with self._lock:
+            stages = set(self.hits) | set(self.disk_hits) | set(self.misses)
+            return {
+                "stages": {
+                    stage: {
+                        "hits": self.hits[stage],
+                        "disk_hits": self.disk_hits[stage],
+                        "misses": self.misses[stage],
+                    }
+                    for stage in sorted(stages)
+                },
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _remember(self, stage, key, data):
+        """Keep `data` in memory, evicting the least recently used entries."""
+        old = self._entries.pop((stage, key), None)
+        if old is not None:
+            self._bytes -= len(old)
+        if len(data) > self.max_bytes:
+            return
+        self._entries[stage, key] = data
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def _path(self, stage, key):
+        return os.path.join(self.directory, f"{stage}-{key}.pickle")
+
+    def _read(self, stage, key):
+        if self.directory is None:
+            return None
+        path = self._path(stage, key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Reading counts as a use for the directory's LRU order
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def _write(self, stage, key, data):
+        if self.directory is None or len(data) > self.max_disk_bytes:
+            return
+        # Written to a temporary file first, so other workers never read a
+        # partly written entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(stage, key))
+        self._trim_disk()
+
+    def _trim_disk(self):
+        """Drop the least recently used files over `max_disk_bytes`."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # Removed by another worker
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -1,15 +1,30 @@
+// "canvas" draws the animation in the browser from the sketch's data, "png"
+// shows frames rendered by the server, playing them as they arrive
+const RENDERER = "canvas";
+
+// What the server is doing in each stage of a job
+const STAGES = {
+  diagram: "Computing the persistence diagram",
+  sketch: "Computing the greedy sketch",
+  data: "Preparing the animation",
+  frames: "Rendering frames",
+};
+
 const POINT_SIZE = 5;
 const POINT_COLOR = "#ff0000";
 
 const canvas = document.getElementById("canvas");
 const run = document.getElementById("run");
 const clear = document.getElementById("clear");
+const statusText = document.getElementById("status");
 const animationContainer = document.getElementById("animation-container");
 
 // Canvas height and width are guaranteed to be the same
 const CANVAS_BUF_SIZE = canvas.width;
 
 let points = [];
+// The job computing the animation, as { id, events }
+let job = null;
 
 canvas.onclick = function (event) {
   console.log(event);
@@ -36,27 +51,114 @@ canvas.onclick = function (event) {
 
 clear.onclick = function (_event) {
   points = [];
+  cancelJob();
 
   let ctx = canvas.getContext("2d");
   ctx.clearRect(0, 0, canvas.width, canvas.height);
 };
 
+function showAnimation(frames) {
+  let canvas = RENDERER === "canvas";
+  document.getElementById("_anim_img").hidden = canvas;
+  document.getElementById("_anim_canvas").hidden = !canvas;
+  if (typeof anim !== "undefined") {
+    anim.pause_animation();
+  }
+  // This must be global
+  anim = new Animation(frames, "_anim_slider", 500.0, "_anim_loop_select");
+}
+
+function cancelJob() {
+  if (job === null) {
+    return;
+  }
+  job.events.close();
+  fetch("/api/jobs/" + job.id, { method: "DELETE" });
+  job = null;
+  statusText.textContent = "";
+}
+
+// Follows the events of a job until it finishes, playing the animation
+function watchJob(id) {
+  let events = new EventSource("/api/jobs/" + id + "/events");
+  job = { id: id, events: events };
+  let frames = new ImageFrames([], "_anim_img");
+  frames.complete = false;
+  let total = 0;
+  statusText.textContent = "Waiting for the server";
+
+  function finish(text) {
+    events.close();
+    job = null;
+    statusText.textContent = text;
+  }
+
+  events.addEventListener("progress", function (event) {
+    statusText.textContent = STAGES[JSON.parse(event.data).stage];
+  });
+  events.addEventListener("meta", function (event) {
+    total = JSON.parse(event.data).frames;
+  });
+  events.addEventListener("frame", function (event) {
+    frames.push(JSON.parse(event.data).image);
+    statusText.textContent = `Rendered ${frames.length} of ${total} frames`;
+    if (frames.length === 1) {
+      // Start playing as soon as there's something to show
+      showAnimation(frames);
+      anim.play_animation();
+    } else {
+      anim.frames_added();
+    }
+  });
+  events.addEventListener("done", function (_event) {
+    finish("");
+    if (RENDERER === "png") {
+      frames.complete = true;
+      return;
+    }
+    fetch("/api/jobs/" + id + "/result")
+      .then(function (response) {
+        return response.json();
+      })
+      .then(function (data) {
+        showAnimation(new SketchFrames(data, "_anim_canvas"));
+      });
+  });
+  events.addEventListener("failed", function (event) {
+    finish("Failed: " + JSON.parse(event.data).error);
+  });
+  events.addEventListener("cancelled", function (_event) {
+    finish("Cancelled");
+  });
+  events.onerror = function () {
+    // Don't reconnect after the stream was cut off
+    finish("Lost the connection to the server");
+  };
+}
+
 run.onclick = function (_event) {
+  cancelJob();
   let r = new XMLHttpRequest();
-  r.open("POST", "/api/animate", true);
+  r.open("POST", "/api/jobs", true);
   r.setRequestHeader("Content-Type", "application/json;charset=UTF-8");
 
   r.onreadystatechange = function () {
-    if (this.readyState !== 4 || this.status !== 200) {
+    if (this.readyState !== 4) {
       return;
     }
-    let frames = JSON.parse(this.response);
-    let img_id = "_anim_img";
-    let slider_id = "_anim_slider";
-    let loop_select_id = "_anim_loop_select";
-    // This must be global
-    anim = new Animation(frames, img_id, slider_id, 500.0, loop_select_id);
+    let response = JSON.parse(this.response);
+    if (this.status !== 202) {
+      // Too many points, or the server is busy
+      statusText.textContent = response.error;
+      return;
+    }
+    watchJob(response.id);
   };
 
-  r.send(JSON.stringify(points));
+  r.send(
+    JSON.stringify({
+      points: points,
+      output: RENDERER === "canvas" ? "data" : "frames",
+    })
+  );
 };
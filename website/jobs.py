@@ -0,0 +1,305 @@
+"""Background jobs with limits, run in their own processes.
+
+Every job runs in a child process of its own, so a job over its time limit
+or cancelled while running can be killed, and its memory limit doesn't
+apply to the server. A fixed number of worker threads take jobs from a
+bounded queue, and submitting to a full queue fails instead of waiting.
+
+Child processes are started by a fork server rather than forked from the
+server itself, whose other threads may hold locks at the time of the fork.
+"""
+
+import multiprocessing
+import queue
+import resource
+import threading
+import time
+import uuid
+from collections import Counter
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = {DONE, FAILED, CANCELLED}
+
+
+class QueueFull(Exception):
+    """Raised when submitting a job to a queue which is full."""
+
+
+class Job:
+    """A job of a `JobQueue`.
+
+    Attributes
+    ----------
+    id : str
+        Unique id of the job.
+    state : str
+        One of "queued", "running", "done", "failed" and "cancelled".
+    events : list of tuple of (str, object)
+        Events reported by the job so far, as `(name, data)`.
+    result : object
+        What the job returned, once it's done.
+    error : str
+        Why the job failed, if it did.
+    """
+
+    def __init__(self, func, args):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.state = QUEUED
+        self.events = []
+        self.result = None
+        self.error = None
+        self.finished_at = None
+        self._changed = threading.Condition()
+
+    def status(self):
+        """JSON-friendly state of the job."""
+        status = {"id": self.id, "state": self.state, "events": len(self.events)}
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+    def wait(self, seen, timeout):
+        """Wait until there are more than `seen` events or the job finished.
+
+        Returns the events after the first `seen` and whether the job
+        finished.
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: len(self.events) > seen or self.state in FINISHED, timeout
+            )
+            return self.events[seen:], self.state in FINISHED
+
+    def _update(self, **changes):
+        with self._changed:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            if self.state in FINISHED and self.finished_at is None:
+                self.finished_at = time.monotonic()
+                # The work is done, so don't keep its input around
+                self.args = None
+            self._changed.notify_all()
+
+    def _finish(self, state, **changes):
+        """Finish the job unless it's finished already, e.g. cancelled.
+
+        Returns whether it finished the job.
+        """
+        with self._changed:
+            if self.state in FINISHED:
+                return False
+            self._update(state=state, **changes)
+            return True
+
+    def _start(self):
+        """Mark a queued job as running, returning False if it was cancelled."""
+        with self._changed:
+            if self.state != QUEUED:
+                return False
+            self.state = RUNNING
+            self._changed.notify_all()
+            return True
+
+    def _report(self, event):
+        with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+
+class JobQueue:
+    """Run jobs in child processes with limits on their time and memory.
+
+    Parameters
+    ----------
+    workers : int
+        Number of jobs run at once.
+    max_queued : int
+        Number of jobs waiting to run before `submit` raises `QueueFull`.
+    time_limit : float
+        Seconds a job can run for before it's killed.
+    memory_limit : int, optional
+        Bytes of address space a job's process can use, unlimited by default.
+    keep_for : float, default=600
+        Seconds finished jobs are kept for, after which `get` doesn't find
+        them.
+    on_done : callable, optional
+        Called with every job which is done, before its state changes.
+    preload : list of str, optional
+        Modules for the fork server to import once, so that child processes
+        don't each import them again. Their import mustn't start threads.
+    """
+
+    def __init__(
+        self,
+        workers,
+        max_queued,
+        time_limit,
+        memory_limit=None,
+        keep_for=600,
+        on_done=None,
+        preload=(),
+    ):
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.keep_for = keep_for
+        self.on_done = on_done
+        self._context = multiprocessing.get_context("forkserver")
+        if preload:
+            self._context.set_forkserver_preload(list(preload))
+        self._queue = queue.Queue(max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, func, *args):
+        """Queue `func(report, *args)` to run in a child process.
+
+        `report(name, data)` adds an event to the job, and `func` must return
+        something picklable, which becomes the job's result.
+
+        Raises
+        ------
+        QueueFull
+            When `max_queued` jobs are waiting already.
+        """
+        job = Job(func, args)
+        self._forget_old()
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFull("Too many jobs are waiting, try again later") from None
+        return job
+
+    def add_done(self, result, events=()):
+        """Add a job which is done already, like for a cached result."""
+        job = Job(None, None)
+        job.events = list(events)
+        job._update(state=DONE, result=result)
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        """The job with id `job_id`, or None."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a job, killing its process if it's running.
+
+        Returns the job, or None if there's no such job.
+        """
+        job = self.get(job_id)
+        if job is not None:
+            job._finish(CANCELLED)
+        return job
+
+    def queued(self):
+        """Number of jobs waiting to run."""
+        return self._queue.qsize()
+
+    def states(self):
+        """Number of jobs kept in every state."""
+        with self._lock:
+            counts = Counter(job.state for job in self._jobs.values())
+        return {state: counts[state] for state in (QUEUED, RUNNING, *FINISHED)}
+
+    def _forget_old(self):
+        now = time.monotonic()
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if (
+                    job.finished_at is not None
+                    and now - job.finished_at > self.keep_for
+                ):
+                    del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if not job._start():
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                # Keep the worker going, and the job from running forever
+                job._finish(FAILED, error=f"{type(e).__name__}: {e}")
+
+    def _run(self, job):
+        """Run a job in a child process until it's done, killed or cancelled."""
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_child,
+            args=(sender, self.memory_limit, job.func, job.args),
+            daemon=True,
+        )
+        try:
+            process.start()
+        except BaseException:
+            receiver.close()
+            raise
+        finally:
+            # Only the child writes to the pipe
+            sender.close()
+        deadline = time.monotonic() + self.time_limit
+        try:
+            while True:
+                if job.state == CANCELLED:
+                    return
+                if time.monotonic() > deadline:
+                    job._finish(FAILED, error="time limit exceeded")
+                    return
+                # Wake up now and then to check for cancellation
+                if not receiver.poll(0.1):
+                    continue
+                try:
+                    kind, value = receiver.recv()
+                except EOFError:
+                    job._finish(FAILED, error="job process died")
+                    return
+                if kind == "event":
+                    job._report(value)
+                elif kind == "error":
+                    job._finish(FAILED, error=value)
+                    return
+                else:
+                    job.result = value
+                    if self.on_done is not None:
+                        self.on_done(job)
+                    # Stays cancelled if it was cancelled during `on_done`
+                    job._finish(DONE)
+                    return
+        finally:
+            if process.is_alive():
+                process.kill()
+            process.join()
+            receiver.close()
+
+
+def _child(sender, memory_limit, func, args):
+    """Run a job in its child process, sending back its events and result."""
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    def report(name, data=None):
+        sender.send(("event", (name, data)))
+
+    try:
+        sender.send(("result", func(report, *args)))
+    except MemoryError:
+        sender.send(("error", "memory limit exceeded"))
+    except Exception as e:
+        sender.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        sender.close()
@@ -0,0 +1,131 @@
+"""Timers of the stages of computing animations, exposed for Prometheus.
+
+Stages are timed wherever they run, and the timings of other processes
+(render workers, jobs) are sent back with their results and added to the
+server's with `StageTimers.add_all`. A disabled `StageTimers` times nothing,
+so turning metrics off costs nothing per frame either.
+"""
+
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+_NOT_TIMED = nullcontext()
+
+
+class StageTimers:
+    """Number of runs and total seconds of every stage.
+
+    Parameters
+    ----------
+    enabled : bool, default=True
+        Whether to time anything at all.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.counts = Counter()
+        self.seconds = Counter()
+        self._lock = threading.Lock()
+
+    def time(self, stage):
+        """Context manager timing one run of `stage`."""
+        if not self.enabled:
+            return _NOT_TIMED
+        return self._time(stage)
+
+    @contextmanager
+    def _time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage, seconds, count=1):
+        """Count `count` runs of `stage` taking `seconds` in total."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counts[stage] += count
+            self.seconds[stage] += seconds
+
+    def timings(self):
+        """The timings so far as `{stage: (count, seconds)}`, to send elsewhere."""
+        with self._lock:
+            return {
+                stage: (self.counts[stage], self.seconds[stage])
+                for stage in self.counts
+            }
+
+    def add_all(self, timings):
+        """Add the `timings` of another `StageTimers`."""
+        for stage, (count, seconds) in timings.items():
+            self.add(stage, seconds, count)
+
+
+def prometheus_text(timers, cache_stats, job_states):
+    """Everything `/metrics` reports, in Prometheus' text exposition format.
+
+    Parameters
+    ----------
+    timers : StageTimers
+        Timings of the stages.
+    cache_stats : dict
+        `ResultCache.stats()` of the cache of results.
+    job_states : dict
+        Number of jobs in every state.
+    """
+    lines = []
+
+    def metric(name, kind, help, samples):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            labels = ",".join(f'{key}="{label}"' for key, label in labels.items())
+            labels = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}{suffix}{labels} {value}")
+
+    timings = timers.timings()
+    metric(
+        "greedy_sketch_stage_seconds",
+        "summary",
+        "Time spent computing each stage of the animations.",
+        [
+            sample
+            for stage, (count, seconds) in sorted(timings.items())
+            for sample in (
+                ("_count", {"stage": stage}, count),
+                ("_sum", {"stage": stage}, repr(seconds)),
+            )
+        ],
+    )
+    stages = cache_stats["stages"]
+    metric(
+        "greedy_sketch_cache_lookups_total",
+        "counter",
+        "Lookups of each stage in the cache of results, by where they were found.",
+        [
+            ("", {"stage": stage, "result": result}, counts[key])
+            for stage, counts in sorted(stages.items())
+            for result, key in (
+                ("hit", "hits"),
+                ("disk_hit", "disk_hits"),
+                ("miss", "misses"),
+            )
+        ],
+    )
+    metric(
+        "greedy_sketch_cache_bytes",
+        "gauge",
+        "Size of the results cached in memory.",
+        [("", {}, cache_stats["bytes"])],
+    )
+    metric(
+        "greedy_sketch_jobs",
+        "gauge",
+        "Number of jobs kept, by state.",
+        [("", {"state": state}, count) for state, count in sorted(job_states.items())],
+    )
+    return "\n".join(lines) + "\n"